@@ -0,0 +1,160 @@
+"""
+Secciones del panel de analytics del dashboard.
+
+Cada sección se calcula con una sola consulta agrupada y se guarda en la caché por
+separado, bajo una clave que incluye la generación de los modelos que lee (ver
+cache.py): un cambio en esos modelos la recalcula y el TTL de cada sección
+(``ANALYTICS_CACHE_TTL``) es sólo un límite. ``/api/analytics/<seccion>/`` devuelve una
+sección y ``/api/analytics/`` las arma todas leyendo la caché de una vez.
+
+Si una sección falla se informa en ``errores`` (y se registra en el log); nunca se
+reemplaza por datos inventados.
+"""
+import logging
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+
+from .cache import PREFIJO, generacion, versiones
+from .models import Bien, Entrega, EntregaItem, OrdenDeCompra, OrdenDeCompraItem, ResumenEntregas, Rubro, Servicio
+from .stock import VERSION_STOCK
+
+logger = logging.getLogger(__name__)
+
+
+class Seccion:
+    def __init__(self, nombre, calcular, modelos, ttl, versiones=(), diaria=False):
+        self.nombre = nombre
+        self.calcular = calcular
+        self.modelos = modelos
+        self.ttl = ttl
+        # Contadores de versión de datos (cache.data_version) además de los modelos
+        self.versiones = versiones
+        # El resultado depende de la fecha del día además de los datos
+        self.diaria = diaria
+
+    def clave(self):
+        clave = f'{PREFIJO}:analytics:{self.nombre}:{generacion(self.modelos)}:{versiones(self.versiones)}'
+        if self.diaria:
+            clave += f':{date.today().isoformat()}'
+        return clave
+
+    def timeout(self):
+        return getattr(settings, 'ANALYTICS_CACHE_TTL', {}).get(self.nombre, self.ttl)
+
+
+SECCIONES = {}
+
+
+def seccion(nombre, modelos, ttl, versiones=(), diaria=False):
+    """Registra la función que calcula una sección"""
+    def registrar(funcion):
+        SECCIONES[nombre] = Seccion(nombre, funcion, modelos, ttl, versiones, diaria)
+        return funcion
+    return registrar
+
+
+@seccion('stock_por_rubro', (Rubro, Bien, OrdenDeCompraItem, EntregaItem), ttl=5 * 60, versiones=(VERSION_STOCK,))
+def stock_por_rubro():
+    """Stock positivo por rubro (todos los rubros, aunque no tengan stock), de mayor a menor"""
+    filas = (
+        Rubro.objects.annotate(total_stock=Coalesce(Sum(
+            'bien__saldos__stock',
+            filter=Q(bien__saldos__orden_de_compra__isnull=True, bien__saldos__stock__gt=0),
+        ), 0))
+        .order_by('-total_stock', 'nombre')
+        .values_list('nombre', 'total_stock')
+    )
+    return [{'rubro__nombre': nombre, 'total_stock': total} for nombre, total in filas]
+
+
+@seccion('entregas_por_mes', (ResumenEntregas,), ttl=60 * 60)
+def entregas_por_mes(meses=12):
+    """Valor entregado en los últimos ``meses`` meses con entregas, leído del resumen mensual"""
+    filas = list(
+        ResumenEntregas.objects.values('anio', 'mes')
+        .annotate(total=Sum('monto'))
+        .filter(total__gt=0)
+        .order_by('-anio', '-mes')[:meses]
+    )
+    return [{'mes': date(fila['anio'], fila['mes'], 1), 'total': fila['total']} for fila in reversed(filas)]
+
+
+@seccion('servicios_por_estado', (Servicio,), ttl=60 * 60, diaria=True)
+def servicios_por_estado():
+    """Servicios por estado vigente (calculado a partir de fecha_fin, no la columna guardada)"""
+    filas = (
+        Servicio.objects.con_estado_vigente()
+        .values('estado_vigente')
+        .annotate(count=Count('id'))
+        .order_by('estado_vigente')
+    )
+    return [{'estado': fila['estado_vigente'], 'count': fila['count']} for fila in filas]
+
+
+@seccion('top_bienes', (ResumenEntregas, Bien), ttl=60 * 60)
+def top_bienes(cantidad=10):
+    """Bienes más entregados, leídos del resumen mensual"""
+    filas = (
+        ResumenEntregas.objects.values('bien_id', 'bien__nombre')
+        .annotate(total_entregado=Sum('cantidad'))
+        .filter(total_entregado__gt=0)
+        .order_by('-total_entregado', 'bien__nombre')[:cantidad]
+    )
+    return [{'nombre': fila['bien__nombre'], 'total_entregado': fila['total_entregado']} for fila in filas]
+
+
+CONTEOS = (
+    ('total_bienes', Bien),
+    ('total_rubros', Rubro),
+    ('total_ordenes', OrdenDeCompra),
+    ('total_entregas', Entrega),
+    ('total_servicios', Servicio),
+)
+
+
+@seccion('totales', tuple(modelo for _, modelo in CONTEOS) + (ResumenEntregas,), ttl=5 * 60)
+def totales():
+    """Conteos generales y valor total entregado en una sola consulta de subconsultas escalares"""
+    tabla = connection.ops.quote_name
+    columnas = [f'(SELECT COUNT(*) FROM {tabla(modelo._meta.db_table)})' for _, modelo in CONTEOS]
+    columnas.append(
+        f'(SELECT COALESCE(SUM({tabla("monto")}), 0) FROM {tabla(ResumenEntregas._meta.db_table)})'
+    )
+    with connection.cursor() as cur:
+        cur.execute('SELECT ' + ', '.join(columnas))
+        *conteos, valor = cur.fetchone()
+    resultado = {clave: conteo for (clave, _), conteo in zip(CONTEOS, conteos)}
+    resultado['valor_total_entregas'] = float(valor or 0)
+    return resultado
+
+
+def obtener(nombres=None):
+    """Devuelve ``(datos, errores)`` de las secciones pedidas (todas por defecto).
+
+    Las que están en la caché se leen con un solo ``get_many``; las demás se calculan
+    y se guardan. Una sección que falla queda en ``None`` y su mensaje en ``errores``.
+    """
+    secciones = [SECCIONES[nombre] for nombre in (nombres or SECCIONES)]
+    claves = {seccion.nombre: seccion.clave() for seccion in secciones}
+    guardados = cache.get_many(claves.values())
+    datos, errores = {}, {}
+    for seccion in secciones:
+        clave = claves[seccion.nombre]
+        if clave in guardados:
+            datos[seccion.nombre] = guardados[clave]
+            continue
+        try:
+            valor = seccion.calcular()
+        except Exception:
+            logger.exception('Error calculando la sección de analytics %s', seccion.nombre)
+            datos[seccion.nombre] = None
+            errores[seccion.nombre] = f'No se pudo calcular {seccion.nombre}.'
+            continue
+        cache.set(clave, valor, seccion.timeout())
+        datos[seccion.nombre] = valor
+    return datos, errores
@@ -1,207 +1,134 @@
+from datetime import date, datetime, time
+
 from rest_framework import viewsets, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import Rubro, Bien, OrdenDeCompra, OrdenDeCompraItem, Entrega, Servicio, EntregaItem
+from .models import Rubro, Bien, OrdenDeCompra, OrdenDeCompraItem, Entrega, Servicio
+from .condicional import RespuestaCondicionalMixin
+from .stock import VERSION_STOCK
 from .serializers import (
     RubroSerializer, BienSerializer, OrdenDeCompraSerializer,
     EntregaSerializer, ServicioSerializer
 )
 
-class RubroViewSet(viewsets.ModelViewSet):
+class RubroViewSet(RespuestaCondicionalMixin, viewsets.ModelViewSet):
     queryset = Rubro.objects.all()
     serializer_class = RubroSerializer
     permission_classes = [permissions.IsAuthenticated]
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['nombre']
+    modelos_condicionales = (Rubro,)
 
-class BienViewSet(viewsets.ModelViewSet):
-    queryset = Bien.objects.select_related('rubro').all()
+class BienViewSet(RespuestaCondicionalMixin, viewsets.ModelViewSet):
+    queryset = Bien.objects.select_related('rubro').with_stock()
     serializer_class = BienSerializer
     permission_classes = [permissions.IsAuthenticated]
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['rubro', 'nombre']
+    modelos_condicionales = (Bien, Rubro)
+    # El stock sale del saldo materializado
+    versiones_condicionales = (VERSION_STOCK,)
 
-class OrdenDeCompraViewSet(viewsets.ModelViewSet):
+class OrdenDeCompraViewSet(RespuestaCondicionalMixin, viewsets.ModelViewSet):
     queryset = OrdenDeCompra.objects.select_related('rubro').all()
     serializer_class = OrdenDeCompraSerializer
     permission_classes = [permissions.IsAuthenticated]
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['rubro', 'proveedor', 'fecha_inicio', 'fecha_fin']
+    modelos_condicionales = (OrdenDeCompra, Rubro)
 
-class EntregaViewSet(viewsets.ModelViewSet):
+class EntregaViewSet(RespuestaCondicionalMixin, viewsets.ModelViewSet):
     queryset = Entrega.objects.select_related('orden_de_compra').all()
     serializer_class = EntregaSerializer
     permission_classes = [permissions.IsAuthenticated]
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['orden_de_compra', 'area_persona', 'fecha']
+    modelos_condicionales = (Entrega, OrdenDeCompra)
 
-class ServicioViewSet(viewsets.ModelViewSet):
+class ServicioViewSet(RespuestaCondicionalMixin, viewsets.ModelViewSet):
     queryset = Servicio.objects.select_related('rubro').all()
     serializer_class = ServicioSerializer
     permission_classes = [permissions.IsAuthenticated]
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['rubro', 'proveedor', 'estado', 'frecuencia']
+    modelos_condicionales = (Servicio, Rubro)
 
 # Analytics API View
-from django.db.models import Sum, Count
-from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import NotFound
 from rest_framework.views import APIView
+from . import analytics
+from .cache import nombre_modelo
+
+def _recursos_secciones(secciones):
+    nombres = []
+    for seccion in secciones:
+        nombres += [nombre_modelo(modelo) for modelo in seccion.modelos] + list(seccion.versiones)
+    return list(dict.fromkeys(nombres))
+
+
+def _vigente_desde_secciones(secciones):
+    """Comienzo del día de hoy si alguna sección depende de la fecha"""
+    if any(seccion.diaria for seccion in secciones):
+        return datetime.combine(date.today(), time.min).timestamp()
+    return None
+
+
+class AnalyticsAPIView(RespuestaCondicionalMixin, APIView):
+    """Todas las secciones del panel de analytics, armadas desde la caché (ver analytics.py).
 
-class AnalyticsAPIView(APIView):
+    Si alguna sección no se pudo calcular queda en null y el motivo va en ``errores``.
+    """
     permission_classes = [permissions.IsAuthenticated]
-    
+
+    def recursos_condicionales(self):
+        return _recursos_secciones(analytics.SECCIONES.values())
+
+    def vigente_desde(self):
+        return _vigente_desde_secciones(analytics.SECCIONES.values())
+
+    def respuesta_validable(self, response):
+        return response.status_code == 200 and not response.data.get('errores')
+
     def get(self, request):
-        # Datos para gráficos
-        data = {
-            'stock_por_rubro': self.get_stock_por_rubro(),
-            'entregas_por_mes': self.get_entregas_por_mes(),
-            'servicios_por_estado': self.get_servicios_por_estado(),
-            'top_bienes': self.get_top_bienes(),
-            'totales': self.get_totales(),
-        }
-        return Response(data)
-    
+        datos, errores = analytics.obtener()
+        datos['errores'] = errores
+        return Response(datos)
+
+    # Cálculo directo de cada sección, sin caché
     def get_stock_por_rubro(self):
-        # Calcular stock real por rubro usando el mismo método que el reporte
-        try:
-            from django.db.models import Sum
-
-            rubros = Rubro.objects.all().order_by('nombre')
-            stock_por_rubro = []
-
-            for rubro in rubros:
-                bienes = Bien.objects.filter(rubro=rubro)
-                total_stock_rubro = 0
-
-                for bien in bienes:
-                    comprado = OrdenDeCompraItem.objects.filter(bien=bien).aggregate(total=Sum('cantidad'))['total'] or 0
-                    entregado = EntregaItem.objects.filter(bien=bien).aggregate(total=Sum('cantidad'))['total'] or 0
-                    stock = comprado - entregado
-                    if stock > 0:
-                        total_stock_rubro += stock
-
-                if total_stock_rubro > 0:
-                    stock_por_rubro.append({
-                        'rubro__nombre': rubro.nombre,
-                        'total_stock': total_stock_rubro
-                    })
-                else:
-                    # Incluir rubros con stock 0 para mostrar todos
-                    stock_por_rubro.append({
-                        'rubro__nombre': rubro.nombre,
-                        'total_stock': 0
-                    })
-
-            # Ordenar por stock descendente
-            stock_por_rubro.sort(key=lambda x: x['total_stock'], reverse=True)
-            return stock_por_rubro
-        except Exception as e:
-            # Si hay error, devolver lista vacía
-            return []
-    
-    def get_stock_value_por_rubro(self):
-        # Calcular valor del stock por rubro
-        try:
-            from django.db.models import Sum, F, Subquery, OuterRef
-            from django.db.models.functions import Coalesce
-            
-            return list(
-                Bien.objects.annotate(
-                    total_orden=Coalesce(Sum('ordendecompraitem__cantidad'), 0),
-                    total_entrega=Coalesce(Sum('entregaitem__cantidad'), 0),
-                    last_price=Coalesce(
-                        Subquery(
-                            OrdenDeCompraItem.objects.filter(bien=OuterRef('pk')).order_by('-orden_de_compra__fecha_inicio').values('precio_unitario')[:1]
-                        ), 0
-                    )
-                ).annotate(
-                    stock=F('total_orden') - F('total_entrega'),
-                    value=F('stock') * F('last_price')
-                ).filter(value__gt=0).values('rubro__nombre').annotate(
-                    total_value=Sum('value')
-                ).order_by('-total_value')[:10]
-            )
-        except Exception as e:
-            return [{'rubro__nombre': 'Test', 'total_value': 1000}]
-    
+        return analytics.stock_por_rubro()
+
     def get_entregas_por_mes(self):
-        try:
-            from django.db.models.functions import TruncMonth
-            # Usar EntregaItem directamente para calcular el total
-            entregas = list(
-                EntregaItem.objects.annotate(mes=TruncMonth('entrega__fecha'))
-                .values('mes')
-                .annotate(total=Sum('precio_total'))
-                .filter(total__gt=0)
-                .order_by('mes')[:12]
-            )
-            
-            # Si no hay entregas, crear datos de ejemplo basados en entregas existentes
-            if not entregas:
-                entregas_existentes = list(
-                    Entrega.objects.annotate(mes=TruncMonth('fecha'))
-                    .values('mes')
-                    .annotate(count=Count('id'))
-                    .order_by('mes')[:12]
-                )
-                # Convertir a formato esperado
-                entregas = [{'mes': item['mes'], 'total': item['count'] * 1000} for item in entregas_existentes]
-            
-            return entregas
-        except Exception as e:
-            return [{'mes': '2024-12-01', 'total': 1000}]
-    
+        return analytics.entregas_por_mes()
+
     def get_servicios_por_estado(self):
-        try:
-            return list(
-                Servicio.objects.values('estado')
-                .annotate(count=Count('id'))
-                .order_by('estado')
-            )
-        except Exception as e:
-            return [{'estado': 'ACTIVO', 'count': 5}]
-    
+        return analytics.servicios_por_estado()
+
     def get_top_bienes(self):
-        try:
-            return list(
-                Bien.objects.values('nombre')
-                .annotate(total_entregado=Sum('entregaitem__cantidad'))
-                .filter(total_entregado__gt=0)
-                .order_by('-total_entregado')[:10]
-            )
-        except Exception as e:
-            return [{'nombre': 'Test Item', 'total_entregado': 5}]
-    
+        return analytics.top_bienes()
+
     def get_totales(self):
-        try:
-            from django.db.models import Sum, Count
-            
-            total_bienes = Bien.objects.count()
-            total_rubros = Rubro.objects.count()
-            total_ordenes = OrdenDeCompra.objects.count()
-            total_entregas = Entrega.objects.count()
-            total_servicios = Servicio.objects.count()
-            
-            # Valor total de entregas
-            valor_total_entregas = EntregaItem.objects.aggregate(
-                total=Sum('precio_total')
-            )['total'] or 0
-            
-            return {
-                'total_bienes': total_bienes,
-                'total_rubros': total_rubros,
-                'total_ordenes': total_ordenes,
-                'total_entregas': total_entregas,
-                'total_servicios': total_servicios,
-                'valor_total_entregas': float(valor_total_entregas),
-            }
-        except Exception as e:
-            return {
-                'total_bienes': 0,
-                'total_rubros': 0,
-                'total_ordenes': 0,
-                'total_entregas': 0,
-                'total_servicios': 0,
-                'valor_total_entregas': 0,
-            }
\ No newline at end of file
+        return analytics.totales()
+
+
+class AnalyticsSeccionAPIView(RespuestaCondicionalMixin, APIView):
+    """Una sección del panel de analytics con su propia entrada de caché"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def recursos_condicionales(self):
+        seccion = analytics.SECCIONES.get(self.kwargs.get('seccion'))
+        return _recursos_secciones([seccion]) if seccion else []
+
+    def vigente_desde(self):
+        seccion = analytics.SECCIONES.get(self.kwargs.get('seccion'))
+        return _vigente_desde_secciones([seccion]) if seccion else None
+
+    def get(self, request, seccion):
+        if seccion not in analytics.SECCIONES:
+            raise NotFound(f'Sección desconocida: {seccion}')
+        datos, errores = analytics.obtener([seccion])
+        if errores:
+            return Response({'error': errores[seccion]}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response({seccion: datos[seccion]})
@@ -0,0 +1,133 @@
+"""
+Contadores de versión de datos para invalidar cachés derivadas.
+
+Las claves de caché que dependen de compras y entregas incluyen la versión
+vigente; al cambiar los datos se incrementa el contador y las entradas viejas
+dejan de consultarse (expiran solas). Funciona igual con LocMemCache y Redis.
+"""
+import hashlib
+import json
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+PREFIJO = 'inventario'
+
+
+def _clave_version(nombre):
+    return f'{PREFIJO}:version:{nombre}'
+
+
+def _version_inicial():
+    # Si el contador se pierde (reinicio o desalojo) no debe volver a un valor ya usado
+    return time.time_ns()
+
+
+def data_version(nombre):
+    """Versión vigente del conjunto de datos ``nombre``"""
+    return cache.get_or_set(_clave_version(nombre), _version_inicial, timeout=None)
+
+
+def _clave_modificado(nombre):
+    return f'{PREFIJO}:modificado:{nombre}'
+
+
+def bump_data_version(nombre):
+    """Invalida las cachés que dependen de ``nombre`` y anota el momento del cambio"""
+    clave = _clave_version(nombre)
+    cache.set(_clave_modificado(nombre), time.time(), timeout=None)
+    try:
+        return cache.incr(clave)
+    except ValueError:
+        version = _version_inicial()
+        cache.set(clave, version, timeout=None)
+        return version
+
+
+def ultima_modificacion(nombres):
+    """Momento (epoch) del último cambio entre los conjuntos ``nombres``.
+
+    None si alguno no registró cambios desde que arrancó la caché: en ese caso no se
+    sabe cuándo cambió por última vez.
+    """
+    claves = [_clave_modificado(nombre) for nombre in nombres]
+    momentos = cache.get_many(claves)
+    if not claves or len(momentos) < len(claves):
+        return None
+    return max(momentos.values())
+
+
+def clave_versionada(nombre, *partes):
+    """Clave de caché que incluye la versión vigente de ``nombre``"""
+    sufijo = ':'.join(str(parte) for parte in partes)
+    return f'{PREFIJO}:{nombre}:{data_version(nombre)}:{sufijo}'
+
+
+# --- Generación de datos por modelo y caché de reportes ---
+# Cada modelo tiene su propio contador, que incrementan los handlers de post_save /
+# post_delete (ver signals.py). Un reporte guarda su resultado bajo una clave que
+# incluye las generaciones de los modelos que consulta: cualquier alta, cambio o baja
+# en esos modelos hace que la próxima consulta lo recalcule.
+
+CACHE_TIMEOUT_REPORTES = 60 * 60
+_SIN_VALOR = object()
+
+
+def nombre_modelo(modelo):
+    return f'modelo:{modelo._meta.label_lower}'
+
+
+def invalidar_modelo(modelo):
+    """Incrementa la generación de ``modelo`` cuando la transacción en curso confirma"""
+    transaction.on_commit(lambda: bump_data_version(nombre_modelo(modelo)))
+
+
+def generacion(modelos):
+    """Generaciones vigentes de ``modelos`` en una sola consulta a la caché"""
+    return versiones([nombre_modelo(modelo) for modelo in modelos])
+
+
+def versiones(nombres):
+    """Versiones vigentes de los conjuntos de datos ``nombres``, unidas con puntos"""
+    claves = {nombre: _clave_version(nombre) for nombre in nombres}
+    guardadas = cache.get_many(claves.values())
+    partes = []
+    for nombre in nombres:
+        version = guardadas.get(claves[nombre])
+        if version is None:
+            version = data_version(nombre)
+        partes.append(str(version))
+    return '.'.join(partes)
+
+
+def parametros_normalizados(parametros, excluir=('export', 'page')):
+    """Parámetros GET ordenados y sin valores vacíos, para usar en una clave"""
+    normalizados = sorted(
+        (clave, sorted(valor for valor in parametros.getlist(clave) if valor))
+        for clave in parametros
+        if clave not in excluir
+    )
+    return [(clave, valores) for clave, valores in normalizados if valores]
+
+
+def clave_reporte(nombre, parametros, modelos, rubro=None, *partes):
+    firma = hashlib.sha1(
+        json.dumps([parametros_normalizados(parametros), partes], default=str).encode()
+    ).hexdigest()
+    rubro = getattr(rubro, 'pk', rubro) or 'todos'
+    return f'{PREFIJO}:reporte:{nombre}:{generacion(modelos)}:{rubro}:{firma}'
+
+
+def resultado_reporte(nombre, request, modelos, calcular, rubro=None, partes=(), timeout=CACHE_TIMEOUT_REPORTES):
+    """Resultado de ``calcular()`` guardado por (reporte, filtros, rubro, generación de datos).
+
+    ``modelos`` son los modelos que consulta el reporte; ``partes`` agrega a la clave
+    lo que no está en los parámetros GET (por ejemplo, el número de página ya validado).
+    """
+    clave = clave_reporte(nombre, request.GET, modelos, rubro, *partes)
+    resultado = cache.get(clave, _SIN_VALOR)
+    if resultado is _SIN_VALOR:
+        resultado = calcular()
+        cache.set(clave, resultado, timeout)
+    return resultado
@@ -0,0 +1,81 @@
+"""
+GET condicional (ETag / Last-Modified) para las vistas de la API.
+
+La validez de una respuesta se deriva de las generaciones de los modelos que lee y
+de los contadores de versión de datos (ver cache.py), que se leen con una sola
+consulta a la caché. Si el cliente ya tiene la versión vigente (``If-None-Match`` o
+``If-Modified-Since``) se responde 304 antes de ejecutar la acción: no se consulta la
+base ni se serializa nada.
+
+    class BienViewSet(RespuestaCondicionalMixin, viewsets.ModelViewSet):
+        modelos_condicionales = (Bien, Rubro)
+
+Los cambios que no pasan por las señales (``QuerySet.update``, SQL directo) no
+cambian las generaciones, igual que en la caché de reportes.
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.http import http_date
+
+from .cache import nombre_modelo, ultima_modificacion, versiones
+
+
+class RespuestaCondicionalMixin:
+    """Mixin para APIView / ViewSet de DRF que agrega ETag y Last-Modified a los GET"""
+    # Modelos cuyas altas, cambios o bajas cambian la respuesta
+    modelos_condicionales = ()
+    # Contadores de versión de datos (cache.data_version) que también la cambian
+    versiones_condicionales = ()
+
+    def recursos_condicionales(self):
+        """Nombres de los conjuntos de datos de los que depende la respuesta"""
+        return [nombre_modelo(modelo) for modelo in self.modelos_condicionales] + list(self.versiones_condicionales)
+
+    def vigente_desde(self):
+        """Epoch desde el que vale la respuesta aunque los datos no cambien (por ejemplo, si
+        depende de la fecha del día), o None si sólo depende de los datos"""
+        return None
+
+    def validadores(self, request):
+        """(ETag, Last-Modified en segundos o None) de la respuesta vigente"""
+        nombres = self.recursos_condicionales()
+        desde = self.vigente_desde()
+        firma = '|'.join([versiones(nombres), str(desde), request.get_full_path(), request.accepted_renderer.format])
+        etag = quote_etag(hashlib.sha1(firma.encode()).hexdigest())
+        modificado = ultima_modificacion(nombres)
+        if modificado is not None and desde is not None:
+            modificado = max(modificado, desde)
+        return etag, int(modificado) if modificado is not None else None
+
+    def respuesta_validable(self, response):
+        """Si la respuesta puede llevar validadores (por ejemplo, no si informa errores)"""
+        return response.status_code == 200
+
+    def _poner_validadores(self, response):
+        etag, modificado = self.validadores_respuesta
+        response['ETag'] = etag
+        if modificado is not None:
+            response['Last-Modified'] = http_date(modificado)
+        # Que el navegador revalide siempre en lugar de usar una copia vieja
+        patch_cache_control(response, private=True, no_cache=True)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.validadores_respuesta = None
+        if request.method not in ('GET', 'HEAD') or not self.recursos_condicionales():
+            return
+        self.validadores_respuesta = self.validadores(request)
+        etag, modificado = self.validadores_respuesta
+        no_modificado = get_conditional_response(request._request, etag=etag, last_modified=modificado)
+        if no_modificado is not None:
+            self._poner_validadores(no_modificado)
+            # DRF busca el handler después de initial(): la acción no llega a ejecutarse
+            setattr(self, request.method.lower(), lambda *args, **kwargs: no_modificado)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'validadores_respuesta', None) and response.status_code != 304 \
+                and self.respuesta_validable(response):
+            self._poner_validadores(response)
+        return response
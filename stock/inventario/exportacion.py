@@ -0,0 +1,258 @@
+"""
+Exportaciones a planilla que no cargan todo el reporte en memoria.
+
+``respuesta_xlsx`` escribe las filas de a una con openpyxl en modo ``write_only`` sobre
+un archivo temporal, que después se envía con FileResponse en bloques.
+
+``respuesta_xlsx_streaming`` y ``respuesta_csv`` no esperan a tener el archivo completo:
+generan los bytes a medida que leen las filas y los envían con StreamingHttpResponse,
+así el primer bloque sale enseguida y la memoria no crece con la cantidad de filas.
+"""
+import csv
+import re
+import tempfile
+import zipfile
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, datetime, time
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
+from openpyxl.utils.datetime import to_excel
+
+CONTENT_TYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+FILAS_POR_BLOQUE = 500
+
+# --- Progreso ---
+# Quien genera un reporte fuera del request (ver trabajos.py) puede pedir que las
+# exportaciones le avisen cuántas filas llevan leídas, sin que las vistas se enteren.
+
+_avance = ContextVar('inventario_avance_filas', default=None)
+
+
+class _Avance:
+    def __init__(self, funcion):
+        self.funcion = funcion
+        # Se acumula entre tablas: un documento con varias informa el total leído
+        self.filas = 0
+
+    def contar(self, filas):
+        for fila in filas:
+            yield fila
+            self.filas += 1
+            if self.filas % FILAS_POR_BLOQUE == 0:
+                self.funcion(self.filas)
+        self.funcion(self.filas)
+
+
+@contextmanager
+def informar_progreso(funcion):
+    """Mientras dura el bloque, las exportaciones llaman a ``funcion(filas)`` cada
+    ``FILAS_POR_BLOQUE`` filas leídas (y al terminar cada tabla)"""
+    token = _avance.set(_Avance(funcion))
+    try:
+        yield
+    finally:
+        _avance.reset(token)
+
+
+def contar_filas(filas):
+    """``filas`` tal cual, o contadas si hay alguien esperando el progreso"""
+    avance = _avance.get()
+    return filas if avance is None else avance.contar(filas)
+
+
+def escribir_xlsx(archivo, encabezados, filas, hoja='Datos'):
+    """Escribe ``encabezados`` y las ``filas`` (cualquier iterable) en ``archivo``"""
+    libro = Workbook(write_only=True)
+    planilla = libro.create_sheet(title=hoja)
+    planilla.append(list(encabezados))
+    for fila in contar_filas(filas):
+        planilla.append(list(fila))
+    libro.save(archivo)
+
+
+def respuesta_xlsx(nombre_archivo, encabezados, filas, hoja='Datos'):
+    """FileResponse con un XLSX armado fila por fila desde un iterable"""
+    archivo = tempfile.TemporaryFile()
+    escribir_xlsx(archivo, encabezados, filas, hoja=hoja)
+    archivo.seek(0)
+    return FileResponse(archivo, as_attachment=True, filename=nombre_archivo, content_type=CONTENT_TYPE_XLSX)
+
+
+# --- XLSX en streaming ---
+# openpyxl sólo produce el zip al final (``save``), así que para emitir bytes mientras se
+# leen las filas se escribe directamente el paquete mínimo de SpreadsheetML: textos en
+# línea (sin tabla de cadenas compartidas) y dos estilos para fechas.
+
+_XML = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_NS_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_NS_PKG = 'http://schemas.openxmlformats.org/package/2006/relationships'
+
+_CONTENT_TYPES = _XML + (
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+_RELS = _XML + (
+    f'<Relationships xmlns="{_NS_PKG}">'
+    '<Relationship Id="rId1" Target="xl/workbook.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+    '</Relationships>'
+)
+_WORKBOOK_RELS = _XML + (
+    f'<Relationships xmlns="{_NS_PKG}">'
+    '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+    '<Relationship Id="rId2" Target="styles.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles"/>'
+    '</Relationships>'
+)
+# Estilo 1: fecha (dd/mm/yyyy); estilo 2: fecha y hora
+_STYLES = _XML + (
+    f'<styleSheet xmlns="{_NS}">'
+    '<numFmts count="1"><numFmt numFmtId="164" formatCode="dd/mm/yyyy hh:mm"/></numFmts>'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="3">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '</cellXfs><cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+# Caracteres de control que XML 1.0 no admite
+_CARACTERES_INVALIDOS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _workbook(hoja):
+    return _XML + (
+        f'<workbook xmlns="{_NS}" xmlns:r="{_NS_REL}">'
+        f'<sheets><sheet name="{escape(hoja, {chr(34): "&quot;"})}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    )
+
+
+def _celda(referencia, valor):
+    if valor is None or valor == '':
+        return ''
+    if isinstance(valor, bool):
+        return f'<c r="{referencia}" t="b"><v>{int(valor)}</v></c>'
+    if isinstance(valor, (int, float, Decimal)):
+        return f'<c r="{referencia}"><v>{valor}</v></c>'
+    if isinstance(valor, datetime):
+        if timezone.is_aware(valor):
+            valor = timezone.localtime(valor).replace(tzinfo=None)
+        return f'<c r="{referencia}" s="2"><v>{to_excel(valor)}</v></c>'
+    if isinstance(valor, date):
+        return f'<c r="{referencia}" s="1"><v>{to_excel(valor)}</v></c>'
+    if isinstance(valor, time):
+        valor = valor.isoformat()
+    texto = escape(_CARACTERES_INVALIDOS.sub('', str(valor)))
+    return f'<c r="{referencia}" t="inlineStr"><is><t xml:space="preserve">{texto}</t></is></c>'
+
+
+def _fila_xml(numero, letras, valores):
+    celdas = ''.join(_celda(f'{letra}{numero}', valor) for letra, valor in zip(letras, valores))
+    return f'<row r="{numero}">{celdas}</row>'
+
+
+class _Tubo:
+    """Destino de escritura para ZipFile que acumula los bytes hasta que se retiran"""
+
+    def __init__(self):
+        self.partes = []
+        self.posicion = 0
+
+    def write(self, datos):
+        self.partes.append(bytes(datos))
+        self.posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self.posicion
+
+    def flush(self):
+        pass
+
+    def retirar(self):
+        datos = b''.join(self.partes)
+        self.partes = []
+        return datos
+
+
+def iterar_xlsx(encabezados, filas, hoja='Datos', filas_por_bloque=FILAS_POR_BLOQUE):
+    """Genera los bytes de un XLSX a medida que consume ``filas``"""
+    encabezados = list(encabezados)
+    letras = [get_column_letter(indice) for indice in range(1, len(encabezados) + 1)]
+    tubo = _Tubo()
+    with zipfile.ZipFile(tubo, 'w', compression=zipfile.ZIP_DEFLATED) as paquete:
+        for nombre, contenido in (
+            ('[Content_Types].xml', _CONTENT_TYPES),
+            ('_rels/.rels', _RELS),
+            ('xl/workbook.xml', _workbook(hoja)),
+            ('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS),
+            ('xl/styles.xml', _STYLES),
+        ):
+            paquete.writestr(nombre, contenido)
+        yield tubo.retirar()
+
+        with paquete.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as planilla:
+            planilla.write((_XML + f'<worksheet xmlns="{_NS}"><sheetData>').encode())
+            planilla.write(_fila_xml(1, letras, encabezados).encode())
+            bloque = []
+            for numero, fila in enumerate(contar_filas(filas), start=2):
+                bloque.append(_fila_xml(numero, letras, fila))
+                if len(bloque) >= filas_por_bloque:
+                    planilla.write(''.join(bloque).encode())
+                    bloque = []
+                    datos = tubo.retirar()
+                    if datos:
+                        yield datos
+            planilla.write((''.join(bloque) + '</sheetData></worksheet>').encode())
+    yield tubo.retirar()
+
+
+def respuesta_xlsx_streaming(nombre_archivo, encabezados, filas, hoja='Datos'):
+    """StreamingHttpResponse con un XLSX que se genera mientras se leen las filas"""
+    response = StreamingHttpResponse(iterar_xlsx(encabezados, filas, hoja=hoja), content_type=CONTENT_TYPE_XLSX)
+    response['Content-Disposition'] = f'attachment; filename={nombre_archivo}'
+    return response
+
+
+class _Eco:
+    """Pseudo archivo para csv.writer: devuelve la línea en lugar de escribirla"""
+
+    def write(self, valor):
+        return valor
+
+
+def iterar_csv(encabezados, filas):
+    """Líneas CSV (con BOM para que Excel reconozca la codificación)"""
+    escritor = csv.writer(_Eco())
+    yield '\ufeff'
+    yield escritor.writerow(list(encabezados))
+    for fila in contar_filas(filas):
+        yield escritor.writerow(list(fila))
+
+
+def respuesta_csv(nombre_archivo, encabezados, filas):
+    """StreamingHttpResponse con un CSV que se genera mientras se leen las filas"""
+    response = StreamingHttpResponse(iterar_csv(encabezados, filas), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename={nombre_archivo}'
+    return response
@@ -0,0 +1,143 @@
+"""
+Kardex: movimientos de un bien (compras y entregas) en orden cronológico con su saldo.
+
+Las compras se fechan con la fecha de inicio de la orden de compra y las entregas
+con la fecha del remito; en un mismo día las compras van antes que las entregas.
+El saldo acumulado lo calcula la base con una función de ventana (SUM ... OVER).
+
+La paginación es por clave (fecha, tipo, id): cada página trae el cursor firmado
+del último movimiento con su saldo, así la siguiente sólo lee los movimientos
+posteriores y suma desde ese saldo sin recorrer las páginas anteriores.
+"""
+from datetime import date, datetime, timezone as dt_timezone
+
+from django.core import signing
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Entrega, EntregaItem, OrdenDeCompra, OrdenDeCompraItem
+
+INGRESO = 0
+EGRESO = 1
+TIPOS = {INGRESO: 'INGRESO', EGRESO: 'EGRESO'}
+
+SALT_CURSOR = 'inventario.kardex'
+POR_PAGINA = 50
+COLUMNAS = ('fecha', 'tipo', 'movimiento_id', 'cantidad', 'precio_unitario',
+            'orden_id', 'orden_numero', 'entrega_id', 'destino', 'saldo')
+
+
+def _tabla(modelo):
+    return connection.ops.quote_name(modelo._meta.db_table)
+
+
+def _sql_kardex(con_cursor, con_limite):
+    movimientos = f"""
+        SELECT o.fecha_inicio AS fecha, {INGRESO} AS tipo, i.id AS movimiento_id, i.cantidad AS cantidad,
+               i.precio_unitario AS precio_unitario, o.id AS orden_id, o.numero AS orden_numero,
+               NULL AS entrega_id, NULL AS destino
+        FROM {_tabla(OrdenDeCompraItem)} i
+        JOIN {_tabla(OrdenDeCompra)} o ON o.id = i.orden_de_compra_id
+        WHERE i.bien_id = %(bien_id)s
+        UNION ALL
+        SELECT e.fecha, {EGRESO}, i.id, -i.cantidad, i.precio_unitario, o.id, o.numero, e.id, e.area_persona
+        FROM {_tabla(EntregaItem)} i
+        JOIN {_tabla(Entrega)} e ON e.id = i.entrega_id
+        LEFT JOIN {_tabla(OrdenDeCompra)} o ON o.id = i.orden_de_compra_id
+        WHERE i.bien_id = %(bien_id)s
+    """
+    filtro = ''
+    if con_cursor:
+        filtro = """
+        WHERE m.fecha > %(fecha)s
+           OR (m.fecha = %(fecha)s AND (m.tipo > %(tipo)s OR (m.tipo = %(tipo)s AND m.movimiento_id > %(id)s)))
+        """
+    limite = 'LIMIT %(limite)s' if con_limite else ''
+    return f"""
+        SELECT {', '.join('m.' + c for c in COLUMNAS[:-1])},
+               %(saldo_inicial)s + SUM(m.cantidad) OVER (
+                   ORDER BY m.fecha, m.tipo, m.movimiento_id
+                   ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+               ) AS saldo
+        FROM ({movimientos}) m
+        {filtro}
+        ORDER BY m.fecha, m.tipo, m.movimiento_id
+        {limite}
+    """
+
+
+def _fecha_local(valor):
+    """Fecha del movimiento como date (SQLite devuelve texto en las consultas crudas)"""
+    if isinstance(valor, str):
+        valor = parse_datetime(valor) or parse_date(valor)
+    if isinstance(valor, datetime):
+        if timezone.is_naive(valor):
+            valor = timezone.make_aware(valor, dt_timezone.utc)
+        return timezone.localtime(valor).date()
+    return valor
+
+
+def _valor_cursor(valor):
+    return valor.isoformat() if isinstance(valor, (date, datetime)) else valor
+
+
+def _movimiento(fila):
+    movimiento = dict(zip(COLUMNAS, fila))
+    movimiento['fecha_orden'] = movimiento['fecha']
+    movimiento['fecha'] = _fecha_local(movimiento['fecha'])
+    movimiento['tipo_nombre'] = TIPOS[movimiento['tipo']]
+    movimiento['ingreso'] = movimiento['cantidad'] if movimiento['cantidad'] > 0 else 0
+    movimiento['egreso'] = -movimiento['cantidad'] if movimiento['cantidad'] < 0 else 0
+    return movimiento
+
+
+def codificar_cursor(movimiento):
+    return signing.dumps(
+        [_valor_cursor(movimiento['fecha_orden']), movimiento['tipo'], movimiento['movimiento_id'], movimiento['saldo']],
+        salt=SALT_CURSOR,
+    )
+
+
+def decodificar_cursor(cursor):
+    """(fecha, tipo, id, saldo) del cursor; None si falta o no es válido"""
+    if not cursor:
+        return None
+    try:
+        fecha, tipo, movimiento_id, saldo = signing.loads(cursor, salt=SALT_CURSOR)
+    except (signing.BadSignature, ValueError, TypeError):
+        return None
+    return fecha, tipo, movimiento_id, saldo
+
+
+def pagina_kardex(bien_id, cursor=None, por_pagina=POR_PAGINA):
+    """Una página del kardex del bien a partir de ``cursor``.
+
+    Devuelve (movimientos, siguiente_cursor); ``siguiente_cursor`` es None en la
+    última página.
+    """
+    posicion = decodificar_cursor(cursor)
+    parametros = {'bien_id': bien_id, 'saldo_inicial': 0, 'limite': por_pagina + 1}
+    if posicion:
+        fecha, tipo, movimiento_id, saldo = posicion
+        parametros.update({'fecha': fecha, 'tipo': tipo, 'id': movimiento_id, 'saldo_inicial': saldo})
+    with connection.cursor() as cur:
+        cur.execute(_sql_kardex(con_cursor=bool(posicion), con_limite=True), parametros)
+        movimientos = [_movimiento(fila) for fila in cur.fetchall()]
+    siguiente = None
+    if len(movimientos) > por_pagina:
+        movimientos = movimientos[:por_pagina]
+        siguiente = codificar_cursor(movimientos[-1])
+    return movimientos, siguiente
+
+
+def iterar_kardex(bien_id, tamanio_bloque=2000):
+    """Todos los movimientos del bien, leídos de a bloques (para exportar)"""
+    with connection.cursor() as cur:
+        cur.execute(_sql_kardex(con_cursor=False, con_limite=False), {'bien_id': bien_id, 'saldo_inicial': 0})
+        while True:
+            filas = cur.fetchmany(tamanio_bloque)
+            if not filas:
+                break
+            for fila in filas:
+                yield _movimiento(fila)
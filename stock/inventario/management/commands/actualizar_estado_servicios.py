@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from inventario.models import Servicio
+
+
+class Command(BaseCommand):
+    help = 'Actualiza el estado guardado de los servicios según su fecha de finalización (para correr una vez por día)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fecha', help='Fecha de referencia (AAAA-MM-DD, por defecto hoy)')
+
+    def handle(self, *args, **options):
+        fecha = None
+        if options['fecha']:
+            try:
+                fecha = parse_date(options['fecha'])
+            except ValueError:
+                fecha = None
+            if fecha is None:
+                raise CommandError(f'Fecha inválida: {options["fecha"]}')
+
+        cambios = Servicio.objects.actualizar_estados(hoy=fecha)
+        if not cambios:
+            self.stdout.write('No hay servicios con el estado desactualizado.')
+            return
+        detalle = ', '.join(f'{cantidad} a {estado}' for estado, cantidad in cambios.items())
+        self.stdout.write(self.style.SUCCESS(f'Servicios actualizados: {detalle}.'))
@@ -0,0 +1,53 @@
+import io
+import time
+
+from django.core.management.base import BaseCommand
+from inventario.pdf_tablas import DocumentoPDF, tabla_pdf
+
+
+def _filas(cantidad):
+    return ([f'BIEN {numero}', 'RUBRO', numero % 97, f'{numero * 1.5:.2f}'] for numero in range(cantidad))
+
+
+ENCABEZADOS = ['Bien', 'Rubro', 'Cantidad', 'Monto ($)']
+
+
+class Command(BaseCommand):
+    help = 'Mide el tiempo de exportación a PDF de tablas grandes según la cantidad de filas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--filas', type=int, nargs='+', default=[5000, 10000, 20000, 40000],
+                            help='Cantidades de filas a medir')
+        parser.add_argument('--comparar', action='store_true',
+                            help='Mide también una única tabla de reportlab con todas las filas')
+
+    def medir(self, generar):
+        inicio = time.perf_counter()
+        tamanio = generar()
+        return time.perf_counter() - inicio, tamanio
+
+    def por_bloques(self, cantidad):
+        documento = DocumentoPDF('Benchmark')
+        documento.tabla(ENCABEZADOS, _filas(cantidad))
+        return len(documento.escribir().read())
+
+    def tabla_unica(self, cantidad):
+        from reportlab.lib.pagesizes import letter
+        from reportlab.platypus import SimpleDocTemplate
+
+        salida = io.BytesIO()
+        SimpleDocTemplate(salida, pagesize=letter).build([tabla_pdf([ENCABEZADOS] + list(_filas(cantidad)))])
+        return len(salida.getvalue())
+
+    def handle(self, *args, **options):
+        variantes = [('por bloques', self.por_bloques)]
+        if options['comparar']:
+            variantes.append(('tabla única', self.tabla_unica))
+        for nombre, generar in variantes:
+            self.stdout.write(self.style.MIGRATE_HEADING(nombre))
+            for cantidad in options['filas']:
+                segundos, tamanio = self.medir(lambda: generar(cantidad))
+                self.stdout.write(
+                    f'  {cantidad:>7} filas: {segundos:7.2f} s  '
+                    f'{segundos * 1000000 / cantidad:7.1f} µs/fila  {tamanio / 1024:8.0f} KB'
+                )
@@ -0,0 +1,48 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from inventario import remitos_pdf
+
+
+def _fecha(valor):
+    if valor is None:
+        return None
+    try:
+        fecha = parse_date(valor)
+    except ValueError:
+        fecha = None
+    if fecha is None:
+        raise CommandError(f'Fecha inválida: {valor}')
+    return fecha
+
+
+class Command(BaseCommand):
+    help = 'Genera en paralelo los PDF de varios remitos en un ZIP o en un único PDF'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', help='Primera fecha de entrega (AAAA-MM-DD)')
+        parser.add_argument('--hasta', help='Última fecha de entrega (AAAA-MM-DD)')
+        parser.add_argument('--ids', type=int, nargs='+', help='Números de remito')
+        parser.add_argument('--formato', choices=remitos_pdf.FORMATOS_LOTE, default='zip')
+        parser.add_argument('--salida', help='Archivo a generar (por defecto, remitos[_desde][_hasta].zip|pdf)')
+        parser.add_argument('--procesos', type=int, help='Procesos en paralelo (por defecto, REMITOS_PDF_PROCESOS)')
+
+    def handle(self, *args, **options):
+        desde, hasta = _fecha(options['desde']), _fecha(options['hasta'])
+        if not (desde or hasta or options['ids']):
+            raise CommandError('Indicá --desde / --hasta o --ids.')
+        entregas = remitos_pdf.entregas_lote(desde=desde, hasta=hasta, ids=options['ids'])
+        total = entregas.count()
+        if not total:
+            raise CommandError('No hay remitos para los filtros indicados.')
+
+        formato = options['formato']
+        salida = Path(options['salida'] or remitos_pdf.nombre_lote(formato, desde, hasta))
+        with open(salida, 'wb') as archivo:
+            if formato == 'pdf':
+                remitos_pdf.unir_pdf(entregas, archivo, procesos=options['procesos'])
+            else:
+                for bloque in remitos_pdf.iterar_zip(entregas, procesos=options['procesos']):
+                    archivo.write(bloque)
+        self.stdout.write(self.style.SUCCESS(f'{total} remitos generados en {salida}.'))
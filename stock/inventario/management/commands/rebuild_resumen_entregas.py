@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from inventario import resumen_entregas
+
+
+class Command(BaseCommand):
+    help = 'Recalcula el resumen mensual de entregas (ResumenEntregas) e informa las diferencias encontradas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Solo informar diferencias, sin reconstruir')
+        parser.add_argument('--max-diferencias', type=int, default=50, help='Cantidad máxima de diferencias a listar')
+
+    def handle(self, *args, **options):
+        esperado = resumen_entregas.calcular_resumen()
+        diferencias = resumen_entregas.diferencias_resumen(esperado)
+
+        if diferencias:
+            self.stdout.write(self.style.WARNING(f'Se encontraron {len(diferencias)} grupos con diferencias:'))
+            for (anio, mes, bien_id, area, orden_id), actual, correcto in diferencias[:options['max_diferencias']]:
+                destino = f'{mes:02d}/{anio} bien={bien_id} área={area}' + (f' orden={orden_id}' if orden_id else '')
+                if actual is None:
+                    self.stdout.write(f'  {destino}: falta la fila (cantidad esperada {correcto["cantidad"]})')
+                elif correcto is None:
+                    self.stdout.write(f'  {destino}: fila sobrante (cantidad {actual["cantidad"]})')
+                else:
+                    self.stdout.write(f'  {destino}: cantidad {actual["cantidad"]} -> {correcto["cantidad"]}')
+            if len(diferencias) > options['max_diferencias']:
+                self.stdout.write(f'  ... y {len(diferencias) - options["max_diferencias"]} más')
+        else:
+            self.stdout.write('El resumen de entregas está al día.')
+
+        if options['check']:
+            return
+
+        total = resumen_entregas.reconstruir_resumen(esperado)
+        self.stdout.write(self.style.SUCCESS(f'Resumen de entregas reconstruido: {total} filas.'))
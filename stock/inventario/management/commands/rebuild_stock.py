@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from inventario import stock
+
+
+class Command(BaseCommand):
+    help = 'Recalcula el saldo materializado de stock (StockBalance) e informa las diferencias encontradas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Solo informar diferencias, sin reconstruir')
+        parser.add_argument('--max-diferencias', type=int, default=50, help='Cantidad máxima de diferencias a listar')
+
+    def handle(self, *args, **options):
+        esperado = stock.calcular_saldos()
+        diferencias = stock.diferencias_saldos(esperado)
+
+        if diferencias:
+            self.stdout.write(self.style.WARNING(f'Se encontraron {len(diferencias)} saldos con diferencias:'))
+            for (bien_id, orden_id), actual, correcto in diferencias[:options['max_diferencias']]:
+                destino = f'bien={bien_id}' + (f' orden={orden_id}' if orden_id else '')
+                if actual is None:
+                    self.stdout.write(f'  {destino}: falta la fila (stock esperado {correcto["stock"]})')
+                elif correcto is None:
+                    self.stdout.write(f'  {destino}: fila sobrante (stock {actual["stock"]})')
+                else:
+                    self.stdout.write(f'  {destino}: stock {actual["stock"]} -> {correcto["stock"]}')
+            if len(diferencias) > options['max_diferencias']:
+                self.stdout.write(f'  ... y {len(diferencias) - options["max_diferencias"]} más')
+        else:
+            self.stdout.write('El saldo de stock está al día.')
+
+        if options['check']:
+            return
+
+        total = stock.reconstruir_saldos(esperado)
+        self.stdout.write(self.style.SUCCESS(f'Saldo de stock reconstruido: {total} filas.'))
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+from inventario import trabajos
+
+
+class Command(BaseCommand):
+    help = 'Procesa los reportes pedidos en segundo plano y borra los archivos vencidos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--una-vez', action='store_true',
+                            help='Procesa los pedidos pendientes y termina (para cron)')
+        parser.add_argument('--intervalo', type=float, default=5,
+                            help='Segundos de espera cuando no hay pedidos (por defecto 5)')
+
+    def handle(self, *args, **options):
+        procesados = 0
+        while True:
+            borrados = trabajos.limpiar_vencidos()
+            if borrados:
+                self.stdout.write(f'{borrados} reportes vencidos borrados.')
+            colgados = trabajos.recuperar_colgados()
+            if colgados:
+                self.stderr.write(self.style.ERROR(f'{colgados} reportes interrumpidos marcados con error.'))
+            job = trabajos.tomar_siguiente()
+            if job is None:
+                if options['una_vez']:
+                    break
+                time.sleep(options['intervalo'])
+                continue
+            trabajos.ejecutar(job)
+            procesados += 1
+            if job.estado == 'ERROR':
+                self.stderr.write(self.style.ERROR(f'Reporte {job.pk} ({job.reporte}): {job.error}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'Reporte {job.pk} ({job.reporte}) generado: {job.nombre_archivo}'))
+        self.stdout.write(f'{procesados} reportes procesados.')
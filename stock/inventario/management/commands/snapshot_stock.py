@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from inventario import snapshots
+
+
+class Command(BaseCommand):
+    help = 'Guarda la foto de stock por bien al cierre de un período (por defecto, el último día del mes anterior)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fecha', help='Fecha de cierre (AAAA-MM-DD)')
+
+    def handle(self, *args, **options):
+        if options['fecha']:
+            try:
+                fecha = parse_date(options['fecha'])
+            except ValueError:
+                fecha = None
+            if fecha is None:
+                raise CommandError(f'Fecha inválida: {options["fecha"]}')
+        else:
+            fecha = snapshots.cierre_mes_anterior()
+
+        total = snapshots.generar_foto(fecha)
+        self.stdout.write(self.style.SUCCESS(f'Foto de stock al {fecha:%d/%m/%Y} guardada: {total} bienes.'))
@@ -0,0 +1,153 @@
+"""
+Métricas por request: consultas SQL, tiempo de base y tiempo total.
+
+``MetricasMiddleware`` (activado con ``REQUEST_METRICS_ENABLED``) mide cada request
+con un ``execute_wrapper`` sobre las conexiones y deja:
+
+* una línea de log estructurada (JSON) en el logger ``inventario.metricas`` con la
+  cantidad de consultas, el tiempo de base, las ``REQUEST_METRICS_SLOW_QUERIES``
+  consultas más lentas y las consultas repetidas (misma huella, típico N+1);
+* para usuarios staff, un encabezado ``Server-Timing`` que el navegador muestra en
+  la pestaña de red;
+* histogramas por vista de latencia y de cantidad de consultas, que ``/metrics``
+  expone en el formato de texto de Prometheus.
+
+Los histogramas se acumulan en memoria del proceso: con varios procesos cada uno
+expone los suyos. En respuestas en streaming se mide hasta que la vista devuelve la
+respuesta, no hasta que termina de enviarse.
+"""
+import hashlib
+import re
+import threading
+import time
+from collections import defaultdict
+
+# Límites de los histogramas (segundos y cantidad de consultas)
+LIMITES_DURACION = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LIMITES_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+LARGO_SQL = 300
+
+_LISTA_PARAMETROS = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+_LITERALES = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_ESPACIOS = re.compile(r'\s+')
+
+
+def normalizar_sql(sql):
+    """SQL sin valores: las listas IN de cualquier largo y los literales quedan iguales"""
+    sql = _LISTA_PARAMETROS.sub('(%s, ...)', sql)
+    sql = _LITERALES.sub('?', sql)
+    return _ESPACIOS.sub(' ', sql).strip()
+
+
+def huella_sql(sql):
+    return hashlib.sha1(normalizar_sql(sql).encode()).hexdigest()[:12]
+
+
+class RegistroConsultas:
+    """``execute_wrapper`` que anota el SQL y la duración de cada consulta"""
+
+    def __init__(self):
+        self.consultas = []
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.consultas.append((sql, time.perf_counter() - inicio))
+
+    @property
+    def tiempo_total(self):
+        return sum(duracion for _, duracion in self.consultas)
+
+    @property
+    def repeticiones(self):
+        """Consultas que repiten la huella de una anterior"""
+        return len(self.consultas) - len({huella_sql(sql) for sql, _ in self.consultas})
+
+    def mas_lentas(self, cantidad):
+        lentas = sorted(self.consultas, key=lambda consulta: consulta[1], reverse=True)[:cantidad]
+        return [{'sql': sql[:LARGO_SQL], 'ms': round(duracion * 1000, 2)} for sql, duracion in lentas]
+
+    def repetidas(self, cantidad):
+        """Huellas que se ejecutaron más de una vez, de la más repetida a la menos"""
+        grupos = defaultdict(lambda: [0, 0.0, ''])
+        for sql, duracion in self.consultas:
+            grupo = grupos[huella_sql(sql)]
+            grupo[0] += 1
+            grupo[1] += duracion
+            grupo[2] = grupo[2] or sql
+        repetidas = sorted(
+            ((huella, *grupo) for huella, grupo in grupos.items() if grupo[0] > 1),
+            key=lambda grupo: (grupo[1], grupo[2]), reverse=True,
+        )[:cantidad]
+        return [
+            {'huella': huella, 'veces': veces, 'ms': round(duracion * 1000, 2), 'sql': sql[:LARGO_SQL]}
+            for huella, veces, duracion, sql in repetidas
+        ]
+
+
+class Histograma:
+    """Histograma de Prometheus con una etiqueta (la vista)"""
+
+    def __init__(self, nombre, ayuda, limites):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.limites = tuple(limites)
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, etiqueta, valor):
+        with self._lock:
+            serie = self.series.get(etiqueta)
+            if serie is None:
+                serie = self.series[etiqueta] = {'cubetas': [0] * len(self.limites), 'suma': 0, 'cantidad': 0}
+            for indice, limite in enumerate(self.limites):
+                if valor <= limite:
+                    serie['cubetas'][indice] += 1
+            serie['suma'] += valor
+            serie['cantidad'] += 1
+
+    def limpiar(self):
+        with self._lock:
+            self.series = {}
+
+    def lineas(self, nombre_etiqueta='view'):
+        yield f'# HELP {self.nombre} {self.ayuda}'
+        yield f'# TYPE {self.nombre} histogram'
+        with self._lock:
+            series = sorted((etiqueta, dict(serie, cubetas=list(serie['cubetas']))) for etiqueta, serie in self.series.items())
+        for etiqueta, serie in series:
+            etiqueta = _escapar(etiqueta)
+            for limite, acumulado in zip(self.limites, serie['cubetas']):
+                yield f'{self.nombre}_bucket{{{nombre_etiqueta}="{etiqueta}",le="{limite}"}} {acumulado}'
+            yield f'{self.nombre}_bucket{{{nombre_etiqueta}="{etiqueta}",le="+Inf"}} {serie["cantidad"]}'
+            yield f'{self.nombre}_sum{{{nombre_etiqueta}="{etiqueta}"}} {serie["suma"]}'
+            yield f'{self.nombre}_count{{{nombre_etiqueta}="{etiqueta}"}} {serie["cantidad"]}'
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+DURACION = Histograma(
+    'inventario_request_duration_seconds', 'Duración de los requests por vista.', LIMITES_DURACION,
+)
+CONSULTAS = Histograma(
+    'inventario_request_queries', 'Consultas SQL por request y vista.', LIMITES_CONSULTAS,
+)
+TIEMPO_DB = Histograma(
+    'inventario_request_db_seconds', 'Tiempo en la base de datos por request y vista.', LIMITES_DURACION,
+)
+HISTOGRAMAS = (DURACION, CONSULTAS, TIEMPO_DB)
+
+
+def registrar(vista, duracion, consultas, tiempo_db):
+    DURACION.observar(vista, duracion)
+    CONSULTAS.observar(vista, consultas)
+    TIEMPO_DB.observar(vista, tiempo_db)
+
+
+def exposicion():
+    """Texto de todas las métricas en el formato de exposición de Prometheus"""
+    return '\n'.join(linea for histograma in HISTOGRAMAS for linea in histograma.lineas()) + '\n'
@@ -0,0 +1,66 @@
+import json
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .. import metricas
+
+logger = logging.getLogger('inventario.metricas')
+
+
+def _nombre_vista(request):
+    coincidencia = getattr(request, 'resolver_match', None)
+    if coincidencia is None:
+        return 'sin_ruta'
+    return coincidencia.view_name or coincidencia._func_path
+
+
+class MetricasMiddleware:
+    """Mide consultas SQL y tiempos de cada request (ver ``inventario.metricas``).
+
+    Conviene ponerlo primero en MIDDLEWARE para que el tiempo total incluya a los demás.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_METRICS_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.cantidad = getattr(settings, 'REQUEST_METRICS_SLOW_QUERIES', 5)
+
+    def __call__(self, request):
+        registro = metricas.RegistroConsultas()
+        inicio = time.perf_counter()
+        with ExitStack() as pila:
+            for conexion in connections.all():
+                pila.enter_context(conexion.execute_wrapper(registro))
+            response = self.get_response(request)
+        duracion = time.perf_counter() - inicio
+
+        vista = _nombre_vista(request)
+        tiempo_db = registro.tiempo_total
+        metricas.registrar(vista, duracion, len(registro.consultas), tiempo_db)
+        logger.info(json.dumps({
+            'metodo': request.method,
+            'ruta': request.path,
+            'vista': vista,
+            'estado': response.status_code,
+            'streaming': response.streaming,
+            'duracion_ms': round(duracion * 1000, 2),
+            'consultas': len(registro.consultas),
+            'tiempo_db_ms': round(tiempo_db * 1000, 2),
+            'lentas': registro.mas_lentas(self.cantidad),
+            'repetidas': registro.repetidas(self.cantidad),
+        }, ensure_ascii=False))
+
+        usuario = getattr(request, 'user', None)
+        if usuario is not None and usuario.is_staff:
+            response['Server-Timing'] = (
+                f'total;dur={duracion * 1000:.1f}, '
+                f'db;dur={tiempo_db * 1000:.1f};desc="{len(registro.consultas)} consultas, '
+                f'{registro.repeticiones} repetidas"'
+            )
+        return response
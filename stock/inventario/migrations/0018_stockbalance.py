@@ -0,0 +1,75 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def poblar_saldos(apps, schema_editor):
+    """Carga inicial del saldo a partir de las compras y entregas existentes"""
+    Bien = apps.get_model('inventario', 'Bien')
+    OrdenDeCompraItem = apps.get_model('inventario', 'OrdenDeCompraItem')
+    EntregaItem = apps.get_model('inventario', 'EntregaItem')
+    StockBalance = apps.get_model('inventario', 'StockBalance')
+
+    saldos = {}
+
+    def fila(bien_id, orden_id):
+        return saldos.setdefault((bien_id, orden_id), {
+            'comprado': 0, 'entregado': 0, 'valor_comprado': 0, 'valor_entregado': 0,
+        })
+
+    for bien_id in Bien.objects.values_list('id', flat=True):
+        fila(bien_id, None)
+    grupos = (
+        (OrdenDeCompraItem.objects.values('bien_id'), 'comprado', False),
+        (OrdenDeCompraItem.objects.values('bien_id', 'orden_de_compra_id'), 'comprado', True),
+        (EntregaItem.objects.values('bien_id'), 'entregado', False),
+        (EntregaItem.objects.filter(orden_de_compra__isnull=False).values('bien_id', 'orden_de_compra_id'), 'entregado', True),
+    )
+    for qs, campo, por_orden in grupos:
+        for row in qs.order_by().annotate(cantidad=Sum('cantidad'), valor=Sum('precio_total')):
+            valores = fila(row['bien_id'], row['orden_de_compra_id'] if por_orden else None)
+            valores[campo] = row['cantidad'] or 0
+            valores['valor_' + campo] = row['valor'] or 0
+
+    StockBalance.objects.bulk_create(
+        [
+            StockBalance(
+                bien_id=bien_id, orden_de_compra_id=orden_id,
+                stock=valores['comprado'] - valores['entregado'], **valores
+            )
+            for (bien_id, orden_id), valores in saldos.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0017_servicio_expediente_contratacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('comprado', models.IntegerField(default=0)),
+                ('entregado', models.IntegerField(default=0)),
+                ('stock', models.IntegerField(default=0)),
+                ('valor_comprado', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('valor_entregado', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('bien', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saldos', to='inventario.bien')),
+                ('orden_de_compra', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='saldos', to='inventario.ordendecompra')),
+            ],
+            options={
+                'verbose_name': 'Saldo de stock',
+                'verbose_name_plural': 'Saldos de stock',
+                'indexes': [models.Index(fields=['stock'], name='stockbalance_stock_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('orden_de_compra__isnull', True)), fields=('bien',), name='stockbalance_unico_por_bien'), models.UniqueConstraint(condition=models.Q(('orden_de_compra__isnull', False)), fields=('orden_de_compra', 'bien'), name='stockbalance_unico_por_orden_bien')],
+            },
+        ),
+        migrations.RunPython(poblar_saldos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0018_stockbalance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(verbose_name='Fecha de cierre')),
+                ('comprado', models.IntegerField(default=0)),
+                ('entregado', models.IntegerField(default=0)),
+                ('stock', models.IntegerField(default=0)),
+                ('valor_comprado', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('valor_entregado', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('bien', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='inventario.bien')),
+            ],
+            options={
+                'verbose_name': 'Foto de stock',
+                'verbose_name_plural': 'Fotos de stock',
+                'constraints': [models.UniqueConstraint(fields=('fecha', 'bien'), name='stocksnapshot_unico_por_fecha_bien')],
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0019_stocksnapshot'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reporte', models.CharField(max_length=50, verbose_name='Reporte')),
+                ('formato', models.CharField(default='pdf', max_length=10, verbose_name='Formato')),
+                ('consulta', models.TextField(blank=True, verbose_name='Parámetros del reporte')),
+                ('filas_estimadas', models.PositiveIntegerField(default=0)),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('PROCESANDO', 'Procesando'), ('TERMINADO', 'Terminado'), ('ERROR', 'Error')], default='PENDIENTE', max_length=15, verbose_name='Estado')),
+                ('progreso', models.PositiveSmallIntegerField(default=0, verbose_name='Progreso (%)')),
+                ('archivo', models.CharField(blank=True, max_length=255, verbose_name='Ruta del archivo generado')),
+                ('nombre_archivo', models.CharField(blank=True, max_length=255, verbose_name='Nombre de descarga')),
+                ('error', models.TextField(blank=True)),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('iniciado', models.DateTimeField(blank=True, null=True)),
+                ('terminado', models.DateTimeField(blank=True, null=True)),
+                ('expira', models.DateTimeField(blank=True, null=True, verbose_name='Vencimiento del archivo')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='report_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Usuario')),
+            ],
+            options={
+                'verbose_name': 'Reporte en segundo plano',
+                'verbose_name_plural': 'Reportes en segundo plano',
+                'ordering': ['-creado'],
+                'indexes': [models.Index(fields=['estado', 'creado'], name='reportjob_estado_creado'), models.Index(fields=['expira'], name='reportjob_expira')],
+            },
+        ),
+    ]
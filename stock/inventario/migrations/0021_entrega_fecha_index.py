@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0020_reportjob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='entrega',
+            name='fecha',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+
+def poblar_resumen(apps, schema_editor):
+    """Carga inicial del resumen a partir de las entregas existentes"""
+    EntregaItem = apps.get_model('inventario', 'EntregaItem')
+    ResumenEntregas = apps.get_model('inventario', 'ResumenEntregas')
+
+    filas = (
+        EntregaItem.objects.order_by()
+        .values(
+            anio=ExtractYear('entrega__fecha'), mes=ExtractMonth('entrega__fecha'),
+            bien_ref=F('bien_id'), area=F('entrega__area_persona'), orden=F('orden_de_compra_id'),
+        )
+        .annotate(lineas=Count('id'), suma_cantidad=Sum('cantidad'), suma_monto=Sum('precio_total'))
+    )
+    ResumenEntregas.objects.bulk_create(
+        (
+            ResumenEntregas(
+                anio=fila['anio'], mes=fila['mes'], bien_id=fila['bien_ref'], area_persona=fila['area'],
+                orden_de_compra_id=fila['orden'], lineas=fila['lineas'],
+                cantidad=fila['suma_cantidad'] or 0, monto=fila['suma_monto'] or 0,
+            )
+            for fila in filas
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0021_entrega_fecha_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenEntregas',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('anio', models.PositiveSmallIntegerField(verbose_name='Año')),
+                ('mes', models.PositiveSmallIntegerField(verbose_name='Mes')),
+                ('area_persona', models.CharField(max_length=100)),
+                ('lineas', models.IntegerField(default=0, verbose_name='Ítems entregados')),
+                ('cantidad', models.IntegerField(default=0)),
+                ('monto', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('bien', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumen_entregas', to='inventario.bien')),
+                ('orden_de_compra', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='resumen_entregas', to='inventario.ordendecompra')),
+            ],
+            options={
+                'verbose_name': 'Resumen mensual de entregas',
+                'verbose_name_plural': 'Resúmenes mensuales de entregas',
+                'constraints': [models.UniqueConstraint(condition=models.Q(('orden_de_compra__isnull', True)), fields=('anio', 'mes', 'bien', 'area_persona'), name='resumenentregas_unico_sin_orden'), models.UniqueConstraint(condition=models.Q(('orden_de_compra__isnull', False)), fields=('anio', 'mes', 'bien', 'area_persona', 'orden_de_compra'), name='resumenentregas_unico_con_orden')],
+            },
+        ),
+        migrations.RunPython(poblar_resumen, migrations.RunPython.noop),
+    ]
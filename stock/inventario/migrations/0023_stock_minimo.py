@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0022_resumenentregas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bien',
+            name='stock_minimo',
+            field=models.PositiveIntegerField(blank=True, help_text='Umbral de stock bajo; vacío para usar el del rubro', null=True, verbose_name='Stock mínimo'),
+        ),
+        migrations.AddField(
+            model_name='rubro',
+            name='stock_minimo',
+            field=models.PositiveIntegerField(blank=True, help_text='Umbral de stock bajo de los bienes del rubro que no tienen uno propio', null=True, verbose_name='Stock mínimo'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0023_stock_minimo'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ordendecompra',
+            name='fecha_fin',
+            field=models.DateField(blank=True, db_index=True, null=True, verbose_name='Fecha de finalización'),
+        ),
+        migrations.AlterField(
+            model_name='servicio',
+            name='fecha_fin',
+            field=models.DateField(blank=True, db_index=True, null=True, verbose_name='Fecha de finalización'),
+        ),
+    ]
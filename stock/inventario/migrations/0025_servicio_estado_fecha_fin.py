@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0024_fecha_fin_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='servicio',
+            index=models.Index(fields=['estado', 'fecha_fin'], name='servicio_estado_fecha_fin'),
+        ),
+    ]
@@ -1,8 +1,11 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import DecimalField, F, Func, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, NullIf
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.utils import timezone
+from datetime import date, timedelta
 from decimal import Decimal
 
 class AuditLog(models.Model):
@@ -35,18 +38,65 @@ class AuditLog(models.Model):
 
 class Rubro(models.Model):
     nombre = models.CharField(max_length=100, unique=True)
+    stock_minimo = models.PositiveIntegerField(
+        null=True, blank=True, verbose_name="Stock mínimo",
+        help_text="Umbral de stock bajo de los bienes del rubro que no tienen uno propio",
+    )
 
     def __str__(self):
         return self.nombre
 
+class DiasHasta(Func):
+    """Días enteros desde ``desde`` hasta la fecha ``fecha`` (negativo si ya pasó).
+
+    En PostgreSQL la resta de dos DATE ya es un entero; SQLite no tiene tipo fecha
+    y se resta con julianday.
+    """
+    arg_joiner = ' - '
+    template = '(%(expressions)s)'
+    arity = 2
+    output_field = IntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template='CAST(julianday(%(expressions)s) AS INTEGER)', arg_joiner=') - julianday(',
+            **extra_context,
+        )
+
+
+class VencimientoQuerySet(models.QuerySet):
+    """Consultas por ``fecha_fin`` para modelos que vencen (órdenes de compra y servicios)"""
+
+    def con_dias_restantes(self, hoy=None):
+        """Anota ``dias_restantes`` hasta ``fecha_fin`` (None si no tiene)"""
+        hoy = hoy or date.today()
+        return self.annotate(dias_restantes=DiasHasta(F('fecha_fin'), Value(hoy, output_field=models.DateField())))
+
+    def por_vencer(self, dias, hoy=None):
+        """Los que vencen dentro de ``dias`` días o ya vencieron, del más próximo al más lejano.
+
+        Filtra por rango sobre ``fecha_fin`` (indexado): el costo depende de cuántos
+        resultados hay y no del tamaño de la tabla.
+        """
+        hoy = hoy or date.today()
+        return (
+            self.filter(fecha_fin__lte=hoy + timedelta(days=dias))
+            .con_dias_restantes(hoy)
+            .order_by('fecha_fin', 'pk')
+        )
+
+
 class OrdenDeCompra(models.Model):
 
     numero = models.CharField(max_length=50, unique=True)
     fecha_inicio = models.DateField(verbose_name="Fecha de inicio")
-    fecha_fin = models.DateField(verbose_name="Fecha de finalización", null=True, blank=True)
+    fecha_fin = models.DateField(verbose_name="Fecha de finalización", null=True, blank=True, db_index=True)
     proveedor = models.CharField(max_length=100, blank=True)
     rubro = models.ForeignKey(Rubro, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Rubro principal")
 
+    objects = VencimientoQuerySet.as_manager()
+
     def save(self, *args, **kwargs):
         if self.numero:
             self.numero = self.numero.upper()
@@ -76,12 +126,91 @@ class OrdenDeCompraItem(models.Model):
     def __str__(self):
         return f"{self.bien} x {self.cantidad} (OC: {self.orden_de_compra})"
 
+def _suma_por_bien(modelo, campo, output_field):
+    """Subconsulta correlacionada con la suma de ``campo`` de ``modelo`` para el bien externo"""
+    return Coalesce(
+        Subquery(
+            modelo.objects.filter(bien=OuterRef('pk'))
+            .order_by()
+            .values('bien')
+            .annotate(total=Sum(campo))
+            .values('total'),
+            output_field=output_field,
+        ),
+        Value(0),
+        output_field=output_field,
+    )
+
+
+class DivisionDecimal(Func):
+    """``numerador / denominador`` con resultado decimal.
+
+    En SQLite dos valores NUMERIC enteros se dividen como enteros; multiplicar por
+    1.0 dentro de la misma expresión conserva los decimales (en PostgreSQL no cambia nada).
+    """
+    arg_joiner = ' * 1.0 / '
+    template = '(%(expressions)s)'
+    arity = 2
+
+
+class BienQuerySet(models.QuerySet):
+    """Consultas de stock sobre Bien.
+
+    Cada total se calcula con una subconsulta independiente en lugar de unir
+    compras y entregas en la misma consulta: el doble JOIN multiplica filas e infla
+    las sumas, y su costo crece con el historial en vez de con la página pedida.
+    """
+
+    def with_stock(self):
+        """Anota ``comprado``, ``entregado`` y ``stock``"""
+        if 'stock' in self.query.annotations:
+            return self
+        return self.annotate(
+            comprado=_suma_por_bien(OrdenDeCompraItem, 'cantidad', IntegerField()),
+            entregado=_suma_por_bien(EntregaItem, 'cantidad', IntegerField()),
+        ).annotate(stock=F('comprado') - F('entregado'))
+
+    def with_valuation(self):
+        """Anota además ``valor_comprado``, ``valor_entregado``, ``precio_promedio`` y ``valor_stock``"""
+        monto = DecimalField(max_digits=16, decimal_places=2)
+        qs = self.with_stock().annotate(
+            valor_comprado=_suma_por_bien(OrdenDeCompraItem, 'precio_total', monto),
+            valor_entregado=_suma_por_bien(EntregaItem, 'precio_total', monto),
+        )
+        return qs.annotate(
+            precio_promedio=Coalesce(
+                DivisionDecimal(
+                    F('valor_comprado'), NullIf(F('comprado'), 0),
+                    output_field=DecimalField(max_digits=16, decimal_places=4),
+                ),
+                Value(Decimal('0')),
+            ),
+            valor_stock=Coalesce(
+                DivisionDecimal(
+                    F('stock') * F('valor_comprado'), NullIf(F('comprado'), 0),
+                    output_field=monto,
+                ),
+                Value(Decimal('0')),
+            ),
+        )
+
+    def low_stock(self, threshold=10):
+        """Bienes con stock menor o igual a ``threshold``, del menor al mayor"""
+        return self.with_stock().filter(stock__lte=threshold).order_by('stock', 'nombre')
+
+
 class Bien(models.Model):
     rubro = models.ForeignKey(Rubro, on_delete=models.SET_NULL, null=True)
     nombre = models.CharField(max_length=100)
     catalogo = models.CharField(max_length=100, blank=True)
     renglon = models.CharField(max_length=50, blank=True)
     imagen = models.BinaryField(null=True, blank=True, editable=True)  # Campo para almacenar la imagen como blob
+    stock_minimo = models.PositiveIntegerField(
+        null=True, blank=True, verbose_name="Stock mínimo",
+        help_text="Umbral de stock bajo; vacío para usar el del rubro",
+    )
+
+    objects = BienQuerySet.as_manager()
 
     def save(self, *args, **kwargs):
         if self.nombre:
@@ -95,6 +224,62 @@ class Bien(models.Model):
     def __str__(self):
         return self.nombre
 
+# Un servicio pasa a "por vencer" cuando le quedan estos días o menos
+DIAS_POR_VENCER = 60
+
+
+def condiciones_estado_servicio(hoy=None):
+    """Condición (Q) de cada estado calculado de Servicio a la fecha ``hoy``, en orden de prioridad.
+
+    Se comparan fechas en lugar de restar días para que la base pueda usar los
+    índices de ``estado`` y ``fecha_fin``. Es la misma regla que ``Servicio.estado_actual``.
+    """
+    hoy = hoy or date.today()
+    vigente = ~models.Q(estado='SUSPENDIDO')
+    return (
+        ('SUSPENDIDO', models.Q(estado='SUSPENDIDO')),
+        ('VENCIDO', vigente & models.Q(fecha_fin__lt=hoy)),
+        ('POR_VENCER', vigente & models.Q(fecha_fin__gte=hoy, fecha_fin__lte=hoy + timedelta(days=DIAS_POR_VENCER))),
+        ('ACTIVO', vigente & (models.Q(fecha_fin__isnull=True) | models.Q(fecha_fin__gt=hoy + timedelta(days=DIAS_POR_VENCER)))),
+    )
+
+
+class ServicioQuerySet(VencimientoQuerySet):
+
+    def con_estado_vigente(self, hoy=None):
+        """Anota ``estado_vigente``: el estado según ``fecha_fin``, calculado en la consulta.
+
+        A diferencia de la columna ``estado`` (que actualiza el comando
+        ``actualizar_estado_servicios``) no queda desactualizado, y se puede filtrar y
+        agrupar por él.
+        """
+        return self.annotate(estado_vigente=models.Case(
+            *(models.When(condicion, then=models.Value(estado)) for estado, condicion in condiciones_estado_servicio(hoy)),
+            default=models.Value('ACTIVO'),
+            output_field=models.CharField(max_length=15),
+        ))
+
+    def actualizar_estados(self, hoy=None):
+        """Guarda en ``estado`` el estado vigente, con un UPDATE por cada estado de destino.
+
+        Los servicios suspendidos no se tocan. Devuelve ``{estado: cantidad}`` de los que
+        cambiaron. Como ``update()`` no dispara señales, se invalida a mano la generación
+        de Servicio para las cachés de reportes.
+        """
+        from .cache import invalidar_modelo
+        cambios = {}
+        with transaction.atomic():
+            for estado, condicion in condiciones_estado_servicio(hoy):
+                if estado == 'SUSPENDIDO':
+                    continue
+                cantidad = self.filter(condicion).exclude(estado=estado).update(estado=estado)
+                if cantidad:
+                    cambios[estado] = cantidad
+            if cambios:
+                invalidar_modelo(self.model)
+        return cambios
+
+
 class Servicio(models.Model):
     FRECUENCIA_CHOICES = [
         ('SEMANAL', 'Semanal'),
@@ -115,12 +300,19 @@ class Servicio(models.Model):
     frecuencia = models.CharField(max_length=10, choices=FRECUENCIA_CHOICES, verbose_name="Frecuencia")
     costo_mensual = models.DecimalField(max_digits=12, decimal_places=2, verbose_name="Costo mensual")
     fecha_inicio = models.DateField(verbose_name="Fecha de inicio")
-    fecha_fin = models.DateField(null=True, blank=True, verbose_name="Fecha de finalización")
+    fecha_fin = models.DateField(null=True, blank=True, verbose_name="Fecha de finalización", db_index=True)
     estado = models.CharField(max_length=15, choices=ESTADO_CHOICES, default='ACTIVO', verbose_name="Estado")
     rubro = models.ForeignKey(Rubro, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Rubro")
     observaciones = models.TextField(blank=True, verbose_name="Observaciones")
     expediente_contratacion = models.CharField(max_length=100, blank=True, verbose_name="Expediente de contratación")
 
+    objects = ServicioQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['estado', 'fecha_fin'], name='servicio_estado_fecha_fin'),
+        ]
+
     def save(self, *args, **kwargs):
         if self.nombre:
             self.nombre = self.nombre.upper()
@@ -165,7 +357,7 @@ class Servicio(models.Model):
         
         if dias < 0:
             return 'VENCIDO'
-        elif dias <= 60:
+        elif dias <= DIAS_POR_VENCER:
             return 'POR_VENCER'
         else:
             return 'ACTIVO'
@@ -296,7 +488,7 @@ class Almacen(models.Model):
 
 
 class Entrega(models.Model):
-    fecha = models.DateTimeField(auto_now_add=True)
+    fecha = models.DateTimeField(auto_now_add=True, db_index=True)
     area_persona = models.CharField(max_length=100)
     observaciones = models.TextField(blank=True)
     orden_de_compra = models.ForeignKey(OrdenDeCompra, on_delete=models.SET_NULL, null=True, blank=True)
@@ -331,3 +523,158 @@ class EntregaItem(models.Model):
 
     def __str__(self):
         return f"{self.bien} x {self.cantidad}"
+
+
+class StockBalance(models.Model):
+    """Saldo materializado de stock.
+
+    Una fila por bien (orden_de_compra nulo) y una por cada par orden de compra / bien.
+    Se mantiene desde las señales de OrdenDeCompraItem y EntregaItem (ver inventario/stock.py)
+    y se puede reconstruir con el comando ``rebuild_stock``.
+    """
+    bien = models.ForeignKey(Bien, related_name='saldos', on_delete=models.CASCADE)
+    orden_de_compra = models.ForeignKey(OrdenDeCompra, related_name='saldos', on_delete=models.CASCADE, null=True, blank=True)
+    comprado = models.IntegerField(default=0)
+    entregado = models.IntegerField(default=0)
+    stock = models.IntegerField(default=0)
+    valor_comprado = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    valor_entregado = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = "Saldo de stock"
+        verbose_name_plural = "Saldos de stock"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['bien'], condition=models.Q(orden_de_compra__isnull=True),
+                name='stockbalance_unico_por_bien',
+            ),
+            models.UniqueConstraint(
+                fields=['orden_de_compra', 'bien'], condition=models.Q(orden_de_compra__isnull=False),
+                name='stockbalance_unico_por_orden_bien',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['stock'], name='stockbalance_stock_idx'),
+        ]
+
+    @property
+    def precio_promedio(self):
+        """Precio unitario promedio ponderado de lo comprado"""
+        if not self.comprado:
+            return Decimal('0')
+        return self.valor_comprado / self.comprado
+
+    @property
+    def valor_stock(self):
+        return self.stock * self.precio_promedio
+
+    def __str__(self):
+        if self.orden_de_compra_id:
+            return f"{self.bien} ({self.orden_de_compra}): {self.stock}"
+        return f"{self.bien}: {self.stock}"
+
+
+class StockSnapshot(models.Model):
+    """Foto del stock de cada bien al cierre de un período.
+
+    La genera el comando ``snapshot_stock``; ``inventario.snapshots`` la usa como punto
+    de partida para calcular el stock a una fecha sumando los movimientos posteriores.
+    Las fotos afectadas por un movimiento con fecha anterior se descartan solas.
+    """
+    bien = models.ForeignKey(Bien, related_name='snapshots', on_delete=models.CASCADE)
+    fecha = models.DateField(verbose_name="Fecha de cierre")
+    comprado = models.IntegerField(default=0)
+    entregado = models.IntegerField(default=0)
+    stock = models.IntegerField(default=0)
+    valor_comprado = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    valor_entregado = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    creado = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Foto de stock"
+        verbose_name_plural = "Fotos de stock"
+        constraints = [
+            models.UniqueConstraint(fields=['fecha', 'bien'], name='stocksnapshot_unico_por_fecha_bien'),
+        ]
+
+    def __str__(self):
+        return f"{self.bien} al {self.fecha}: {self.stock}"
+
+
+class ResumenEntregas(models.Model):
+    """Totales mensuales de entregas por bien, área / persona y orden de compra.
+
+    Se mantiene desde las señales de EntregaItem y Entrega (ver inventario/resumen_entregas.py)
+    y se puede reconstruir con el comando ``rebuild_resumen_entregas``. El rubro y el
+    proveedor se leen a través de ``bien`` y ``orden_de_compra``, así que cambiarlos no
+    requiere tocar el resumen.
+    """
+    anio = models.PositiveSmallIntegerField(verbose_name="Año")
+    mes = models.PositiveSmallIntegerField(verbose_name="Mes")
+    bien = models.ForeignKey(Bien, related_name='resumen_entregas', on_delete=models.CASCADE)
+    area_persona = models.CharField(max_length=100)
+    orden_de_compra = models.ForeignKey(
+        OrdenDeCompra, related_name='resumen_entregas', on_delete=models.SET_NULL, null=True, blank=True,
+    )
+    lineas = models.IntegerField(default=0, verbose_name="Ítems entregados")
+    cantidad = models.IntegerField(default=0)
+    monto = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = "Resumen mensual de entregas"
+        verbose_name_plural = "Resúmenes mensuales de entregas"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['anio', 'mes', 'bien', 'area_persona'], condition=models.Q(orden_de_compra__isnull=True),
+                name='resumenentregas_unico_sin_orden',
+            ),
+            models.UniqueConstraint(
+                fields=['anio', 'mes', 'bien', 'area_persona', 'orden_de_compra'],
+                condition=models.Q(orden_de_compra__isnull=False),
+                name='resumenentregas_unico_con_orden',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.bien} {self.mes:02d}/{self.anio} - {self.area_persona}: {self.cantidad}"
+
+
+class ReportJob(models.Model):
+    """Exportación de un reporte pedida para generar en segundo plano.
+
+    La procesa el comando ``run_report_worker`` (ver ``inventario.trabajos``); el archivo
+    generado queda en disco hasta ``expira``.
+    """
+    ESTADO_CHOICES = [
+        ('PENDIENTE', 'Pendiente'),
+        ('PROCESANDO', 'Procesando'),
+        ('TERMINADO', 'Terminado'),
+        ('ERROR', 'Error'),
+    ]
+
+    usuario = models.ForeignKey(User, related_name='report_jobs', on_delete=models.CASCADE, verbose_name="Usuario")
+    reporte = models.CharField(max_length=50, verbose_name="Reporte")
+    formato = models.CharField(max_length=10, default='pdf', verbose_name="Formato")
+    consulta = models.TextField(blank=True, verbose_name="Parámetros del reporte")
+    filas_estimadas = models.PositiveIntegerField(default=0)
+    estado = models.CharField(max_length=15, choices=ESTADO_CHOICES, default='PENDIENTE', verbose_name="Estado")
+    progreso = models.PositiveSmallIntegerField(default=0, verbose_name="Progreso (%)")
+    archivo = models.CharField(max_length=255, blank=True, verbose_name="Ruta del archivo generado")
+    nombre_archivo = models.CharField(max_length=255, blank=True, verbose_name="Nombre de descarga")
+    error = models.TextField(blank=True)
+    creado = models.DateTimeField(auto_now_add=True)
+    iniciado = models.DateTimeField(null=True, blank=True)
+    terminado = models.DateTimeField(null=True, blank=True)
+    expira = models.DateTimeField(null=True, blank=True, verbose_name="Vencimiento del archivo")
+
+    class Meta:
+        verbose_name = "Reporte en segundo plano"
+        verbose_name_plural = "Reportes en segundo plano"
+        ordering = ['-creado']
+        indexes = [
+            models.Index(fields=['estado', 'creado'], name='reportjob_estado_creado'),
+            models.Index(fields=['expira'], name='reportjob_expira'),
+        ]
+
+    def __str__(self):
+        return f"{self.reporte} ({self.formato}) - {self.get_estado_display()}"
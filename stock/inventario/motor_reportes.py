@@ -0,0 +1,333 @@
+"""
+Motor de reportes declarativos.
+
+Un reporte declara una sola vez su consulta, sus columnas y, si corresponde, el campo
+por el que se agrupa y las columnas que se totalizan. Los renderers (HTML paginado,
+Excel, CSV y PDF) recorren la consulta con ``iterator()`` por bloques, así que las
+exportaciones no arman el resultado completo en listas intermedias.
+
+    class RankingBienesReporte(Reporte):
+        titulo = 'Ranking de bienes'
+        nombre_archivo = 'ranking_bienes'
+        columnas = [Columna('bien__nombre', 'Bien'), Columna('cantidad', 'Cantidad', 'entero')]
+
+        def get_queryset(self):
+            return EntregaItem.objects.values('bien__nombre').annotate(cantidad=Sum('cantidad'))
+
+    reporte_ranking_bienes = RankingBienesReporte.as_view()
+
+El formato se elige con ``?export=`` (excel, csv o pdf); sin parámetro se muestra la
+página HTML. Se pueden sumar formatos nuevos con el decorador ``renderer``.
+
+Un reporte puede declarar además una tabla de resumen chica (``columnas_resumen`` y
+``resumen()``, por ejemplo los totales por año) que va antes del detalle en la página
+y en el PDF; Excel y CSV llevan sólo el detalle.
+"""
+import re
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.contrib.auth.decorators import login_required
+from django.core.paginator import EmptyPage, Paginator
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.shortcuts import render
+from django.utils import timezone
+
+from .cache import resultado_reporte
+from .exportacion import respuesta_csv, respuesta_xlsx_streaming
+from .pdf_tablas import DocumentoPDF
+
+
+def _fecha(valor):
+    if isinstance(valor, datetime):
+        if timezone.is_aware(valor):
+            valor = timezone.localtime(valor)
+        return valor.strftime('%d/%m/%Y')
+    if isinstance(valor, date):
+        return valor.strftime('%d/%m/%Y')
+    return valor or ''
+
+
+FORMATOS = {
+    'texto': lambda valor: '' if valor is None else str(valor),
+    'entero': lambda valor: str(valor or 0),
+    'moneda': lambda valor: f'{Decimal(valor or 0):.2f}',
+    'fecha': _fecha,
+}
+
+
+class Columna:
+    """Columna de un reporte: ``campo`` es la clave de la fila (dict) que se muestra"""
+
+    def __init__(self, campo, titulo, formato='texto', clase=''):
+        self.campo = campo
+        self.titulo = titulo
+        self.formato = formato
+        self.clase = clase
+
+    def valor(self, fila):
+        return fila.get(self.campo)
+
+    def texto(self, fila):
+        valor = self.valor(fila)
+        if valor == '':
+            return ''
+        return FORMATOS[self.formato](valor)
+
+    def valor_planilla(self, fila):
+        """Valor nativo para Excel (las fechas con zona horaria se pasan a hora local)"""
+        valor = self.valor(fila)
+        if isinstance(valor, datetime) and timezone.is_aware(valor):
+            return timezone.localtime(valor).replace(tzinfo=None)
+        if valor is None and self.formato in ('entero', 'moneda'):
+            return 0
+        return valor
+
+
+class Reporte:
+    titulo = ''
+    icono = 'fa-table'
+    nombre_archivo = 'reporte'
+    columnas = ()
+    # Campo de la fila que separa grupos; la consulta debe venir ordenada por él
+    agrupar_por = None
+    # Título de la columna con el grupo en Excel y CSV, que no llevan subtítulos
+    titulo_grupo = 'Grupo'
+    # Campos que se suman en la fila de totales
+    totalizar = ()
+    # Modelos que consulta el reporte: si se declaran, cada página HTML se guarda en la
+    # caché hasta que cambian los datos de alguno (ver cache.resultado_reporte)
+    modelos = ()
+    # Tabla de resumen que se muestra antes del detalle (ver resumen())
+    columnas_resumen = ()
+    titulo_resumen = 'Resumen'
+    # True si el template agrega una columna de acciones por fila (bloque ``acciones``)
+    acciones = False
+    template_name = 'inventario/reporte_tabla.html'
+    por_pagina = 20
+    tamanio_bloque = 2000
+    formatos = ('excel', 'csv', 'pdf')
+    # Opciones del PDF para reportes con muchas columnas
+    pdf_horizontal = False
+    pdf_tamanio_fuente = None
+
+    def __init__(self, request):
+        self.request = request
+
+    def get_queryset(self):
+        """Consulta de filas ``values()``, ya ordenada"""
+        raise NotImplementedError
+
+    def columnas_planilla(self):
+        """Columnas de Excel y CSV: si se agrupa por un campo que no es columna, va primero"""
+        if self.agrupar_por and self.agrupar_por not in {columna.campo for columna in self.columnas}:
+            return [Columna(self.agrupar_por, self.titulo_grupo)] + list(self.columnas)
+        return list(self.columnas)
+
+    def preparar_fila(self, fila):
+        """Ajusta una fila antes de mostrarla (valores derivados, textos por defecto)"""
+        return fila
+
+    def filas(self):
+        for fila in self.get_queryset().iterator(chunk_size=self.tamanio_bloque):
+            yield self.preparar_fila(fila)
+
+    def resumen(self):
+        """Filas (dicts) de la tabla de resumen, en general una consulta agregada chica"""
+        return []
+
+    def totales(self):
+        """Totales de las columnas de ``totalizar`` con una consulta agregada"""
+        if not self.totalizar:
+            return None
+        resultado = self.get_queryset().order_by().aggregate(
+            **{f'total_{campo}': Sum(campo) for campo in self.totalizar}
+        )
+        return {campo: resultado[f'total_{campo}'] or 0 for campo in self.totalizar}
+
+    def fila_totales(self, totales):
+        """Fila con los totales en las columnas totalizadas y 'TOTAL' en la primera"""
+        fila = {columna.campo: '' for columna in self.columnas}
+        fila.update(totales)
+        fila[self.columnas[0].campo] = 'TOTAL'
+        return fila
+
+    def en_cache(self, calcular, *partes):
+        """Resultado de ``calcular()`` guardado por filtros y generación de datos.
+
+        Las consultas de los reportes no dependen del usuario: si un reporte filtra por
+        algo que no está en los parámetros GET, lo tiene que sumar en ``partes``.
+        """
+        if not self.modelos:
+            return calcular()
+        return resultado_reporte(self.nombre_archivo, self.request, self.modelos, calcular, partes=partes)
+
+    def contexto_extra(self):
+        return {}
+
+    def respuesta(self):
+        formato = self.request.GET.get('export') or 'html'
+        if formato not in self.formatos:
+            formato = 'html'
+        return RENDERERS[formato](self)
+
+    @classmethod
+    def as_view(cls):
+        def vista(request):
+            return cls(request).respuesta()
+        vista.__name__ = vista.__qualname__ = cls.__name__
+        vista.__doc__ = cls.__doc__
+        vista.reporte = cls
+        return login_required(vista)
+
+
+def _acumular(reporte, filas, totales):
+    """Recorre ``filas`` sumando las columnas de ``totalizar`` en ``totales``"""
+    for fila in filas:
+        for campo in reporte.totalizar:
+            totales[campo] = totales.get(campo, 0) + (fila.get(campo) or 0)
+        yield fila
+
+
+def _filas_con_totales(reporte):
+    """Filas del reporte seguidas de la fila de totales (si corresponde)"""
+    totales = {}
+    yield from _acumular(reporte, reporte.filas(), totales)
+    if reporte.totalizar:
+        yield reporte.fila_totales(totales)
+
+
+# --- Renderers ---
+
+RENDERERS = {}
+
+
+def renderer(nombre):
+    """Registra una función ``f(reporte) -> HttpResponse`` para ``?export=nombre``"""
+    def registrar(funcion):
+        RENDERERS[nombre] = funcion
+        return funcion
+    return registrar
+
+
+def _pagina(reporte, numero):
+    """Filas ya preparadas de la página ``numero`` (acotada al rango válido) y los totales"""
+    paginator = Paginator(reporte.get_queryset(), reporte.por_pagina)
+    try:
+        page_obj = paginator.page(min(numero, max(paginator.num_pages, 1)))
+    except EmptyPage:
+        page_obj = paginator.page(1)
+    return {
+        'numero': page_obj.number,
+        'cantidad': paginator.count,
+        'filas': [reporte.preparar_fila(fila) for fila in page_obj.object_list],
+        'totales': reporte.totales(),
+    }
+
+
+@renderer('html')
+def renderizar_html(reporte):
+    request = reporte.request
+    try:
+        numero = max(int(request.GET.get('page') or 1), 1)
+    except (TypeError, ValueError):
+        numero = 1
+    pagina = reporte.en_cache(lambda: _pagina(reporte, numero), numero)
+    # La página cacheada sólo guarda la cantidad de filas; el paginador del template
+    # se arma sobre un rango de esa longitud
+    page_obj = Paginator(range(pagina['cantidad']), reporte.por_pagina).page(pagina['numero'])
+
+    filas = []
+    grupo_anterior = object()
+    for fila in pagina['filas']:
+        grupo = fila.get(reporte.agrupar_por) if reporte.agrupar_por else None
+        filas.append({
+            'grupo': grupo if reporte.agrupar_por and grupo != grupo_anterior else None,
+            'celdas': [(columna.texto(fila), columna.clase) for columna in reporte.columnas],
+            'datos': fila,
+        })
+        grupo_anterior = grupo
+
+    totales = pagina['totales']
+    parametros = request.GET.copy()
+    for clave in ('page', 'export'):
+        parametros.pop(clave, None)
+    contexto = {
+        'reporte': reporte,
+        'columnas': reporte.columnas,
+        'ancho': len(reporte.columnas) + (1 if reporte.acciones else 0),
+        'filas': filas,
+        'page_obj': page_obj,
+        'totales': (
+            [columna.texto(reporte.fila_totales(totales)) for columna in reporte.columnas]
+            if totales is not None and pagina['cantidad'] else None
+        ),
+        'consulta': parametros.urlencode(),
+        'request': request,
+    }
+    if reporte.columnas_resumen:
+        contexto['resumen'] = [
+            [columna.texto(fila) for columna in reporte.columnas_resumen]
+            for fila in reporte.en_cache(lambda: list(reporte.resumen()), 'resumen')
+        ]
+    contexto.update(reporte.contexto_extra())
+    return render(request, reporte.template_name, contexto)
+
+
+@renderer('excel')
+def renderizar_excel(reporte):
+    columnas = reporte.columnas_planilla()
+    return respuesta_xlsx_streaming(
+        f'{reporte.nombre_archivo}.xlsx',
+        [columna.titulo for columna in columnas],
+        ([columna.valor_planilla(fila) for columna in columnas] for fila in _filas_con_totales(reporte)),
+        hoja=re.sub(r'[\\/*?:\[\]]', '-', reporte.titulo)[:31] or 'Datos',
+    )
+
+
+@renderer('csv')
+def renderizar_csv(reporte):
+    columnas = reporte.columnas_planilla()
+    return respuesta_csv(
+        f'{reporte.nombre_archivo}.csv',
+        [columna.titulo for columna in columnas],
+        ([columna.texto(fila) for columna in columnas] for fila in _filas_con_totales(reporte)),
+    )
+
+
+@renderer('pdf')
+def renderizar_pdf(reporte):
+    pagesize = None
+    if reporte.pdf_horizontal:
+        from reportlab.lib.pagesizes import landscape, letter
+        pagesize = landscape(letter)
+    documento = DocumentoPDF(reporte.titulo, pagesize=pagesize)
+    if reporte.columnas_resumen:
+        documento.parrafo(reporte.titulo_resumen, 'Heading2')
+        documento.tabla(
+            [columna.titulo for columna in reporte.columnas_resumen],
+            ([columna.texto(fila) for columna in reporte.columnas_resumen] for fila in reporte.resumen()),
+        )
+        documento.espacio(18)
+
+    def filas():
+        # Una sola pasada: con agrupar_por cada fila va con su grupo y la de totales queda en el último
+        totales = {}
+        grupo = None
+        for fila in _acumular(reporte, reporte.filas(), totales):
+            celdas = [columna.texto(fila) for columna in reporte.columnas]
+            if reporte.agrupar_por:
+                grupo = fila.get(reporte.agrupar_por)
+                yield grupo, celdas
+            else:
+                yield celdas
+        if reporte.totalizar:
+            celdas = [columna.texto(reporte.fila_totales(totales)) for columna in reporte.columnas]
+            yield (grupo, celdas) if reporte.agrupar_por else celdas
+
+    documento.tabla(
+        [columna.titulo for columna in reporte.columnas], filas(),
+        tamanio_fuente=reporte.pdf_tamanio_fuente, agrupada=bool(reporte.agrupar_por),
+    )
+    return documento.respuesta(f'{reporte.nombre_archivo}.pdf')
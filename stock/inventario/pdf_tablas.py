@@ -0,0 +1,203 @@
+"""
+Exportación de tablas a PDF con reportlab en tiempo lineal.
+
+Un ``Table`` de reportlab con decenas de miles de filas es caro de armar: al cortar
+cada página se vuelve a medir y copiar todo lo que queda de la tabla, y el documento
+entero queda en memoria hasta ``doc.build``. ``DocumentoPDF`` corta las filas en tablas
+del tamaño de una página que comparten un mismo ``TableStyle`` y los mismos anchos de
+columna (calculados una sola vez), las arma a medida que reportlab las va consumiendo y
+escribe el resultado en un archivo temporal que se envía con FileResponse.
+
+El comando ``benchmark_pdf`` mide el tiempo por fila con distintas cantidades.
+"""
+import tempfile
+
+from django.http import FileResponse
+
+from .exportacion import contar_filas
+
+ESTILO_TABLA = [
+    ('BACKGROUND', (0, 0), (-1, 0), 'grey'),
+    ('TEXTCOLOR', (0, 0), (-1, 0), 'whitesmoke'),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+    ('BACKGROUND', (0, 1), (-1, -1), 'beige'),
+    ('GRID', (0, 0), (-1, -1), 1, 'black'),
+]
+TAMANIO_FUENTE = 10
+# Memoria máxima del PDF antes de pasar a disco
+MEMORIA_MAXIMA = 5 * 1024 * 1024
+# Cantidad de filas que se miden para calcular los anchos de columna
+FILAS_MUESTRA = 200
+
+
+def tabla_pdf(filas, estilo=None, anchos=None):
+    """Table de reportlab con el estilo común de los reportes (para tablas chicas)"""
+    from reportlab.platypus import Table, TableStyle
+
+    return Table(filas, repeatRows=1, colWidths=anchos, style=TableStyle(estilo or ESTILO_TABLA))
+
+
+class _Flujo:
+    """Lista de flowables que se completa a medida que reportlab la consume.
+
+    ``doc.build`` sólo mira el principio de la lista (lee, borra e inserta adelante),
+    así que alcanza con tener armados los próximos elementos: las tablas ya dibujadas
+    se descartan y la memoria no crece con la cantidad de filas.
+    """
+
+    def __init__(self, origen):
+        self._origen = iter(origen)
+        self._pendientes = []
+
+    def _llenar(self, cantidad):
+        while len(self._pendientes) < cantidad:
+            try:
+                self._pendientes.append(next(self._origen))
+            except StopIteration:
+                return
+
+    def _hasta(self, indice):
+        if isinstance(indice, slice):
+            if indice.stop is None or indice.stop < 0:
+                self._llenar(float('inf'))
+            else:
+                self._llenar(indice.stop)
+        else:
+            self._llenar(indice + 1 if indice >= 0 else float('inf'))
+
+    def __len__(self):
+        self._llenar(3)
+        return len(self._pendientes)
+
+    def __getitem__(self, indice):
+        self._hasta(indice)
+        return self._pendientes[indice]
+
+    def __setitem__(self, indice, valor):
+        self._hasta(indice)
+        self._pendientes[indice] = valor
+
+    def __delitem__(self, indice):
+        self._hasta(indice)
+        del self._pendientes[indice]
+
+    def insert(self, indice, valor):
+        self._pendientes.insert(indice, valor)
+
+
+class DocumentoPDF:
+    """PDF armado por secciones (títulos, párrafos y tablas) y construido al final.
+
+    Las tablas reciben cualquier iterable de filas y no lo recorren hasta ``respuesta()``.
+    """
+
+    def __init__(self, titulo=None, pagesize=None):
+        from reportlab.lib.pagesizes import letter
+        from reportlab.lib.styles import getSampleStyleSheet
+        from reportlab.platypus import SimpleDocTemplate
+
+        self.archivo = tempfile.SpooledTemporaryFile(max_size=MEMORIA_MAXIMA)
+        self.doc = SimpleDocTemplate(self.archivo, pagesize=pagesize or letter)
+        self.styles = getSampleStyleSheet()
+        self.partes = []
+        if titulo:
+            self.parrafo(titulo, 'Title')
+            self.espacio()
+
+    def parrafo(self, texto, estilo='Normal'):
+        from reportlab.platypus import Paragraph
+
+        self.partes.append([Paragraph(texto, self.styles[estilo])])
+
+    def espacio(self, alto=12):
+        from reportlab.platypus import Spacer
+
+        self.partes.append([Spacer(1, alto)])
+
+    def tabla(self, encabezados, filas, anchos=None, tamanio_fuente=None, estilo=None, agrupada=False, vacia=None):
+        """Agrega una tabla cortada en bloques de una página.
+
+        Con ``agrupada`` las filas son pares (grupo, celdas) ordenados por grupo: cada
+        grupo lleva un subtítulo y sus propias tablas. ``vacia`` es el texto que se
+        muestra si no hay filas.
+        """
+        self.partes.append(self._bloques(
+            list(encabezados), contar_filas(filas), anchos, tamanio_fuente, estilo, agrupada, vacia,
+        ))
+
+    def _estilo(self, estilo, tamanio_fuente):
+        from reportlab.platypus import TableStyle
+
+        comandos = list(estilo or ESTILO_TABLA)
+        if tamanio_fuente:
+            comandos.append(('FONTSIZE', (0, 0), (-1, -1), tamanio_fuente))
+        return TableStyle(comandos)
+
+    def _anchos(self, encabezados, muestra, tamanio_fuente):
+        """Anchos de columna medidos sobre el encabezado y las primeras filas, ajustados a la página"""
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+
+        anchos = [stringWidth(str(texto), 'Helvetica-Bold', tamanio_fuente) for texto in encabezados]
+        for fila in muestra[:FILAS_MUESTRA]:
+            for indice, celda in enumerate(fila):
+                anchos[indice] = max(anchos[indice], stringWidth(str(celda), 'Helvetica', tamanio_fuente))
+        anchos = [ancho + 12 for ancho in anchos]
+        total = sum(anchos)
+        if total > self.doc.width:
+            anchos = [ancho * self.doc.width / total for ancho in anchos]
+        return anchos
+
+    def filas_por_pagina(self, tamanio_fuente=None):
+        # Alto de una fila: interlineado de la fuente más el relleno de la celda
+        alto_fila = (tamanio_fuente or TAMANIO_FUENTE) * 1.2 + 6
+        return max(10, int((self.doc.height - alto_fila - 5) // alto_fila))
+
+    def _bloques(self, encabezados, filas, anchos, tamanio_fuente, estilo, agrupada, vacia):
+        from reportlab.platypus import Paragraph, Spacer, Table
+
+        tamanio = tamanio_fuente or TAMANIO_FUENTE
+        estilo_tabla = self._estilo(estilo, tamanio_fuente)
+        por_bloque = self.filas_por_pagina(tamanio_fuente)
+        bloque = []
+        grupo_actual = sin_grupo = object()
+        hubo_filas = False
+
+        def cerrar():
+            nonlocal anchos
+            if anchos is None:
+                anchos = self._anchos(encabezados, bloque, tamanio)
+            return Table([encabezados] + bloque, repeatRows=1, colWidths=anchos, style=estilo_tabla)
+
+        for fila in filas:
+            hubo_filas = True
+            if agrupada:
+                grupo, fila = fila
+                if grupo != grupo_actual:
+                    if bloque:
+                        yield cerrar()
+                        bloque = []
+                    if grupo_actual is not sin_grupo:
+                        yield Spacer(1, 12)
+                    yield Paragraph(str(grupo), self.styles['Heading3'])
+                    grupo_actual = grupo
+            bloque.append(list(fila))
+            if len(bloque) >= por_bloque:
+                yield cerrar()
+                bloque = []
+        if bloque:
+            yield cerrar()
+        elif not hubo_filas and vacia:
+            yield Paragraph(vacia, self.styles['Normal'])
+
+    def escribir(self):
+        """Construye el documento y deja el archivo listo para leer desde el principio"""
+        from itertools import chain
+
+        self.doc.build(_Flujo(chain.from_iterable(self.partes)))
+        self.archivo.seek(0)
+        return self.archivo
+
+    def respuesta(self, nombre_archivo):
+        return FileResponse(self.escribir(), as_attachment=True, filename=nombre_archivo, content_type='application/pdf')
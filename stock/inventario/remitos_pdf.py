@@ -0,0 +1,232 @@
+"""
+Caché en disco de los remitos en PDF.
+
+Renderizar ``remito_pdf.html`` con xhtml2pdf es lento y los remitos se descargan
+muchas veces pero casi nunca se editan. Cada PDF se guarda en ``REMITOS_PDF_DIR``
+con un nombre que incluye la huella (SHA-256) de todo lo que se imprime: los datos
+de la entrega, las filas de sus ítems y la versión de la plantilla. Si la entrega se
+edita (``editar_entrega``), si cambia el nombre de un bien o se modifica la
+plantilla, la huella cambia y el remito se vuelve a generar; la versión anterior se
+borra al guardar la nueva. La huella también se usa como ETag de la descarga.
+
+Para imprimir muchos remitos juntos (vista ``remitos_lote`` y comando
+``generar_remitos``) los que faltan en disco se renderizan en paralelo en un
+ProcessPoolExecutor: xhtml2pdf ocupa un núcleo entero y no libera el GIL. Los
+procesos sólo reciben el HTML ya armado y escriben el PDF, así que no tocan la base.
+Este módulo no importa modelos al cargarse para que los procesos (iniciados con
+``spawn``) puedan importarlo sin configurar Django.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing import get_context
+from pathlib import Path
+
+from django.conf import settings
+from django.template.loader import get_template
+from django.utils import timezone
+
+from .exportacion import _Tubo
+
+PLANTILLA = 'inventario/remito_pdf.html'
+# Subir si cambia la forma de generar el PDF sin que cambie la plantilla
+VERSION_PLANTILLA = 1
+
+
+def directorio():
+    ruta = Path(getattr(settings, 'REMITOS_PDF_DIR', Path(settings.BASE_DIR) / 'remitos_pdf'))
+    ruta.mkdir(parents=True, exist_ok=True)
+    return ruta
+
+
+@lru_cache(maxsize=None)
+def _version_plantilla():
+    fuente = get_template(PLANTILLA).template.source
+    return f'{VERSION_PLANTILLA}:{hashlib.sha256(fuente.encode()).hexdigest()}'
+
+
+def _texto(valor):
+    return '' if valor is None else str(valor)
+
+
+def huella(entrega):
+    """Hash del contenido impreso del remito.
+
+    Recorre ``entrega.items.all()``, así que conviene traer la entrega con
+    ``prefetch_related('items__bien', 'items__orden_de_compra')``.
+    """
+    contenido = {
+        'plantilla': _version_plantilla(),
+        'entrega': [
+            entrega.pk,
+            timezone.localtime(entrega.fecha).isoformat() if timezone.is_aware(entrega.fecha) else entrega.fecha.isoformat(),
+            entrega.area_persona,
+            entrega.observaciones,
+        ],
+        'items': [
+            [
+                item.pk, _texto(item.orden_de_compra), _texto(item.bien), item.cantidad,
+                _texto(item.precio_unitario), _texto(item.precio_total),
+            ]
+            for item in sorted(entrega.items.all(), key=lambda item: item.pk)
+        ],
+    }
+    return hashlib.sha256(json.dumps(contenido, ensure_ascii=False).encode()).hexdigest()
+
+
+def ruta(entrega_id, valor_huella):
+    return directorio() / f'{entrega_id}_{valor_huella}.pdf'
+
+
+def descartar(entrega_id, conservar=None):
+    """Borra las versiones guardadas del remito, salvo la ruta ``conservar``"""
+    for archivo in directorio().glob(f'{entrega_id}_*.pdf'):
+        if archivo != conservar:
+            archivo.unlink(missing_ok=True)
+
+
+def _escribir_pdf(html, destino):
+    """Convierte ``html`` en PDF dentro de ``destino`` (corre también en los procesos del lote)"""
+    from xhtml2pdf import pisa
+
+    # Se escribe en un temporal del mismo directorio y se renombra: una descarga
+    # concurrente nunca ve un PDF a medio escribir
+    descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(destino), suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as archivo:
+            resultado = pisa.CreatePDF(html, dest=archivo)
+        if resultado.err:
+            raise RuntimeError(f'No se pudo generar {os.path.basename(destino)}')
+        os.replace(temporal, destino)
+    except BaseException:
+        Path(temporal).unlink(missing_ok=True)
+        raise
+
+
+def _html(entrega):
+    return get_template(PLANTILLA).render({'entrega': entrega})
+
+
+def _renderizar(entrega, destino):
+    _escribir_pdf(_html(entrega), str(destino))
+
+
+def obtener(entrega, valor_huella=None):
+    """Ruta del PDF del remito, generándolo sólo si no está en disco"""
+    valor_huella = valor_huella or huella(entrega)
+    destino = ruta(entrega.pk, valor_huella)
+    if not destino.exists():
+        _renderizar(entrega, destino)
+        descartar(entrega.pk, conservar=destino)
+    return destino
+
+
+# --- Generación en lote ---
+
+# Remitos leídos de la base por consulta
+TAMANIO_BLOQUE = 100
+FORMATOS_LOTE = ('zip', 'pdf')
+
+
+def entregas_lote(desde=None, hasta=None, ids=None):
+    """Entregas de un rango de fechas (inclusive) y / o de una lista de ids, por fecha"""
+    from .models import Entrega
+
+    entregas = Entrega.objects.all()
+    if ids:
+        entregas = entregas.filter(pk__in=ids)
+    if desde:
+        entregas = entregas.filter(fecha__date__gte=desde)
+    if hasta:
+        entregas = entregas.filter(fecha__date__lte=hasta)
+    return entregas.prefetch_related('items__bien', 'items__orden_de_compra').order_by('fecha', 'pk')
+
+
+def procesos_lote():
+    return getattr(settings, 'REMITOS_PDF_PROCESOS', None) or os.cpu_count() or 1
+
+
+def iterar_lote(entregas, procesos=None):
+    """Genera pares (entrega, ruta del PDF) en el orden de ``entregas``.
+
+    Los remitos que no están en disco se renderizan en paralelo; como mucho hay
+    ``2 * procesos`` remitos en vuelo, así que la memoria no depende del tamaño del
+    lote. Con ``procesos=1`` se renderiza en este mismo proceso.
+    """
+    procesos = procesos or procesos_lote()
+    if hasattr(entregas, 'iterator'):
+        entregas = entregas.iterator(chunk_size=TAMANIO_BLOQUE)
+    ventana = 2 * procesos
+    en_vuelo = deque()
+    ejecutor = None
+
+    def listo():
+        futuro = en_vuelo[0][2]
+        return len(en_vuelo) > ventana or futuro is None or futuro.done()
+
+    def terminar():
+        entrega, destino, futuro = en_vuelo.popleft()
+        if futuro is not None:
+            futuro.result()
+            descartar(entrega.pk, conservar=destino)
+        return entrega, destino
+
+    try:
+        for entrega in entregas:
+            destino = ruta(entrega.pk, huella(entrega))
+            futuro = None
+            if not destino.exists():
+                if procesos > 1:
+                    if ejecutor is None:
+                        ejecutor = ProcessPoolExecutor(procesos, mp_context=get_context('spawn'))
+                    futuro = ejecutor.submit(_escribir_pdf, _html(entrega), str(destino))
+                else:
+                    _renderizar(entrega, destino)
+                    descartar(entrega.pk, conservar=destino)
+            en_vuelo.append((entrega, destino, futuro))
+            while en_vuelo and listo():
+                yield terminar()
+        while en_vuelo:
+            yield terminar()
+    finally:
+        if ejecutor is not None:
+            ejecutor.shutdown(cancel_futures=True)
+
+
+def iterar_zip(entregas, procesos=None):
+    """Bytes de un ZIP con un PDF por remito, emitidos a medida que se generan"""
+    tubo = _Tubo()
+    with zipfile.ZipFile(tubo, 'w', compression=zipfile.ZIP_DEFLATED) as paquete:
+        for entrega, destino in iterar_lote(entregas, procesos):
+            with open(destino, 'rb') as origen, paquete.open(f'remito_{entrega.pk}.pdf', 'w') as copia:
+                shutil.copyfileobj(origen, copia)
+            yield tubo.retirar()
+    yield tubo.retirar()
+
+
+def unir_pdf(entregas, destino, procesos=None):
+    """Escribe en ``destino`` un único PDF con todos los remitos; devuelve cuántos unió.
+
+    pypdf arma el documento completo antes de escribirlo, así que a diferencia del
+    ZIP la memoria crece con el tamaño del PDF final (no con el costo de renderizar).
+    """
+    from pypdf import PdfWriter
+
+    documento = PdfWriter()
+    cantidad = 0
+    for _, ruta_pdf in iterar_lote(entregas, procesos):
+        documento.append(str(ruta_pdf))
+        cantidad += 1
+    documento.write(destino)
+    return cantidad
+
+
+def nombre_lote(formato, desde=None, hasta=None):
+    rango = ''.join(f'_{fecha:%Y%m%d}' for fecha in (desde, hasta) if fecha)
+    return f"remitos{rango}.{formato}"
@@ -0,0 +1,214 @@
+"""
+Mantenimiento del resumen mensual de entregas (ResumenEntregas).
+
+Cada fila acumula las entregas de un mes para un bien, un área / persona y una orden
+de compra (o ninguna). Las altas, modificaciones y bajas de EntregaItem, y los cambios
+de fecha o de área de un Entrega, se traducen en deltas sobre esas filas, que se
+aplican con UPDATE ... SET campo = campo + n como en el saldo de stock. Los reportes de
+entregas leen de acá: su costo depende de la cantidad de grupos y no de la de ítems.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+from django.utils import timezone
+
+from .cache import invalidar_modelo
+from .models import Entrega, EntregaItem, ResumenEntregas
+
+CAMPOS = ('lineas', 'cantidad', 'monto')
+
+
+def _nuevo_delta():
+    return {'lineas': 0, 'cantidad': 0, 'monto': Decimal('0')}
+
+
+def nuevos_deltas():
+    return defaultdict(_nuevo_delta)
+
+
+def periodo(fecha):
+    """(año, mes) de una fecha de entrega en la zona horaria local"""
+    if timezone.is_aware(fecha):
+        fecha = timezone.localtime(fecha)
+    return fecha.year, fecha.month
+
+
+def datos_entregas(entrega_ids):
+    """{entrega_id: (año, mes, área)} para las entregas indicadas"""
+    return {
+        pk: periodo(fecha) + (area,)
+        for pk, fecha, area in Entrega.objects.filter(pk__in=set(entrega_ids)).values_list('pk', 'fecha', 'area_persona')
+    }
+
+
+def acumular(deltas, items, entregas, signo=1):
+    """Acumula en ``deltas`` el efecto de uno o más EntregaItem.
+
+    ``entregas`` es el resultado de ``datos_entregas`` (o equivalente); los ítems cuya
+    entrega no figura se ignoran.
+    """
+    for item in items:
+        datos = entregas.get(item.entrega_id)
+        if datos is None:
+            continue
+        anio, mes, area = datos
+        valor = item.precio_total if item.precio_total is not None else item.cantidad * item.precio_unitario
+        delta = deltas[(anio, mes, item.bien_id, area, item.orden_de_compra_id)]
+        delta['lineas'] += signo
+        delta['cantidad'] += signo * item.cantidad
+        delta['monto'] += signo * Decimal(valor)
+    return deltas
+
+
+def _aplicar_fila(clave, delta):
+    anio, mes, bien_id, area, orden_id = clave
+    qs = ResumenEntregas.objects.filter(
+        anio=anio, mes=mes, bien_id=bien_id, area_persona=area, orden_de_compra_id=orden_id,
+    )
+    cambios = {campo: F(campo) + delta[campo] for campo in CAMPOS}
+    if qs.update(**cambios):
+        if delta['lineas'] < 0:
+            # El grupo se quedó sin ítems: la fila no aporta nada a los reportes
+            qs.filter(lineas__lte=0).delete()
+        return
+    if delta['lineas'] <= 0:
+        return
+    try:
+        with transaction.atomic():
+            ResumenEntregas.objects.create(
+                anio=anio, mes=mes, bien_id=bien_id, area_persona=area, orden_de_compra_id=orden_id, **delta,
+            )
+    except IntegrityError:
+        # Otra transacción creó la fila entre el UPDATE y el INSERT
+        qs.update(**cambios)
+
+
+def aplicar_deltas(deltas):
+    """Aplica los deltas acumulados en una sola transacción, siempre en el mismo orden"""
+    claves = sorted(
+        (clave for clave, delta in deltas.items() if any(delta[c] for c in CAMPOS)),
+        key=lambda c: (c[0], c[1], c[2], c[3], c[4] or 0),
+    )
+    if not claves:
+        return
+    with transaction.atomic():
+        for clave in claves:
+            _aplicar_fila(clave, deltas[clave])
+        invalidar_modelo(ResumenEntregas)
+
+
+def registrar_item(anterior=None, actual=None):
+    """Refleja en el resumen el cambio de un EntregaItem (alta, modificación o baja)"""
+    items = [item for item in (anterior, actual) if item is not None]
+    entregas = datos_entregas(item.entrega_id for item in items)
+    deltas = nuevos_deltas()
+    if anterior is not None:
+        acumular(deltas, [anterior], entregas, signo=-1)
+    if actual is not None:
+        acumular(deltas, [actual], entregas)
+    aplicar_deltas(deltas)
+
+
+def registrar_items_bulk(creados, actualizados):
+    """Equivalente a ``registrar_item`` para ítems escritos con bulk_create / bulk_update"""
+    anteriores = [anterior for anterior, _ in actualizados]
+    actuales = list(creados) + [actual for _, actual in actualizados]
+    entregas = datos_entregas(item.entrega_id for item in anteriores + actuales)
+    deltas = nuevos_deltas()
+    acumular(deltas, anteriores, entregas, signo=-1)
+    acumular(deltas, actuales, entregas)
+    aplicar_deltas(deltas)
+
+
+def mover_entrega(anterior, actual):
+    """Mueve los ítems de una entrega cuya fecha (mes) o área / persona cambió"""
+    antes = periodo(anterior.fecha) + (anterior.area_persona,)
+    despues = periodo(actual.fecha) + (actual.area_persona,)
+    if antes == despues:
+        return
+    items = list(EntregaItem.objects.filter(entrega_id=actual.pk))
+    deltas = nuevos_deltas()
+    acumular(deltas, items, {actual.pk: antes}, signo=-1)
+    acumular(deltas, items, {actual.pk: despues})
+    aplicar_deltas(deltas)
+
+
+def desvincular_orden(orden_id):
+    """Pasa a "sin orden" las filas de una orden de compra que se va a borrar.
+
+    Es lo que hace la base con los ítems (SET_NULL), que no dispara señales.
+    """
+    deltas = nuevos_deltas()
+    for fila in ResumenEntregas.objects.filter(orden_de_compra_id=orden_id):
+        clave = (fila.anio, fila.mes, fila.bien_id, fila.area_persona)
+        for campo in CAMPOS:
+            deltas[clave + (orden_id,)][campo] -= getattr(fila, campo)
+            deltas[clave + (None,)][campo] += getattr(fila, campo)
+    aplicar_deltas(deltas)
+
+
+# --- Reconstrucción ---
+
+def calcular_resumen():
+    """Recalcula el resumen desde EntregaItem con una consulta agrupada.
+
+    Devuelve un diccionario (año, mes, bien_id, área, orden_id) -> valores.
+    """
+    filas = (
+        EntregaItem.objects.order_by()
+        .values(
+            anio=ExtractYear('entrega__fecha'), mes=ExtractMonth('entrega__fecha'),
+            bien_ref=F('bien_id'), area=F('entrega__area_persona'), orden=F('orden_de_compra_id'),
+        )
+        .annotate(lineas=Count('id'), suma_cantidad=Sum('cantidad'), suma_monto=Sum('precio_total'))
+    )
+    return {
+        (fila['anio'], fila['mes'], fila['bien_ref'], fila['area'], fila['orden']): {
+            'lineas': fila['lineas'],
+            'cantidad': fila['suma_cantidad'] or 0,
+            'monto': fila['suma_monto'] or Decimal('0'),
+        }
+        for fila in filas
+    }
+
+
+def diferencias_resumen(esperado=None):
+    """Compara ResumenEntregas con el recalculado: lista de (clave, actual, esperado)"""
+    if esperado is None:
+        esperado = calcular_resumen()
+    actuales = {
+        (f['anio'], f['mes'], f['bien_id'], f['area_persona'], f['orden_de_compra_id']): f
+        for f in ResumenEntregas.objects.values(
+            'anio', 'mes', 'bien_id', 'area_persona', 'orden_de_compra_id', *CAMPOS,
+        )
+    }
+    diferencias = []
+    for clave, valores in esperado.items():
+        actual = actuales.pop(clave, None)
+        if actual is None or any(actual[c] != valores[c] for c in CAMPOS):
+            diferencias.append((clave, actual, valores))
+    for clave, actual in actuales.items():
+        diferencias.append((clave, actual, None))
+    return diferencias
+
+
+def reconstruir_resumen(esperado=None, batch_size=1000):
+    """Reemplaza el contenido de ResumenEntregas por el recalculado"""
+    if esperado is None:
+        esperado = calcular_resumen()
+    with transaction.atomic():
+        ResumenEntregas.objects.all().delete()
+        ResumenEntregas.objects.bulk_create(
+            (
+                ResumenEntregas(
+                    anio=anio, mes=mes, bien_id=bien_id, area_persona=area, orden_de_compra_id=orden_id, **valores,
+                )
+                for (anio, mes, bien_id, area, orden_id), valores in esperado.items()
+            ),
+            batch_size=batch_size,
+        )
+        invalidar_modelo(ResumenEntregas)
+    return len(esperado)
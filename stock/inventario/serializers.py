@@ -8,6 +8,8 @@ class RubroSerializer(serializers.ModelSerializer):
 
 class BienSerializer(serializers.ModelSerializer):
     rubro_nombre = serializers.CharField(source='rubro.nombre', read_only=True)
+    # Disponible cuando el queryset viene de Bien.objects.with_stock()
+    stock = serializers.IntegerField(read_only=True)
     
     class Meta:
         model = Bien
@@ -1,9 +1,12 @@
-from django.db.models.signals import post_save, post_delete, pre_save
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
 from django.dispatch import receiver
 from django.contrib.contenttypes.models import ContentType
 from .models import AuditLog, Rubro, Bien, OrdenDeCompra, OrdenDeCompraItem, Entrega, EntregaItem, Servicio, ServicioPago, Almacen
 from django.contrib.auth import get_user_model
 from .middleware.current_user import get_current_user
+from django.db import transaction
+from . import remitos_pdf, resumen_entregas, snapshots, stock
+from .cache import invalidar_modelo
 import json
 
 User = get_user_model()
@@ -104,4 +107,142 @@ def audit_post_delete(sender, instance, **kwargs):
             object_id=instance.pk,
             object_repr=str(instance),
             changes=None
-        )
\ No newline at end of file
+        )
+
+
+# --- Generación de datos para la caché de reportes ---
+
+@receiver(post_save)
+def generacion_post_save(sender, instance, **kwargs):
+    if sender in AUDITED_MODELS and not kwargs.get('raw'):
+        invalidar_modelo(sender)
+
+@receiver(post_delete)
+def generacion_post_delete(sender, instance, **kwargs):
+    if sender in AUDITED_MODELS:
+        invalidar_modelo(sender)
+
+
+# --- Saldo materializado de stock ---
+# Los handlers reutilizan la instancia previa que carga audit_pre_save para calcular
+# el delta de una modificación sin volver a consultar la base.
+
+@receiver(post_save, sender=Bien)
+def stock_bien_post_save(sender, instance, created, **kwargs):
+    if kwargs.get('raw'):
+        return
+    if created:
+        stock.asegurar_saldo_bien(instance.pk)
+    else:
+        # Las cachés de stock guardan el nombre del bien
+        stock.invalidar_cache_stock()
+
+@receiver(post_save, sender=OrdenDeCompra)
+def stock_orden_post_save(sender, instance, created, **kwargs):
+    # Las cachés de órdenes con stock guardan el número y dependen del rubro de la orden
+    if created or kwargs.get('raw'):
+        return
+    stock.invalidar_cache_stock()
+    anterior = getattr(instance, '_audit_old_instance', None)
+    if anterior is not None and anterior.fecha_inicio != instance.fecha_inicio:
+        # Las compras de la orden cambian de fecha: las fotos desde la fecha más temprana quedan viejas
+        snapshots.descartar_fotos(desde=min(anterior.fecha_inicio, instance.fecha_inicio))
+
+@receiver(post_save, sender=OrdenDeCompraItem)
+def stock_compra_post_save(sender, instance, created, **kwargs):
+    if kwargs.get('raw'):
+        return
+    anterior = None if created else getattr(instance, '_audit_old_instance', None)
+    stock.registrar_compra(anterior=anterior, actual=instance)
+    stock.invalidar_cache_stock()
+    snapshots.descartar_fotos(ordenes=[instance.orden_de_compra_id, getattr(anterior, 'orden_de_compra_id', None)])
+
+@receiver(post_delete, sender=OrdenDeCompraItem)
+def stock_compra_post_delete(sender, instance, **kwargs):
+    stock.registrar_compra(anterior=instance)
+    stock.invalidar_cache_stock()
+    snapshots.descartar_fotos(ordenes=[instance.orden_de_compra_id])
+
+@receiver(post_save, sender=EntregaItem)
+def stock_entrega_post_save(sender, instance, created, **kwargs):
+    if kwargs.get('raw'):
+        return
+    anterior = None if created else getattr(instance, '_audit_old_instance', None)
+    stock.registrar_entrega(anterior=anterior, actual=instance)
+    stock.invalidar_cache_stock()
+    snapshots.descartar_fotos(entregas=[instance.entrega_id])
+
+@receiver(post_delete, sender=EntregaItem)
+def stock_entrega_post_delete(sender, instance, **kwargs):
+    stock.registrar_entrega(anterior=instance)
+    stock.invalidar_cache_stock()
+    snapshots.descartar_fotos(entregas=[instance.entrega_id])
+
+
+# --- Resumen mensual de entregas ---
+
+@receiver(post_save, sender=EntregaItem)
+def resumen_item_post_save(sender, instance, created, **kwargs):
+    if kwargs.get('raw'):
+        return
+    anterior = None if created else getattr(instance, '_audit_old_instance', None)
+    resumen_entregas.registrar_item(anterior=anterior, actual=instance)
+
+@receiver(post_delete, sender=EntregaItem)
+def resumen_item_post_delete(sender, instance, **kwargs):
+    resumen_entregas.registrar_item(anterior=instance)
+
+@receiver(post_save, sender=Entrega)
+def resumen_entrega_post_save(sender, instance, created, **kwargs):
+    anterior = getattr(instance, '_audit_old_instance', None)
+    if created or kwargs.get('raw') or anterior is None:
+        return
+    resumen_entregas.mover_entrega(anterior, instance)
+
+@receiver(post_delete, sender=Entrega)
+def remito_pdf_post_delete(sender, instance, **kwargs):
+    # Los PDF guardados de un remito borrado ya no se pueden pedir
+    pk = instance.pk
+    transaction.on_commit(lambda: remitos_pdf.descartar(pk))
+
+@receiver(pre_delete, sender=OrdenDeCompra)
+def resumen_orden_pre_delete(sender, instance, **kwargs):
+    resumen_entregas.desvincular_orden(instance.pk)
+
+
+def registrar_entrega_items_bulk(creados, actualizados):
+    """Equivalente a post_save para EntregaItem escritos con bulk_create / bulk_update.
+
+    ``creados`` es la lista de ítems nuevos (con pk asignada) y ``actualizados`` una
+    lista de pares (anterior, actual). Actualiza el saldo de stock y el resumen de
+    entregas con un único juego de deltas cada uno y deja el registro de auditoría
+    como lo harían los handlers.
+    """
+    deltas = stock.nuevos_deltas()
+    stock.acumular_entregas(deltas, [anterior for anterior, _ in actualizados], signo=-1)
+    stock.acumular_entregas(deltas, list(creados) + [actual for _, actual in actualizados])
+    stock.aplicar_deltas(deltas)
+    stock.invalidar_cache_stock()
+    resumen_entregas.registrar_items_bulk(creados, actualizados)
+    invalidar_modelo(EntregaItem)
+    snapshots.descartar_fotos(entregas={item.entrega_id for item in creados} | {actual.entrega_id for _, actual in actualizados})
+
+    user = get_current_user()
+    if user and not user.is_authenticated:
+        user = None
+    content_type = ContentType.objects.get_for_model(EntregaItem)
+    logs = [
+        AuditLog(
+            user=user, action='CREATE', content_type=content_type,
+            object_id=item.pk, object_repr=str(item), changes=None,
+        )
+        for item in creados
+    ]
+    for anterior, actual in actualizados:
+        changes = get_changes(anterior, actual)
+        if changes:
+            logs.append(AuditLog(
+                user=user, action='UPDATE', content_type=content_type,
+                object_id=actual.pk, object_repr=str(actual), changes=changes,
+            ))
+    AuditLog.objects.bulk_create(logs)
@@ -0,0 +1,143 @@
+"""
+Stock a una fecha a partir de fotos periódicas (StockSnapshot).
+
+El stock al cierre de un día se calcula desde la foto más cercana anterior (o
+desde cero si no hay ninguna) sumando los movimientos posteriores: compras según
+la fecha de inicio de su orden de compra y entregas según la fecha del remito.
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Max, Q, Subquery, Sum
+from django.db.models.functions import TruncDate
+
+from .models import Bien, Entrega, OrdenDeCompra, OrdenDeCompraItem, EntregaItem, StockBalance, StockSnapshot
+
+CAMPOS = ('comprado', 'entregado', 'valor_comprado', 'valor_entregado')
+
+
+def fecha_ultima_foto(fecha):
+    """Fecha de la foto más reciente en o antes de ``fecha`` (None si no hay)"""
+    return StockSnapshot.objects.filter(fecha__lte=fecha).aggregate(ultima=Max('fecha'))['ultima']
+
+
+def _movimientos(qs, filtro_fecha, desde, hasta):
+    filtro = Q(**{f'{filtro_fecha}__lte': hasta})
+    if desde is not None:
+        filtro &= Q(**{f'{filtro_fecha}__gt': desde})
+    return (
+        qs.filter(filtro)
+        .order_by()
+        .values('bien_id')
+        .annotate(cantidad=Sum('cantidad'), valor=Sum('precio_total'))
+    )
+
+
+def saldos_por_bien_at(fecha, bien_ids=None):
+    """Saldo de cada bien al cierre de ``fecha``.
+
+    Devuelve {bien_id: StockBalance} con instancias sin guardar, para que los
+    reportes las usen igual que ``stock.saldos_por_bien()``.
+    """
+    base = fecha_ultima_foto(fecha)
+    bienes = Bien.objects.all()
+    if bien_ids is not None:
+        bienes = bienes.filter(pk__in=bien_ids)
+    saldos = {
+        bien_id: StockBalance(bien_id=bien_id, **{campo: 0 for campo in CAMPOS})
+        for bien_id in bienes.values_list('pk', flat=True)
+    }
+
+    if base is not None:
+        fotos = StockSnapshot.objects.filter(fecha=base, bien_id__in=saldos.keys())
+        for foto in fotos.values('bien_id', *CAMPOS):
+            saldo = saldos[foto['bien_id']]
+            for campo in CAMPOS:
+                setattr(saldo, campo, foto[campo])
+
+    compras = _movimientos(
+        OrdenDeCompraItem.objects.filter(bien_id__in=saldos.keys()),
+        'orden_de_compra__fecha_inicio', base, fecha,
+    )
+    entregas = _movimientos(
+        EntregaItem.objects.filter(bien_id__in=saldos.keys()),
+        'entrega__fecha__date', base, fecha,
+    )
+    for filas, campo, campo_valor in ((compras, 'comprado', 'valor_comprado'), (entregas, 'entregado', 'valor_entregado')):
+        for fila in filas:
+            saldo = saldos[fila['bien_id']]
+            setattr(saldo, campo, getattr(saldo, campo) + (fila['cantidad'] or 0))
+            setattr(saldo, campo_valor, Decimal(getattr(saldo, campo_valor)) + (fila['valor'] or Decimal('0')))
+
+    for saldo in saldos.values():
+        saldo.stock = saldo.comprado - saldo.entregado
+    return saldos
+
+
+def stock_at(bien, fecha):
+    """Stock de ``bien`` (instancia o id) al cierre de ``fecha``"""
+    bien_id = getattr(bien, 'pk', bien)
+    saldo = saldos_por_bien_at(fecha, bien_ids=[bien_id]).get(bien_id)
+    return saldo.stock if saldo else 0
+
+
+def stock_by_rubro_at(fecha):
+    """Stock total por rubro al cierre de ``fecha``: {rubro_id: stock}.
+
+    Los bienes sin rubro quedan bajo la clave None.
+    """
+    saldos = saldos_por_bien_at(fecha)
+    totales = {}
+    for bien_id, rubro_id in Bien.objects.values_list('pk', 'rubro_id'):
+        if bien_id in saldos:
+            totales[rubro_id] = totales.get(rubro_id, 0) + saldos[bien_id].stock
+    return totales
+
+
+def cierre_mes_anterior(hoy=None):
+    """Último día del mes anterior a ``hoy``"""
+    hoy = hoy or date.today()
+    return hoy.replace(day=1) - timedelta(days=1)
+
+
+def generar_foto(fecha, batch_size=1000):
+    """Guarda la foto de stock al cierre de ``fecha`` (reemplaza la existente)"""
+    saldos = saldos_por_bien_at(fecha)
+    with transaction.atomic():
+        StockSnapshot.objects.filter(fecha=fecha).delete()
+        StockSnapshot.objects.bulk_create(
+            (
+                StockSnapshot(
+                    bien_id=bien_id, fecha=fecha, stock=saldo.stock,
+                    **{campo: getattr(saldo, campo) for campo in CAMPOS},
+                )
+                for bien_id, saldo in saldos.items()
+            ),
+            batch_size=batch_size,
+        )
+    return len(saldos)
+
+
+def descartar_fotos(ordenes=(), entregas=(), desde=None):
+    """Borra las fotos que ya no reflejan los movimientos.
+
+    Un movimiento con fecha anterior a una foto (por ejemplo, al editar un remito
+    viejo) la invalida. Se borran con una sola consulta las fotos con fecha igual o
+    posterior a la de las órdenes de compra / remitos indicados o a ``desde``.
+    """
+    filtro = Q()
+    ordenes = [pk for pk in ordenes if pk]
+    entregas = [pk for pk in entregas if pk]
+    if ordenes:
+        filtro |= Q(fecha__gte=Subquery(
+            OrdenDeCompra.objects.filter(pk__in=ordenes).order_by('fecha_inicio').values('fecha_inicio')[:1]
+        ))
+    if entregas:
+        filtro |= Q(fecha__gte=Subquery(
+            Entrega.objects.filter(pk__in=entregas).annotate(dia=TruncDate('fecha')).order_by('dia').values('dia')[:1]
+        ))
+    if desde is not None:
+        filtro |= Q(fecha__gte=desde)
+    if filtro:
+        StockSnapshot.objects.filter(filtro).delete()
@@ -27,6 +27,40 @@ function actualizarStockBienOrden(row) {
       .catch(() => { stockCell.textContent = '-'; });
   }
 
+// Órdenes con stock precargadas con /api/stock/batch/ al abrir el formulario,
+// para no hacer un pedido por fila. Sólo se usan durante la carga inicial.
+const ordenesPrecargadas = new Map();
+
+function precargarStockBatch(filas) {
+  const bienes = [...new Set(Array.from(filas)
+    .map(row => row.querySelector('.bien-select')?.value)
+    .filter(Boolean))];
+  if (bienes.length === 0) return;
+  const csrf = document.querySelector('input[name="csrfmiddlewaretoken"]');
+  const pedido = fetch('/api/stock/batch/', {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      'X-CSRFToken': csrf ? csrf.value : '',
+    },
+    body: JSON.stringify({ bienes: bienes }),
+  }).then(resp => resp.json());
+  bienes.forEach(function(bienId) {
+    ordenesPrecargadas.set(bienId, pedido
+      .then(data => {
+        const bien = (data.bienes || []).find(b => String(b.bien_id) === bienId);
+        return { ordenes: bien ? bien.ordenes : [] };
+      })
+      .catch(() => fetch(`/api/ordenes_con_stock_bien/${bienId}/`).then(resp => resp.json())));
+  });
+}
+
+function obtenerOrdenesConStock(bienId) {
+  const precargado = ordenesPrecargadas.get(String(bienId));
+  if (precargado) return precargado;
+  return fetch(`/api/ordenes_con_stock_bien/${bienId}/`).then(resp => resp.json());
+}
+
 function actualizarOrdenesDeCompra(row) {
     const bienSelect = row.querySelector('.bien-select');
     const ordenSelect = row.querySelector('.orden-select');
@@ -41,8 +75,7 @@ function actualizarOrdenesDeCompra(row) {
       return;
     }
     
-    fetch(`/api/ordenes_con_stock_bien/${bienId}/`)
-      .then(resp => resp.json())
+    obtenerOrdenesConStock(bienId)
       .then(data => {
         console.log('[DEBUG V6] Respuesta de /api/ordenes_con_stock_bien/', bienId, data);
         if (data.ordenes && data.ordenes.length > 0) {
@@ -587,6 +620,7 @@ document.addEventListener('DOMContentLoaded', function() {
   console.log('[DEBUG] DOMContentLoaded ejecutado');
   const filas = document.querySelectorAll('#items-table-body tr.form-row');
   console.log('[DEBUG] Filas form-row encontradas:', filas.length);
+  precargarStockBatch(filas);
   filas.forEach(function(row) {
     inicializarFilaEntregaBienOrden(row);
     // Agregar validación adicional para filas existentes que ya tienen datos
@@ -599,6 +633,8 @@ document.addEventListener('DOMContentLoaded', function() {
       }, 500);
     }
   });
+  // Los cambios posteriores consultan datos frescos
+  ordenesPrecargadas.clear();
 
   // Actualizar bienes disponibles al cargar la página
   setTimeout(() => {
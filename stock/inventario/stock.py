@@ -0,0 +1,445 @@
+"""
+Mantenimiento y consulta del saldo materializado de stock (StockBalance).
+
+Cada alta, modificación o baja de OrdenDeCompraItem / EntregaItem se traduce en
+deltas sobre dos filas del saldo: la del bien (orden_de_compra nulo) y la del par
+orden de compra / bien. Los deltas se aplican con UPDATE ... SET campo = campo + n
+para que las escrituras concurrentes no se pisen.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import DecimalField, F, FilteredRelation, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
+
+from .cache import bump_data_version, clave_versionada
+from .models import Bien, DivisionDecimal, OrdenDeCompraItem, EntregaItem, StockBalance
+
+CAMPOS_DELTA = ('comprado', 'entregado', 'valor_comprado', 'valor_entregado')
+
+# Nombre del contador de versión que invalida las cachés derivadas del stock
+VERSION_STOCK = 'stock'
+CACHE_TIMEOUT = 60 * 60
+
+
+def _nuevo_delta():
+    return {'comprado': 0, 'entregado': 0, 'valor_comprado': Decimal('0'), 'valor_entregado': Decimal('0')}
+
+
+def acumular_compras(deltas, items, signo=1):
+    """Acumula en ``deltas`` el efecto de uno o más OrdenDeCompraItem"""
+    for item in items:
+        valor = item.precio_total if item.precio_total is not None else item.cantidad * item.precio_unitario
+        for clave in ((item.bien_id, None), (item.bien_id, item.orden_de_compra_id)):
+            deltas[clave]['comprado'] += signo * item.cantidad
+            deltas[clave]['valor_comprado'] += signo * Decimal(valor)
+    return deltas
+
+
+def acumular_entregas(deltas, items, signo=1):
+    """Acumula en ``deltas`` el efecto de uno o más EntregaItem.
+
+    Los ítems sin orden de compra sólo afectan el saldo del bien.
+    """
+    for item in items:
+        valor = item.precio_total if item.precio_total is not None else item.cantidad * item.precio_unitario
+        claves = [(item.bien_id, None)]
+        if item.orden_de_compra_id:
+            claves.append((item.bien_id, item.orden_de_compra_id))
+        for clave in claves:
+            deltas[clave]['entregado'] += signo * item.cantidad
+            deltas[clave]['valor_entregado'] += signo * Decimal(valor)
+    return deltas
+
+
+def nuevos_deltas():
+    return defaultdict(_nuevo_delta)
+
+
+def _aplicar_fila(bien_id, orden_id, delta, crear):
+    qs = StockBalance.objects.filter(bien_id=bien_id, orden_de_compra_id=orden_id)
+    cambios = {campo: F(campo) + delta[campo] for campo in CAMPOS_DELTA}
+    cambios['stock'] = F('stock') + (delta['comprado'] - delta['entregado'])
+    if qs.update(**cambios) or not crear:
+        return
+    try:
+        with transaction.atomic():
+            StockBalance.objects.create(
+                bien_id=bien_id,
+                orden_de_compra_id=orden_id,
+                stock=delta['comprado'] - delta['entregado'],
+                **delta,
+            )
+    except IntegrityError:
+        # Otra transacción creó la fila entre el UPDATE y el INSERT
+        qs.update(**cambios)
+
+
+def aplicar_deltas(deltas, crear=True):
+    """Aplica los deltas acumulados sobre StockBalance en una sola transacción.
+
+    Las filas se actualizan siempre en el mismo orden para evitar interbloqueos
+    entre transacciones que tocan los mismos bienes. Con ``crear=False`` sólo se
+    actualizan filas existentes: es lo que corresponde a las bajas, que pueden
+    llegar en cascada junto con la orden de compra cuyas filas se están borrando.
+    """
+    claves = sorted(
+        (clave for clave, delta in deltas.items() if any(delta[c] for c in CAMPOS_DELTA)),
+        key=lambda c: (c[0], c[1] or 0),
+    )
+    if not claves:
+        return
+    with transaction.atomic():
+        for bien_id, orden_id in claves:
+            _aplicar_fila(bien_id, orden_id, deltas[(bien_id, orden_id)], crear)
+
+
+def invalidar_cache_stock():
+    """Invalida las cachés de stock cuando la transacción en curso confirma"""
+    transaction.on_commit(lambda: bump_data_version(VERSION_STOCK))
+
+
+def registrar_compra(anterior=None, actual=None):
+    """Refleja en el saldo el cambio de un OrdenDeCompraItem (alta, modificación o baja)"""
+    deltas = nuevos_deltas()
+    if anterior is not None:
+        acumular_compras(deltas, [anterior], signo=-1)
+    if actual is not None:
+        acumular_compras(deltas, [actual])
+    aplicar_deltas(deltas, crear=actual is not None)
+
+
+def registrar_entrega(anterior=None, actual=None):
+    """Refleja en el saldo el cambio de un EntregaItem (alta, modificación o baja)"""
+    deltas = nuevos_deltas()
+    if anterior is not None:
+        acumular_entregas(deltas, [anterior], signo=-1)
+    if actual is not None:
+        acumular_entregas(deltas, [actual])
+    aplicar_deltas(deltas, crear=actual is not None)
+
+
+def asegurar_saldo_bien(bien_id):
+    """Crea la fila de saldo del bien si todavía no existe"""
+    try:
+        with transaction.atomic():
+            StockBalance.objects.get_or_create(bien_id=bien_id, orden_de_compra=None)
+    except IntegrityError:
+        pass
+
+
+# --- Consultas ---
+
+def saldos_bien():
+    """QuerySet de los saldos a nivel bien (una fila por bien)"""
+    return StockBalance.objects.filter(orden_de_compra__isnull=True)
+
+
+def saldos_por_bien():
+    """Diccionario bien_id -> StockBalance con el saldo a nivel bien"""
+    return {saldo.bien_id: saldo for saldo in saldos_bien()}
+
+
+MONTO = DecimalField(max_digits=16, decimal_places=2)
+PRECIO = DecimalField(max_digits=16, decimal_places=4)
+CENTAVO = Decimal('0.01')
+DIEZMILESIMO = Decimal('0.0001')
+
+
+def filas_stock_bienes(fecha=None, solo_con_rubro=False):
+    """Una fila por bien para los reportes de stock, ordenadas por rubro y nombre.
+
+    Cada fila es un dict con ``pk``, ``nombre``, ``rubro_id``, ``rubro_nombre``, ``stock``,
+    ``entregado``, ``valor_entregado``, ``precio_promedio`` (promedio ponderado de lo
+    comprado) y ``valor_stock``. Sin ``fecha`` es una única consulta sobre el saldo
+    materializado que calcula precio y valor en la base con Decimal; los bienes sin
+    fila de saldo salen en cero. Con ``fecha`` se parte de ``snapshots.saldos_por_bien_at``
+    y el cálculo es el mismo en Python.
+    """
+    bienes = Bien.objects.order_by('rubro__nombre', 'nombre', 'pk')
+    if solo_con_rubro:
+        bienes = bienes.filter(rubro__isnull=False)
+    campos = ('pk', 'nombre', 'rubro_id')
+
+    if fecha is not None:
+        from .snapshots import saldos_por_bien_at
+        return _filas_stock_at(bienes.values(*campos, rubro_nombre=F('rubro__nombre')), saldos_por_bien_at(fecha))
+
+    return bienes.annotate(
+        saldo=FilteredRelation('saldos', condition=Q(saldos__orden_de_compra__isnull=True)),
+    ).values(
+        *campos,
+        rubro_nombre=F('rubro__nombre'),
+        stock=Coalesce(F('saldo__stock'), 0),
+        entregado=Coalesce(F('saldo__entregado'), 0),
+        valor_entregado=Coalesce(F('saldo__valor_entregado'), Value(Decimal('0')), output_field=MONTO),
+        precio_promedio=Coalesce(
+            Cast(DivisionDecimal(F('saldo__valor_comprado'), NullIf(F('saldo__comprado'), 0)), PRECIO),
+            Value(Decimal('0')), output_field=PRECIO,
+        ),
+        valor_stock=Coalesce(
+            Cast(DivisionDecimal(F('saldo__stock') * F('saldo__valor_comprado'), NullIf(F('saldo__comprado'), 0)), MONTO),
+            Value(Decimal('0')), output_field=MONTO,
+        ),
+    )
+
+
+def _filas_stock_at(bienes, saldos):
+    filas = []
+    for fila in bienes:
+        saldo = saldos.get(fila['pk'])
+        comprado = saldo.comprado if saldo else 0
+        valor_comprado = Decimal(saldo.valor_comprado) if saldo else Decimal('0')
+        stock = saldo.stock if saldo else 0
+        fila.update(
+            stock=stock,
+            entregado=saldo.entregado if saldo else 0,
+            valor_entregado=Decimal(saldo.valor_entregado).quantize(CENTAVO) if saldo else Decimal('0.00'),
+            precio_promedio=(valor_comprado / comprado).quantize(DIEZMILESIMO) if comprado else Decimal('0'),
+            valor_stock=(stock * valor_comprado / comprado).quantize(CENTAVO) if comprado else Decimal('0.00'),
+        )
+        filas.append(fila)
+    return filas
+
+
+def umbral_stock_bajo():
+    """Umbral de stock bajo de los bienes y rubros que no tienen ``stock_minimo``"""
+    return getattr(settings, 'STOCK_BAJO_UMBRAL', 10)
+
+
+def bienes_bajo_stock(rubro=None):
+    """Bienes con stock menor o igual a su umbral, del menor stock al mayor.
+
+    El umbral es el ``stock_minimo`` del bien, si no el de su rubro y si no
+    ``STOCK_BAJO_UMBRAL``. Es una sola consulta sobre el saldo materializado (los
+    bienes sin fila de saldo cuentan con stock cero) que anota ``stock`` y ``umbral``,
+    así que paginarla con Paginator hace el COUNT y el LIMIT en la base.
+    """
+    bienes = Bien.objects.all()
+    if rubro is not None:
+        bienes = bienes.filter(rubro=rubro)
+    return bienes.annotate(
+        saldo=FilteredRelation('saldos', condition=Q(saldos__orden_de_compra__isnull=True)),
+        stock=Coalesce(F('saldo__stock'), 0),
+        umbral=Coalesce(F('stock_minimo'), F('rubro__stock_minimo'), Value(umbral_stock_bajo())),
+    ).filter(stock__lte=F('umbral')).order_by('stock', 'nombre', 'pk')
+
+
+def stock_bien(bien_id):
+    saldo = saldos_bien().filter(bien_id=bien_id).values_list('stock', flat=True).first()
+    return saldo or 0
+
+
+def bienes_con_stock():
+    """Lista de (id, nombre) de los bienes con stock disponible.
+
+    Se resuelve con una sola consulta sobre el saldo y se guarda en caché hasta
+    que cambie alguna compra o entrega.
+    """
+    clave = clave_versionada(VERSION_STOCK, 'bienes_con_stock')
+    bienes = cache.get(clave)
+    if bienes is None:
+        bienes = list(
+            saldos_bien()
+            .filter(stock__gt=0)
+            .order_by('bien_id')
+            .values_list('bien_id', 'bien__nombre')
+        )
+        cache.set(clave, bienes, CACHE_TIMEOUT)
+    return bienes
+
+
+def stock_orden_bien(orden_id, bien_id):
+    saldo = (
+        StockBalance.objects
+        .filter(orden_de_compra_id=orden_id, bien_id=bien_id)
+        .values_list('stock', flat=True)
+        .first()
+    )
+    return saldo or 0
+
+
+def _filtro_pares(pares):
+    filtro = Q()
+    for orden_id, bien_id in pares:
+        filtro |= Q(orden_de_compra_id=orden_id, bien_id=bien_id)
+    return filtro
+
+
+def _precio_orden_bien():
+    """Subconsulta con el precio unitario del bien en la orden de compra de la fila de saldo"""
+    return (
+        OrdenDeCompraItem.objects
+        .filter(orden_de_compra=OuterRef('orden_de_compra'), bien=OuterRef('bien'))
+        .order_by('pk')
+        .values('precio_unitario')[:1]
+    )
+
+
+def texto_precio(precio):
+    """Precio con dos decimales como texto ('' si no hay precio).
+
+    SQLite devuelve el resultado de la subconsulta sin la escala del campo.
+    """
+    if precio is None:
+        return ''
+    return str(Decimal(precio).quantize(Decimal('0.01')))
+
+
+def saldos_para_entrega(pares):
+    """Bloquea y devuelve el saldo de los pares (orden_id, bien_id) indicados.
+
+    Una sola consulta sobre StockBalance con ``select_for_update``: otra entrega
+    sobre los mismos pares espera a que termine la transacción en curso, así que
+    debe llamarse dentro de ``transaction.atomic()``. Devuelve
+    {(orden_id, bien_id): {'comprado', 'entregado', 'precio_unitario'}}; los pares
+    sin compra registrada no aparecen.
+    """
+    if not pares:
+        return {}
+    filas = (
+        StockBalance.objects
+        .select_for_update()
+        .filter(_filtro_pares(pares), comprado__gt=0)
+        .annotate(precio_unitario=Subquery(_precio_orden_bien()))
+        .order_by('bien_id', 'orden_de_compra_id')
+        .values('orden_de_compra_id', 'bien_id', 'comprado', 'entregado', 'precio_unitario')
+    )
+    return {
+        (fila['orden_de_compra_id'], fila['bien_id']): fila
+        for fila in filas
+    }
+
+
+def saldos_pares(pares, rubro=None):
+    """Stock y precio de varios pares (orden_id, bien_id) en una sola consulta.
+
+    Devuelve {(orden_id, bien_id): {'stock', 'precio_unitario'}}; los pares sin
+    compra registrada (o de órdenes fuera de ``rubro``) no aparecen.
+    """
+    if not pares:
+        return {}
+    filas = StockBalance.objects.filter(_filtro_pares(pares), comprado__gt=0)
+    if rubro is not None:
+        filas = filas.filter(orden_de_compra__rubro=rubro)
+    filas = (
+        filas
+        .annotate(precio_unitario=Subquery(_precio_orden_bien()))
+        .values('orden_de_compra_id', 'bien_id', 'stock', 'precio_unitario')
+    )
+    return {(fila['orden_de_compra_id'], fila['bien_id']): fila for fila in filas}
+
+
+def ordenes_con_stock(bien_ids, rubro=None):
+    """Órdenes de compra con stock disponible para cada bien, en una sola consulta.
+
+    Devuelve {bien_id: [{'id', 'numero', 'disponible', 'precio_unitario'}]} con las
+    órdenes ordenadas por id; los bienes sin órdenes disponibles no aparecen.
+    """
+    if not bien_ids:
+        return {}
+    filas = StockBalance.objects.filter(bien_id__in=bien_ids, orden_de_compra__isnull=False, stock__gt=0)
+    if rubro is not None:
+        filas = filas.filter(orden_de_compra__rubro=rubro)
+    filas = (
+        filas
+        .annotate(precio_unitario=Subquery(_precio_orden_bien()))
+        .order_by('bien_id', 'orden_de_compra_id')
+        .values('bien_id', 'orden_de_compra_id', 'orden_de_compra__numero', 'stock', 'precio_unitario')
+    )
+    ordenes = defaultdict(list)
+    for fila in filas:
+        ordenes[fila['bien_id']].append({
+            'id': fila['orden_de_compra_id'],
+            'numero': f"OC #{fila['orden_de_compra__numero']}",
+            'disponible': fila['stock'],
+            'precio_unitario': texto_precio(fila['precio_unitario']),
+        })
+    return ordenes
+
+
+def ordenes_con_stock_bien(bien_id, rubro=None):
+    """Órdenes de compra con stock disponible para un bien, cacheadas por (bien, rubro).
+
+    La clave incluye la versión de datos de stock: cualquier compra o entrega nueva
+    deja la entrada vieja sin uso.
+    """
+    clave = clave_versionada(VERSION_STOCK, 'ordenes_con_stock', bien_id, rubro.pk if rubro else 'todos')
+    ordenes = cache.get(clave)
+    if ordenes is None:
+        ordenes = ordenes_con_stock([bien_id], rubro=rubro).get(bien_id, [])
+        cache.set(clave, ordenes, CACHE_TIMEOUT)
+    return ordenes
+
+
+# --- Reconstrucción ---
+
+def calcular_saldos():
+    """Recalcula los saldos desde las tablas de movimientos con consultas agrupadas.
+
+    Devuelve un diccionario (bien_id, orden_id) -> valores, incluyendo una fila
+    en cero para cada bien sin movimientos.
+    """
+    esperado = defaultdict(_nuevo_delta)
+    for bien_id in Bien.objects.values_list('id', flat=True):
+        esperado[(bien_id, None)]
+    grupos = (
+        (OrdenDeCompraItem.objects.values('bien_id'), 'comprado', 'valor_comprado', False),
+        (OrdenDeCompraItem.objects.values('bien_id', 'orden_de_compra_id'), 'comprado', 'valor_comprado', True),
+        (EntregaItem.objects.values('bien_id'), 'entregado', 'valor_entregado', False),
+        (
+            EntregaItem.objects.filter(orden_de_compra__isnull=False).values('bien_id', 'orden_de_compra_id'),
+            'entregado', 'valor_entregado', True,
+        ),
+    )
+    for qs, campo, campo_valor, por_orden in grupos:
+        for fila in qs.order_by().annotate(cantidad=Sum('cantidad'), valor=Sum('precio_total')):
+            clave = (fila['bien_id'], fila['orden_de_compra_id'] if por_orden else None)
+            esperado[clave][campo] = fila['cantidad'] or 0
+            esperado[clave][campo_valor] = fila['valor'] or Decimal('0')
+    for valores in esperado.values():
+        valores['stock'] = valores['comprado'] - valores['entregado']
+    return esperado
+
+
+def diferencias_saldos(esperado=None):
+    """Compara StockBalance con los saldos recalculados.
+
+    Devuelve una lista de (clave, actual, esperado); ``actual`` es None si falta la fila
+    y ``esperado`` es None si la fila sobra.
+    """
+    if esperado is None:
+        esperado = calcular_saldos()
+    campos = ('stock',) + CAMPOS_DELTA
+    actuales = {
+        (fila['bien_id'], fila['orden_de_compra_id']): fila
+        for fila in StockBalance.objects.values('bien_id', 'orden_de_compra_id', *campos)
+    }
+    diferencias = []
+    for clave, valores in esperado.items():
+        actual = actuales.pop(clave, None)
+        if actual is None or any(actual[c] != valores[c] for c in campos):
+            diferencias.append((clave, actual, valores))
+    for clave, actual in actuales.items():
+        diferencias.append((clave, actual, None))
+    return diferencias
+
+
+def reconstruir_saldos(esperado=None, batch_size=1000):
+    """Reemplaza el contenido de StockBalance por los saldos recalculados"""
+    if esperado is None:
+        esperado = calcular_saldos()
+    with transaction.atomic():
+        StockBalance.objects.all().delete()
+        StockBalance.objects.bulk_create(
+            (
+                StockBalance(bien_id=bien_id, orden_de_compra_id=orden_id, **valores)
+                for (bien_id, orden_id), valores in esperado.items()
+            ),
+            batch_size=batch_size,
+        )
+        invalidar_cache_stock()
+    return len(esperado)
@@ -2,8 +2,8 @@ from django.test import TestCase
 from django.contrib.auth.models import User
 from django.utils import timezone
 from decimal import Decimal
-from .models import Rubro, Bien, OrdenDeCompra, OrdenDeCompraItem, Entrega, EntregaItem, Servicio, ServicioPago, AuditLog
-from django.db.models import Sum
+from .models import Rubro, Bien, OrdenDeCompra, OrdenDeCompraItem, Entrega, EntregaItem, Servicio, ServicioPago, AuditLog, StockBalance
+from django.db.models import F, Sum
 
 class RubroModelTest(TestCase):
     def setUp(self):
@@ -137,6 +137,1364 @@ class StockCalculationTest(TestCase):
         stock = self.orden_item.cantidad - entregado
         self.assertEqual(stock, 70)
 
+class StockBalanceTest(TestCase):
+    def setUp(self):
+        self.rubro = Rubro.objects.create(nombre="UTILIDADES")
+        self.bien = Bien.objects.create(nombre="LAPIZ HB", rubro=self.rubro)
+        self.orden = OrdenDeCompra.objects.create(numero="OC001", fecha_inicio=timezone.now().date())
+        self.orden_item = OrdenDeCompraItem.objects.create(
+            orden_de_compra=self.orden,
+            bien=self.bien,
+            cantidad=100,
+            precio_unitario=Decimal("10.00")
+        )
+        self.entrega = Entrega.objects.create(area_persona="DEPTO. INFORMATICA", orden_de_compra=self.orden)
+
+    def saldo(self, orden=None):
+        return StockBalance.objects.get(bien=self.bien, orden_de_compra=orden)
+
+    def test_saldo_compra(self):
+        self.assertEqual(self.saldo().stock, 100)
+        self.assertEqual(self.saldo(self.orden).comprado, 100)
+        self.assertEqual(self.saldo().valor_comprado, Decimal("1000.00"))
+
+    def test_saldo_entrega_modificacion_y_baja(self):
+        item = EntregaItem.objects.create(
+            entrega=self.entrega, orden_de_compra=self.orden, bien=self.bien,
+            cantidad=30, precio_unitario=Decimal("10.00")
+        )
+        self.assertEqual(self.saldo().stock, 70)
+        self.assertEqual(self.saldo(self.orden).stock, 70)
+
+        item.cantidad = 40
+        item.save()
+        self.assertEqual(self.saldo().stock, 60)
+        self.assertEqual(self.saldo(self.orden).entregado, 40)
+
+        item.delete()
+        self.assertEqual(self.saldo().stock, 100)
+        self.assertEqual(self.saldo(self.orden).valor_entregado, Decimal("0.00"))
+
+    def test_bien_sin_movimientos_tiene_saldo(self):
+        bien = Bien.objects.create(nombre="GOMA", rubro=self.rubro)
+        self.assertEqual(StockBalance.objects.get(bien=bien, orden_de_compra=None).stock, 0)
+
+    def test_baja_de_orden_elimina_saldos_de_la_orden(self):
+        self.orden.delete()
+        self.assertFalse(StockBalance.objects.filter(orden_de_compra__isnull=False).exists())
+        self.assertEqual(self.saldo().stock, 0)
+
+    def test_rebuild_stock_corrige_diferencias(self):
+        from io import StringIO
+        from django.core.management import call_command
+        StockBalance.objects.filter(bien=self.bien).update(stock=5)
+        out = StringIO()
+        call_command('rebuild_stock', stdout=out)
+        self.assertIn('diferencias', out.getvalue())
+        self.assertEqual(self.saldo().stock, 100)
+        self.assertEqual(self.saldo(self.orden).stock, 100)
+
+class BienQuerySetTest(TestCase):
+    def setUp(self):
+        self.rubro = Rubro.objects.create(nombre="UTILIDADES")
+        self.bien = Bien.objects.create(nombre="LAPIZ HB", rubro=self.rubro)
+        self.sin_movimientos = Bien.objects.create(nombre="GOMA", rubro=self.rubro)
+        orden = OrdenDeCompra.objects.create(numero="OC001", fecha_inicio=timezone.now().date())
+        for cantidad, precio in ((30, "10.00"), (70, "1.00")):
+            OrdenDeCompraItem.objects.create(
+                orden_de_compra=orden, bien=self.bien, cantidad=cantidad, precio_unitario=Decimal(precio)
+            )
+        entrega = Entrega.objects.create(area_persona="DEPTO. INFORMATICA", orden_de_compra=orden)
+        for cantidad in (20, 30):
+            EntregaItem.objects.create(
+                entrega=entrega, orden_de_compra=orden, bien=self.bien,
+                cantidad=cantidad, precio_unitario=Decimal("1.00")
+            )
+
+    def test_with_stock_no_multiplica_filas(self):
+        bien = Bien.objects.with_stock().get(pk=self.bien.pk)
+        self.assertEqual((bien.comprado, bien.entregado, bien.stock), (100, 50, 50))
+        self.assertEqual(Bien.objects.with_stock().get(pk=self.sin_movimientos.pk).stock, 0)
+
+    def test_with_valuation(self):
+        bien = Bien.objects.with_valuation().get(pk=self.bien.pk)
+        self.assertEqual(bien.valor_comprado, Decimal("370.00"))
+        self.assertEqual(bien.precio_promedio, Decimal("3.7000"))
+        self.assertEqual(bien.valor_stock, Decimal("185.00"))
+
+    def test_low_stock(self):
+        self.assertEqual(list(Bien.objects.low_stock(10)), [self.sin_movimientos])
+        self.assertEqual(list(Bien.objects.low_stock(50)), [self.sin_movimientos, self.bien])
+
+    def test_with_stock_una_consulta(self):
+        with self.assertNumQueries(1):
+            list(Bien.objects.with_valuation())
+
+class BienesConStockTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = User.objects.create_superuser(username='admin', password='12345')
+        self.client.login(username='admin', password='12345')
+        self.rubro = Rubro.objects.create(nombre="UTILIDADES")
+        self.orden = OrdenDeCompra.objects.create(numero="OC001", fecha_inicio=timezone.now().date())
+        self.bienes = []
+        for i in range(5):
+            bien = Bien.objects.create(nombre=f"BIEN {i}", rubro=self.rubro)
+            OrdenDeCompraItem.objects.create(
+                orden_de_compra=self.orden, bien=bien, cantidad=10, precio_unitario=Decimal("1.00")
+            )
+            self.bienes.append(bien)
+        Bien.objects.create(nombre="SIN STOCK", rubro=self.rubro)
+
+    def test_lista_cacheada_e_invalidada(self):
+        from .stock import bienes_con_stock
+        self.assertEqual([nombre for _, nombre in bienes_con_stock()], [b.nombre for b in self.bienes])
+        with self.assertNumQueries(0):
+            bienes_con_stock()
+        entrega = Entrega.objects.create(area_persona="DEPTO")
+        with self.captureOnCommitCallbacks(execute=True):
+            EntregaItem.objects.create(
+                entrega=entrega, orden_de_compra=self.orden, bien=self.bienes[0],
+                cantidad=10, precio_unitario=Decimal("1.00")
+            )
+        self.assertNotIn(self.bienes[0].pk, [bien_id for bien_id, _ in bienes_con_stock()])
+
+    def test_formulario_entrega_no_consulta_stock_por_bien(self):
+        response = self.client.get('/entrega/nueva/')
+        self.assertContains(response, 'BIEN 4')
+        self.assertNotContains(response, 'SIN STOCK')
+        for i in range(5, 20):
+            bien = Bien.objects.create(nombre=f"BIEN {i}", rubro=self.rubro)
+            OrdenDeCompraItem.objects.create(
+                orden_de_compra=self.orden, bien=bien, cantidad=10, precio_unitario=Decimal("1.00")
+            )
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/entrega/nueva/')
+        queries_antes = len(ctx.captured_queries)
+        Bien.objects.create(nombre="OTRO SIN STOCK", rubro=self.rubro)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/entrega/nueva/')
+        self.assertEqual(len(ctx.captured_queries), queries_antes)
+
+class EntregaStockValidacionTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = User.objects.create_superuser(username='admin', password='12345')
+        self.client.login(username='admin', password='12345')
+        self.rubro = Rubro.objects.create(nombre="UTILIDADES")
+        self.bien = Bien.objects.create(nombre="LAPIZ HB", rubro=self.rubro)
+        self.orden = OrdenDeCompra.objects.create(numero="OC001", fecha_inicio=timezone.now().date())
+        OrdenDeCompraItem.objects.create(
+            orden_de_compra=self.orden, bien=self.bien, cantidad=10, precio_unitario=Decimal("2.50")
+        )
+
+    def datos(self, filas, iniciales=0):
+        data = {
+            'area_persona': 'DEPTO. INFORMATICA',
+            'observaciones': '',
+            'orden_de_compra': '',
+            'items-TOTAL_FORMS': str(len(filas)),
+            'items-INITIAL_FORMS': str(iniciales),
+            'items-MIN_NUM_FORMS': '0',
+            'items-MAX_NUM_FORMS': '1000',
+        }
+        for i, fila in enumerate(filas):
+            for campo, valor in fila.items():
+                data[f'items-{i}-{campo}'] = valor
+        return data
+
+    def fila(self, cantidad, **extra):
+        return {'orden_de_compra': self.orden.pk, 'bien': self.bien.pk, 'cantidad': cantidad, **extra}
+
+    def post(self, url, data):
+        # El formulario se envía por AJAX y responde JSON
+        return self.client.post(url, data, HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+
+    def stock(self):
+        return StockBalance.objects.get(bien=self.bien, orden_de_compra=None).stock
+
+    def test_filas_del_mismo_par_se_validan_juntas(self):
+        response = self.post('/entrega/nueva/', self.datos([self.fila(6), self.fila(6)]))
+        self.assertFalse(response['success'])
+        self.assertIn('excede el stock disponible (4)', response['errors']['formset'][1]['cantidad'][0])
+        self.assertFalse(Entrega.objects.exists())
+        self.assertEqual(self.stock(), 10)
+
+    def test_entrega_valida_actualiza_saldo_y_auditoria(self):
+        response = self.post('/entrega/nueva/', self.datos([self.fila(4), self.fila(6)]))
+        self.assertTrue(response['success'])
+        items = EntregaItem.objects.all()
+        self.assertEqual(items.count(), 2)
+        self.assertEqual(sum(item.precio_total for item in items), Decimal("25.00"))
+        self.assertEqual(self.stock(), 0)
+        self.assertEqual(AuditLog.objects.filter(action='CREATE', object_id__in=items.values('pk'), content_type__model='entregaitem').count(), 2)
+
+    def test_editar_libera_el_stock_propio(self):
+        entrega = Entrega.objects.create(area_persona="DEPTO")
+        item = EntregaItem.objects.create(
+            entrega=entrega, orden_de_compra=self.orden, bien=self.bien,
+            cantidad=8, precio_unitario=Decimal("2.50")
+        )
+        response = self.post(
+            f'/entrega/{entrega.pk}/editar/',
+            self.datos([self.fila(10, id=item.pk, entrega=entrega.pk)], iniciales=1),
+        )
+        self.assertTrue(response['success'])
+        item.refresh_from_db()
+        self.assertEqual(item.cantidad, 10)
+        self.assertEqual(self.stock(), 0)
+        self.assertTrue(AuditLog.objects.filter(action='UPDATE', object_id=item.pk).exists())
+
+class StockBatchAPITest(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import Group
+        self.rubro = Rubro.objects.create(nombre="UTILIDADES")
+        self.otro_rubro = Rubro.objects.create(nombre="LIMPIEZA")
+        self.orden = OrdenDeCompra.objects.create(numero="OC001", fecha_inicio=timezone.now().date(), rubro=self.rubro)
+        self.orden_ajena = OrdenDeCompra.objects.create(numero="OC002", fecha_inicio=timezone.now().date(), rubro=self.otro_rubro)
+        self.bienes = []
+        for i in range(3):
+            bien = Bien.objects.create(nombre=f"BIEN {i}", rubro=self.rubro)
+            for orden in (self.orden, self.orden_ajena):
+                OrdenDeCompraItem.objects.create(
+                    orden_de_compra=orden, bien=bien, cantidad=10, precio_unitario=Decimal("1.50")
+                )
+            self.bienes.append(bien)
+        self.user = User.objects.create_user(username='operador', password='12345')
+        self.user.groups.add(Group.objects.create(name='Rubro: UTILIDADES'))
+        self.client.login(username='operador', password='12345')
+
+    def post(self, datos):
+        import json
+        return self.client.post('/api/stock/batch/', json.dumps(datos), content_type='application/json')
+
+    def test_batch_filtra_por_rubro(self):
+        bien = self.bienes[0]
+        data = self.post({'bienes': [bien.pk], 'pares': [[self.orden.pk, bien.pk], [self.orden_ajena.pk, bien.pk]]}).json()
+        self.assertEqual(data['bienes'][0]['stock'], 20)
+        self.assertEqual([o['id'] for o in data['bienes'][0]['ordenes']], [self.orden.pk])
+        self.assertEqual(data['bienes'][0]['ordenes'][0]['precio_unitario'], '1.50')
+        propio, ajeno = sorted(data['pares'], key=lambda p: p['orden_id'])
+        self.assertEqual((propio['stock'], propio['precio']), (10, '1.50'))
+        self.assertFalse(ajeno['encontrado'])
+
+    def test_batch_consultas_constantes(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        def consultas(bienes):
+            with CaptureQueriesContext(connection) as ctx:
+                self.post({'bienes': [b.pk for b in bienes], 'pares': [[self.orden.pk, b.pk] for b in bienes]})
+            return len(ctx.captured_queries)
+        self.assertEqual(consultas(self.bienes[:1]), consultas(self.bienes))
+
+    def test_ordenes_con_stock_bien_cacheado(self):
+        from django.core.cache import cache
+        cache.clear()
+        bien = self.bienes[0]
+        url = f'/api/ordenes_con_stock_bien/{bien.pk}/'
+        self.assertEqual([o['id'] for o in self.client.get(url).json()['ordenes']], [self.orden.pk])
+        from .stock import ordenes_con_stock_bien
+        with self.assertNumQueries(0):
+            ordenes_con_stock_bien(bien.pk, rubro=self.rubro)
+        entrega = Entrega.objects.create(area_persona="DEPTO")
+        with self.captureOnCommitCallbacks(execute=True):
+            EntregaItem.objects.create(
+                entrega=entrega, orden_de_compra=self.orden, bien=bien,
+                cantidad=10, precio_unitario=Decimal("1.50")
+            )
+        self.assertEqual(self.client.get(url).json()['ordenes'], [])
+
+    def test_batch_formato_invalido(self):
+        self.assertEqual(self.post({'pares': [1, 2]}).status_code, 400)
+        self.assertEqual(self.client.get('/api/stock/batch/').status_code, 405)
+
+class StockSnapshotTest(TestCase):
+    def setUp(self):
+        from datetime import date, datetime
+        self.rubro = Rubro.objects.create(nombre="UTILIDADES")
+        self.bien = Bien.objects.create(nombre="LAPIZ HB", rubro=self.rubro)
+        self.orden = OrdenDeCompra.objects.create(numero="OC001", fecha_inicio=date(2024, 1, 10))
+        OrdenDeCompraItem.objects.create(
+            orden_de_compra=self.orden, bien=self.bien, cantidad=100, precio_unitario=Decimal("2.00")
+        )
+        self.entrega_enero = self.entregar(30, datetime(2024, 1, 20, 12))
+        self.entregar(20, datetime(2024, 2, 15, 12))
+
+    def entregar(self, cantidad, fecha):
+        entrega = Entrega.objects.create(area_persona="DEPTO")
+        Entrega.objects.filter(pk=entrega.pk).update(fecha=timezone.make_aware(fecha))
+        EntregaItem.objects.create(
+            entrega=entrega, orden_de_compra=self.orden, bien=self.bien,
+            cantidad=cantidad, precio_unitario=Decimal("2.00")
+        )
+        return entrega
+
+    def test_stock_at_sin_fotos(self):
+        from datetime import date
+        from .snapshots import stock_at, stock_by_rubro_at
+        self.assertEqual(stock_at(self.bien, date(2024, 1, 9)), 0)
+        self.assertEqual(stock_at(self.bien, date(2024, 1, 31)), 70)
+        self.assertEqual(stock_at(self.bien.pk, date(2024, 2, 29)), 50)
+        self.assertEqual(stock_by_rubro_at(date(2024, 1, 31)), {self.rubro.pk: 70})
+
+    def test_foto_y_movimientos_posteriores(self):
+        from datetime import date
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import StockSnapshot
+        from .snapshots import stock_at
+        call_command('snapshot_stock', fecha='2024-01-31', stdout=StringIO())
+        foto = StockSnapshot.objects.get(bien=self.bien, fecha=date(2024, 1, 31))
+        self.assertEqual((foto.stock, foto.valor_entregado), (70, Decimal("60.00")))
+        # El cálculo parte de la foto: alterarla se refleja en las fechas posteriores
+        StockSnapshot.objects.filter(pk=foto.pk).update(comprado=110)
+        self.assertEqual(stock_at(self.bien, date(2024, 2, 29)), 60)
+
+    def test_movimiento_anterior_descarta_fotos(self):
+        from datetime import date
+        from .models import StockSnapshot
+        from .snapshots import generar_foto, stock_at
+        generar_foto(date(2024, 1, 31))
+        generar_foto(date(2023, 12, 31))
+        item = self.entrega_enero.items.get()
+        item.cantidad = 40
+        item.save()
+        self.assertEqual(list(StockSnapshot.objects.values_list('fecha', flat=True)), [date(2023, 12, 31)])
+        self.assertEqual(stock_at(self.bien, date(2024, 1, 31)), 60)
+
+    def test_reporte_stock_bien_a_fecha(self):
+        User.objects.create_superuser(username='admin', password='12345')
+        self.client.login(username='admin', password='12345')
+        response = self.client.get('/reportes/stock_bien/?fecha=2024-01-31')
+        self.assertEqual(response.context['page_obj'].object_list[0]['stock'], 70)
+        response = self.client.get('/reportes/stock_bien/')
+        self.assertEqual(response.context['page_obj'].object_list[0]['stock'], 50)
+
+    def test_filas_stock_con_decimal(self):
+        from datetime import date
+        from .stock import filas_stock_bienes
+        OrdenDeCompraItem.objects.create(
+            orden_de_compra=OrdenDeCompra.objects.create(numero="OC002", fecha_inicio=date(2024, 3, 1)), bien=self.bien,
+            cantidad=3, precio_unitario=Decimal("1.00"),
+        )
+        Bien.objects.create(nombre="SIN MOVIMIENTOS", rubro=self.rubro)
+        filas = list(filas_stock_bienes())
+        self.assertEqual([f['nombre'] for f in filas], ["LAPIZ HB", "SIN MOVIMIENTOS"])
+        # 203 / 103 = 1.9709 por unidad; 53 en stock
+        self.assertEqual(Decimal(filas[0]['precio_promedio']).quantize(Decimal('0.0001')), Decimal('1.9709'))
+        self.assertEqual(Decimal(filas[0]['valor_stock']).quantize(Decimal('0.01')), Decimal('104.46'))
+        self.assertEqual((filas[1]['stock'], filas[1]['valor_stock']), (0, 0))
+        al_31 = filas_stock_bienes(date(2024, 1, 31))
+        self.assertEqual((al_31[0]['stock'], al_31[0]['valor_stock']), (70, Decimal('140.00')))
+
+    def test_reporte_stock_rubro_agrupado(self):
+        User.objects.create_superuser(username='admin', password='12345')
+        self.client.login(username='admin', password='12345')
+        otro = Rubro.objects.create(nombre="ALIMENTOS")
+        Bien.objects.create(nombre="ARROZ", rubro=otro)
+        response = self.client.get('/reportes/stock_rubro/')
+        grupos = [(g['rubro'].nombre, [b['nombre'] for b in g['bienes']]) for g in response.context['data']]
+        self.assertEqual(grupos, [("ALIMENTOS", ["ARROZ"]), ("UTILIDADES", ["LAPIZ HB"])])
+        response = self.client.get('/reportes/stock_rubro/?export=pdf')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        response = self.client.get('/reportes/stock_rubro/?export=excel&fecha=2024-01-31')
+        self.assertIn('stock_por_rubro_20240131.xlsx', response['Content-Disposition'])
+        from io import BytesIO
+        from openpyxl import load_workbook
+        hoja = load_workbook(BytesIO(b''.join(response.streaming_content))).active
+        self.assertEqual([c.value for c in hoja[3]], ["UTILIDADES", "LAPIZ HB", 70, 140, 30, 60])
+
+class KardexTest(TestCase):
+    def setUp(self):
+        from datetime import date, datetime
+        self.bien = Bien.objects.create(nombre="LAPIZ HB")
+        for numero, fecha, cantidad in (("OC001", date(2024, 1, 10), 100), ("OC002", date(2024, 2, 1), 50)):
+            orden = OrdenDeCompra.objects.create(numero=numero, fecha_inicio=fecha)
+            OrdenDeCompraItem.objects.create(
+                orden_de_compra=orden, bien=self.bien, cantidad=cantidad, precio_unitario=Decimal("2.00")
+            )
+        for cantidad, fecha in ((30, datetime(2024, 1, 20, 12)), (20, datetime(2024, 2, 15, 12))):
+            entrega = Entrega.objects.create(area_persona="DEPTO")
+            Entrega.objects.filter(pk=entrega.pk).update(fecha=timezone.make_aware(fecha))
+            EntregaItem.objects.create(entrega=entrega, bien=self.bien, cantidad=cantidad, precio_unitario=Decimal("2.00"))
+
+    def test_saldo_acumulado_por_paginas(self):
+        from .kardex import pagina_kardex
+        movimientos, cursor = pagina_kardex(self.bien.pk, por_pagina=3)
+        self.assertEqual([m['saldo'] for m in movimientos], [100, 70, 120])
+        self.assertEqual([m['tipo_nombre'] for m in movimientos], ['INGRESO', 'EGRESO', 'INGRESO'])
+        movimientos, siguiente = pagina_kardex(self.bien.pk, cursor=cursor, por_pagina=3)
+        self.assertEqual([(m['egreso'], m['saldo']) for m in movimientos], [(20, 100)])
+        self.assertIsNone(siguiente)
+
+    def test_cursor_adulterado_vuelve_al_inicio(self):
+        from .kardex import pagina_kardex
+        movimientos, _ = pagina_kardex(self.bien.pk, cursor='no-valido', por_pagina=1)
+        self.assertEqual(movimientos[0]['saldo'], 100)
+
+    def test_vista_y_exportacion(self):
+        from io import BytesIO
+        from openpyxl import load_workbook
+        User.objects.create_superuser(username='admin', password='12345')
+        self.client.login(username='admin', password='12345')
+        response = self.client.get('/reportes/kardex/', {'bien': self.bien.pk})
+        self.assertEqual(len(response.context['movimientos']), 4)
+        response = self.client.get('/reportes/kardex/', {'bien': self.bien.pk, 'export': 'excel'})
+        libro = load_workbook(BytesIO(b''.join(response.streaming_content)))
+        filas = list(libro.active.values)
+        self.assertEqual(filas[0][0], 'Fecha')
+        self.assertEqual([fila[7] for fila in filas[1:]], [100, 70, 120, 100])
+
+class MotorReportesTest(TestCase):
+    def setUp(self):
+        from datetime import date
+        User.objects.create_user(username='testuser', password='12345')
+        self.client.login(username='testuser', password='12345')
+        for nombre, proveedor, costo in (("AGUA", "ACME", "100.00"), ("LUZ", "ACME", "50.50"), ("GAS", "BETA", "20.00")):
+            Servicio.objects.create(
+                nombre=nombre, proveedor=proveedor, frecuencia='MENSUAL',
+                costo_mensual=Decimal(costo), fecha_inicio=date(2024, 1, 1),
+            )
+
+    def test_html_con_totales(self):
+        response = self.client.get('/reportes/servicios_proveedor/')
+        self.assertTemplateUsed(response, 'inventario/reporte_tabla.html')
+        celdas = [[texto for texto, _ in fila['celdas']] for fila in response.context['filas']]
+        self.assertEqual(celdas, [['ACME', '2', '150.50'], ['BETA', '1', '20.00']])
+        self.assertEqual(response.context['totales'], ['TOTAL', '3', '170.50'])
+
+    def test_exportaciones(self):
+        from io import BytesIO
+        from openpyxl import load_workbook
+        response = self.client.get('/reportes/servicios_proveedor/', {'export': 'csv'})
+        lineas = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(lineas, [
+            'Proveedor,Cantidad de Servicios,Costo Total Mensual ($)',
+            'ACME,2,150.50', 'BETA,1,20.00', 'TOTAL,3,170.50',
+        ])
+        response = self.client.get('/reportes/servicios_proveedor/', {'export': 'excel'})
+        filas = list(load_workbook(BytesIO(b''.join(response.streaming_content))).active.values)
+        self.assertEqual(filas[-1], ('TOTAL', 3, Decimal('170.50')))
+        response = self.client.get('/reportes/servicios_proveedor/', {'export': 'pdf'})
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+    def test_ranking_ordenado(self):
+        rubro = Rubro.objects.create(nombre="LIBRERIA")
+        entrega = Entrega.objects.create(area_persona="DEPTO")
+        for nombre, cantidad in (("LAPIZ", 5), ("GOMA", 12)):
+            bien = Bien.objects.create(nombre=nombre, rubro=rubro)
+            EntregaItem.objects.create(entrega=entrega, bien=bien, cantidad=cantidad, precio_unitario=Decimal("1.00"))
+        response = self.client.get('/reportes/ranking_bienes/')
+        self.assertEqual([fila['celdas'][1][0] for fila in response.context['filas']], ['GOMA', 'LAPIZ'])
+        response = self.client.get('/reportes/ranking_proveedores/')
+        self.assertEqual(response.context['filas'][0]['celdas'][1][0], '(Sin proveedor)')
+
+    def test_ranking_top_periodo_y_variacion(self):
+        from datetime import datetime
+        from django.core.cache import cache
+        cache.clear()
+        libreria = Rubro.objects.create(nombre="LIBRERIA")
+        limpieza = Rubro.objects.create(nombre="LIMPIEZA")
+        bienes = {nombre: Bien.objects.create(nombre=nombre, rubro=libreria) for nombre in ("LAPIZ", "GOMA", "REGLA")}
+        bienes["LAVANDINA"] = Bien.objects.create(nombre="LAVANDINA", rubro=limpieza)
+        for mes, cantidades in ((1, {"LAPIZ": 1, "GOMA": 9}), (3, {"LAPIZ": 6, "GOMA": 4, "REGLA": 4, "LAVANDINA": 50})):
+            entrega = Entrega.objects.create(area_persona="DEPTO")
+            Entrega.objects.filter(pk=entrega.pk).update(fecha=timezone.make_aware(datetime(2024, mes, 10)))
+            for nombre, cantidad in cantidades.items():
+                EntregaItem.objects.create(entrega=entrega, bien=bienes[nombre], cantidad=cantidad, precio_unitario=Decimal("1.00"))
+
+        def celdas(**parametros):
+            response = self.client.get('/reportes/ranking_bienes/', parametros)
+            return [[texto for texto, _ in fila['celdas']] for fila in response.context['filas']]
+
+        # Marzo contra febrero (período anterior de un mes): los empatados en el último puesto quedan
+        self.assertEqual(celdas(desde='2024-03', hasta='2024-03', rubro=libreria.pk, top=2), [
+            ['1', 'LAPIZ', '6', '6.00', '0', '6'],
+            ['2', 'GOMA', '4', '4.00', '0', '4'],
+            ['2', 'REGLA', '4', '4.00', '0', '4'],
+        ])
+        # Febrero y marzo contra diciembre y enero
+        filas = celdas(desde='2024-02', hasta='2024-03', rubro=libreria.pk, top=1, empates='denso')
+        self.assertEqual(filas, [['1', 'LAPIZ', '6', '6.00', '1', '5']])
+        self.assertEqual(celdas(top=1), [['1', 'LAVANDINA', '50', '50.00']])
+        self.assertEqual(len(celdas()), 4)
+
+    def test_entregas_anio_exporta_el_anio_elegido(self):
+        from datetime import datetime
+        from io import BytesIO
+        from django.core.cache import cache
+        from openpyxl import load_workbook
+        cache.clear()
+        bien = Bien.objects.create(nombre="LAPIZ", rubro=Rubro.objects.create(nombre="LIBRERIA"))
+        for anio, cantidad in ((2023, 3), (2024, 5)):
+            entrega = Entrega.objects.create(area_persona="DEPTO")
+            Entrega.objects.filter(pk=entrega.pk).update(fecha=timezone.make_aware(datetime(anio, 6, 1)))
+            EntregaItem.objects.create(entrega=entrega, bien=bien, cantidad=cantidad, precio_unitario=Decimal("1.00"))
+
+        response = self.client.get('/reportes/entregas_anio/', {'anio': 2024})
+        self.assertEqual(response.context['resumen'], [['2023', '3', '3.00'], ['2024', '5', '5.00']])
+        self.assertEqual([fila['grupo'] for fila in response.context['filas']], [2024])
+        response = self.client.get('/reportes/entregas_anio/', {'anio': 2024, 'export': 'excel'})
+        filas = list(load_workbook(BytesIO(b''.join(response.streaming_content))).active.values)
+        self.assertEqual([fila[:4] for fila in filas], [
+            ('Año', 'Rubro', 'Bien', 'Cantidad Entregada'), (2024, 'LIBRERIA', 'LAPIZ', 5), (None, 'TOTAL', None, 5),
+        ])
+        response = self.client.get('/reportes/entregas_anio/', {'export': 'csv'})
+        lineas = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(lineas[1:], ['2023,LIBRERIA,LAPIZ,3,3.00', '2024,LIBRERIA,LAPIZ,5,5.00', ',TOTAL,,8,8.00'])
+
+    def test_costos_servicios(self):
+        response = self.client.get('/reportes/costos_servicios/', {'export': 'csv'})
+        lineas = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(lineas[1], 'AGUA,ACME,Sin Rubro,Mensual,100.00,1200.00,0.00,Activo,01/01/2024,,')
+        self.assertEqual(lineas[-1], 'TOTAL,,,,170.50,2046.00,,,,,')
+        response = self.client.get('/reportes/costos_servicios/', {'export': 'pdf'})
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+    def test_pagos_pendientes_y_pago(self):
+        from datetime import date, timedelta
+        from django.urls import reverse
+        agua = Servicio.objects.get(nombre="AGUA")
+        pago = ServicioPago.objects.create(servicio=agua, fecha_vencimiento=date(2024, 1, 1))
+        ServicioPago.objects.create(servicio=agua, fecha_vencimiento=date.today() + timedelta(days=10))
+        response = self.client.get('/reportes/servicios_pendientes/')
+        self.assertEqual(
+            [[texto for texto, _ in fila['celdas']] for fila in response.context['filas']],
+            [['AGUA', 'ACME', 'Mensual', '01/01/2024', '100.00']],
+        )
+        self.assertEqual(response.context['resumen'], [['Mensual', '1', '100.00']])
+        self.assertContains(response, reverse('realizar_pago', args=[pago.pk]))
+        response = self.client.post(
+            reverse('realizar_pago', args=[pago.pk]), {'fecha_pago': '2024-01-05', 'importe_pago': '100.00'},
+        )
+        self.assertRedirects(response, reverse('reporte_servicios_pendientes'))
+        response = self.client.get('/reportes/servicios_pendientes/')
+        self.assertEqual(response.context['filas'], [])
+
+class ReportePersonalizadoExportacionTest(TestCase):
+    def setUp(self):
+        from datetime import date, datetime
+        User.objects.create_user(username='testuser', password='12345')
+        self.client.login(username='testuser', password='12345')
+        rubro = Rubro.objects.create(nombre="LIBRERIA")
+        self.bien = Bien.objects.create(nombre="LAPIZ <HB> & CIA", rubro=rubro)
+        orden = OrdenDeCompra.objects.create(numero="OC001", proveedor="ACME", fecha_inicio=date(2024, 1, 1))
+        OrdenDeCompraItem.objects.create(orden_de_compra=orden, bien=self.bien, cantidad=10, precio_unitario=Decimal("1.50"))
+        entrega = Entrega.objects.create(area_persona="DEPTO")
+        Entrega.objects.filter(pk=entrega.pk).update(fecha=timezone.make_aware(datetime(2024, 3, 5, 14, 30)))
+        EntregaItem.objects.create(
+            entrega=entrega, bien=self.bien, orden_de_compra=orden, cantidad=4, precio_unitario=Decimal("1.50")
+        )
+
+    def test_excel_en_streaming(self):
+        from io import BytesIO
+        from openpyxl import load_workbook
+        response = self.client.get('/reportes/personalizado/', {'tipo': 'entregados', 'export': 'excel'})
+        self.assertTrue(response.streaming)
+        filas = list(load_workbook(BytesIO(b''.join(response.streaming_content))).active.values)
+        self.assertEqual(filas[0][0], 'Bien')
+        self.assertEqual(filas[1], (
+            'LAPIZ <HB> & CIA', 'LIBRERIA', 'OC001', 'ACME', '2024-03-05', '14:30:00', 'DEPTO', 1.5, 4, 6,
+        ))
+
+    def test_csv_comprados(self):
+        response = self.client.get('/reportes/personalizado/', {'tipo': 'comprados', 'export': 'csv'})
+        lineas = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(lineas, [
+            'Bien,Rubro,Orden,Proveedor,Precio unitario,Cantidad,Precio total',
+            'LAPIZ <HB> & CIA,LIBRERIA,OC001,ACME,1.50,10,15.00',
+        ])
+
+    def test_paginacion_por_clave(self):
+        from datetime import datetime, timedelta
+        orden = OrdenDeCompra.objects.get(numero="OC001")
+        inicio = timezone.make_aware(datetime(2024, 4, 1, 9))
+        for dia in range(24):
+            entrega = Entrega.objects.create(area_persona=f"AREA {dia}")
+            Entrega.objects.filter(pk=entrega.pk).update(fecha=inicio + timedelta(days=dia))
+            EntregaItem.objects.create(
+                entrega=entrega, bien=self.bien, orden_de_compra=orden, cantidad=1, precio_unitario=Decimal("1.00")
+            )
+        response = self.client.get('/reportes/personalizado/', {'tipo': 'entregados'})
+        filas = response.context['filas']
+        self.assertEqual(len(filas), 20)
+        self.assertEqual((filas[0]['fecha'], filas[0]['area_persona']), ('2024-03-05', 'DEPTO'))
+        self.assertEqual(filas[-1]['area_persona'], 'AREA 18')
+        cursor = response.context['siguiente']
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get('/reportes/personalizado/', {'tipo': 'entregados', 'cursor': cursor})
+        # Toda lectura de ítems está acotada: la página no depende del total de filas
+        lecturas = [q['sql'] for q in consultas.captured_queries if 'FROM "inventario_entregaitem"' in q['sql']]
+        self.assertTrue(lecturas)
+        self.assertTrue(all('LIMIT' in sql for sql in lecturas))
+        self.assertEqual([f['area_persona'] for f in response.context['filas']], [f'AREA {n}' for n in range(19, 24)])
+        self.assertIsNone(response.context['siguiente'])
+        self.assertFalse(response.context['es_primera_pagina'])
+
+    def test_fechas_en_xlsx(self):
+        from datetime import date
+        from io import BytesIO
+        from openpyxl import load_workbook
+        from .exportacion import iterar_xlsx
+        contenido = b''.join(iterar_xlsx(['Fecha', 'Texto'], [[date(2024, 1, 2), 'a\x01b']], hoja='Prueba'))
+        libro = load_workbook(BytesIO(contenido))
+        self.assertEqual(libro.sheetnames, ['Prueba'])
+        self.assertEqual(libro.active['A2'].value.date(), date(2024, 1, 2))
+        self.assertEqual(libro.active['B2'].value, 'ab')
+
+class ReportJobTest(TestCase):
+    def setUp(self):
+        import tempfile
+        self.directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directorio.cleanup)
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.login(username='testuser', password='12345')
+        rubro = Rubro.objects.create(nombre="LIBRERIA")
+        for nombre in ("LAPIZ", "GOMA", "REGLA"):
+            Bien.objects.create(nombre=nombre, rubro=rubro)
+
+    def test_ofrece_segundo_plano_sobre_el_umbral(self):
+        with self.settings(REPORT_JOBS_ROW_THRESHOLD=2):
+            response = self.client.get('/reportes/stock_bien/')
+        self.assertEqual(response.context['segundo_plano']['filas'], 3)
+        self.assertContains(response, 'Generar PDF en segundo plano')
+        with self.settings(REPORT_JOBS_ROW_THRESHOLD=10):
+            response = self.client.get('/reportes/stock_bien/')
+        self.assertIsNone(response.context['segundo_plano'])
+
+    def test_worker_genera_y_permite_descargar(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import ReportJob
+        response = self.client.post('/reportes/trabajos/nuevo/', {
+            'reporte': 'stock_bien', 'consulta': 'fecha=2024-01-31', 'formato': 'pdf',
+        }, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        job_id = response.json()['job']['id']
+        self.assertEqual(response.json()['job']['estado'], 'PENDIENTE')
+
+        with self.settings(REPORT_JOBS_DIR=self.directorio.name):
+            call_command('run_report_worker', '--una-vez', stdout=StringIO())
+        estado = self.client.get(f'/reportes/trabajos/{job_id}/estado/').json()['job']
+        self.assertEqual((estado['estado'], estado['progreso']), ('TERMINADO', 100))
+        job = ReportJob.objects.get(pk=job_id)
+        self.assertEqual(job.nombre_archivo, 'stock_por_bien_20240131.pdf')
+
+        response = self.client.get(estado['url_descarga'])
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        otro = User.objects.create_user(username='otro', password='12345')
+        self.client.force_login(otro)
+        self.assertEqual(self.client.get(estado['url_descarga']).status_code, 404)
+
+    def test_vencidos_se_borran_con_el_archivo(self):
+        import os
+        from datetime import timedelta
+        from . import trabajos
+        ruta = os.path.join(self.directorio.name, 'viejo.pdf')
+        open(ruta, 'wb').close()
+        job = trabajos.encolar(self.user, 'stock_bien')
+        trabajos._actualizar(job, estado='TERMINADO', archivo=ruta, expira=timezone.now() - timedelta(hours=1))
+        self.assertEqual(trabajos.limpiar_vencidos(), 1)
+        self.assertFalse(os.path.exists(ruta))
+
+    def test_progreso_segun_filas_exportadas(self):
+        from unittest import mock
+        from . import trabajos
+        job = trabajos.encolar(self.user, 'stock_bien', formato='excel', filas_estimadas=6)
+        job = trabajos.tomar_siguiente()
+        self.assertEqual(job.progreso, 0)
+        with self.settings(REPORT_JOBS_DIR=self.directorio.name), \
+                mock.patch.object(trabajos, '_actualizar', wraps=trabajos._actualizar) as actualizar:
+            trabajos.ejecutar(job)
+        progresos = [llamada.kwargs['progreso'] for llamada in actualizar.call_args_list if 'progreso' in llamada.kwargs]
+        # 3 de 6 filas estimadas y después el final
+        self.assertEqual(progresos, [50, 100])
+
+    def test_error_al_escribir_borra_el_parcial(self):
+        import os
+        from unittest import mock
+        from django.http import StreamingHttpResponse
+        from . import trabajos
+
+        def partes():
+            yield b'primera parte'
+            raise RuntimeError('se cortó')
+
+        def vista(request):
+            response = StreamingHttpResponse(partes())
+            response['Content-Disposition'] = 'attachment; filename="parcial.pdf"'
+            return response
+
+        job = trabajos.encolar(self.user, 'stock_bien')
+        with self.settings(REPORT_JOBS_DIR=self.directorio.name), \
+                mock.patch.object(trabajos, 'import_string', return_value=vista), \
+                self.assertLogs('inventario.trabajos', 'ERROR'):
+            trabajos.ejecutar(job)
+        job.refresh_from_db()
+        self.assertEqual((job.estado, job.error, job.archivo), ('ERROR', 'se cortó', ''))
+        self.assertIsNotNone(job.expira)
+        self.assertEqual(os.listdir(self.directorio.name), [])
+
+    def test_colgados_en_procesando_se_marcan_con_error(self):
+        import os
+        from datetime import timedelta
+        from . import trabajos
+        colgado = trabajos.encolar(self.user, 'stock_bien')
+        reciente = trabajos.encolar(self.user, 'stock_bien')
+        trabajos._actualizar(colgado, estado='PROCESANDO', iniciado=timezone.now() - timedelta(hours=3))
+        trabajos._actualizar(reciente, estado='PROCESANDO', iniciado=timezone.now())
+        parcial = os.path.join(self.directorio.name, f'{colgado.pk}_stock.pdf')
+        open(parcial, 'wb').close()
+        with self.settings(REPORT_JOBS_DIR=self.directorio.name, REPORT_JOBS_TIMEOUT_MINUTES=60):
+            self.assertEqual(trabajos.recuperar_colgados(), 1)
+        colgado.refresh_from_db()
+        reciente.refresh_from_db()
+        self.assertEqual((colgado.estado, reciente.estado), ('ERROR', 'PROCESANDO'))
+        self.assertIsNotNone(colgado.expira)
+        self.assertFalse(os.path.exists(parcial))
+
+    def test_reporte_desconocido(self):
+        response = self.client.post('/reportes/trabajos/nuevo/', {'reporte': 'otro'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 400)
+
+class CacheReportesTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        User.objects.create_user(username='testuser', password='12345')
+        self.client.login(username='testuser', password='12345')
+        self.entrega = Entrega.objects.create(area_persona="DEPTO")
+        self.bien = Bien.objects.create(nombre="LAPIZ")
+        self.item = EntregaItem.objects.create(entrega=self.entrega, bien=self.bien, cantidad=5, precio_unitario=Decimal("1.00"))
+
+    def _cantidades(self):
+        response = self.client.get('/reportes/ranking_bienes/')
+        return [fila['celdas'][2][0] for fila in response.context['filas']]
+
+    def test_resultado_en_cache_hasta_que_cambian_los_datos(self):
+        self.assertEqual(self._cantidades(), ['5'])
+        # Un cambio que no pasa por las señales no se ve: la página sale de la caché
+        EntregaItem.objects.filter(pk=self.item.pk).update(cantidad=7)
+        self.assertEqual(self._cantidades(), ['5'])
+        with self.captureOnCommitCallbacks(execute=True):
+            EntregaItem.objects.create(entrega=self.entrega, bien=self.bien, cantidad=1, precio_unitario=Decimal("1.00"))
+        # El resumen de entregas tampoco vio el UPDATE directo hasta reconstruirlo
+        self.assertEqual(self._cantidades(), ['6'])
+        from io import StringIO
+        from django.core.management import call_command
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rebuild_resumen_entregas', stdout=StringIO())
+        self.assertEqual(self._cantidades(), ['8'])
+
+    def test_escritura_bulk_invalida(self):
+        from .signals import registrar_entrega_items_bulk
+        self.assertEqual(self._cantidades(), ['5'])
+        nuevo = EntregaItem(
+            entrega=self.entrega, bien=self.bien, cantidad=2, precio_unitario=Decimal("1.00"), precio_total=Decimal("2.00"),
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            EntregaItem.objects.bulk_create([nuevo])
+            registrar_entrega_items_bulk([nuevo], [])
+        self.assertEqual(self._cantidades(), ['7'])
+
+    def test_clave_normaliza_parametros(self):
+        from django.http import QueryDict
+        from .cache import clave_reporte
+        clave = clave_reporte('r', QueryDict('b=2&a=1&export=pdf&vacio='), [EntregaItem])
+        self.assertEqual(clave, clave_reporte('r', QueryDict('a=1&b=2'), [EntregaItem]))
+        self.assertNotEqual(clave, clave_reporte('r', QueryDict('a=1&b=2'), [EntregaItem], self.bien.pk))
+
+    def test_servicios_rubro_y_entregas_anio(self):
+        from datetime import date
+        rubro = Rubro.objects.create(nombre="LIMPIEZA")
+        Servicio.objects.create(
+            nombre="AGUA", proveedor="ACME", frecuencia='MENSUAL', costo_mensual=Decimal("10.00"),
+            fecha_inicio=date(2024, 1, 1), rubro=rubro,
+        )
+        response = self.client.get('/reportes/servicios_rubro/')
+        self.assertEqual(response.context['totales'], ['TOTAL', '1', '10.00'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Servicio.objects.create(
+                nombre="LUZ", proveedor="ACME", frecuencia='MENSUAL', costo_mensual=Decimal("5.00"),
+                fecha_inicio=date(2024, 1, 1), rubro=rubro,
+            )
+        response = self.client.get('/reportes/servicios_rubro/')
+        self.assertEqual(response.context['totales'], ['TOTAL', '2', '15.00'])
+        response = self.client.get('/reportes/entregas_anio/')
+        self.assertEqual(response.context['resumen'][0][1], '5')
+
+class ResumenEntregasTest(TestCase):
+    def setUp(self):
+        from datetime import date, datetime
+        from django.core.cache import cache
+        cache.clear()
+        self.rubro = Rubro.objects.create(nombre="LIBRERIA")
+        self.bien = Bien.objects.create(nombre="LAPIZ", rubro=self.rubro)
+        self.orden = OrdenDeCompra.objects.create(numero="OC001", proveedor="ACME", fecha_inicio=date(2024, 1, 1))
+        self.entrega = Entrega.objects.create(area_persona="DEPTO")
+        Entrega.objects.filter(pk=self.entrega.pk).update(fecha=timezone.make_aware(datetime(2024, 3, 31, 22)))
+        self.entrega.refresh_from_db()
+        self.item = EntregaItem.objects.create(
+            entrega=self.entrega, bien=self.bien, orden_de_compra=self.orden, cantidad=4, precio_unitario=Decimal("2.50")
+        )
+
+    def filas(self):
+        from .models import ResumenEntregas
+        return [
+            (f.anio, f.mes, f.area_persona, f.orden_de_compra_id, f.lineas, f.cantidad, Decimal(f.monto))
+            for f in ResumenEntregas.objects.order_by('anio', 'mes', 'area_persona', F('orden_de_compra').asc(nulls_first=True))
+        ]
+
+    def assertAlDia(self):
+        from .resumen_entregas import diferencias_resumen
+        self.assertEqual(diferencias_resumen(), [])
+
+    def test_altas_modificaciones_y_bajas(self):
+        self.assertEqual(self.filas(), [(2024, 3, "DEPTO", self.orden.pk, 1, 4, Decimal("10.00"))])
+        otro = EntregaItem.objects.create(entrega=self.entrega, bien=self.bien, cantidad=2, precio_unitario=Decimal("1.00"))
+        self.item.cantidad = 6
+        self.item.save()
+        self.assertEqual(self.filas(), [
+            (2024, 3, "DEPTO", None, 1, 2, Decimal("2.00")),
+            (2024, 3, "DEPTO", self.orden.pk, 1, 6, Decimal("15.00")),
+        ])
+        otro.delete()
+        self.assertEqual(len(self.filas()), 1)
+        self.assertAlDia()
+
+    def test_cambio_de_area_y_fecha_de_la_entrega(self):
+        from datetime import datetime
+        self.entrega.area_persona = "COMPRAS"
+        self.entrega.fecha = timezone.make_aware(datetime(2024, 4, 2, 10))
+        self.entrega.save()
+        self.assertEqual(self.filas(), [(2024, 4, "COMPRAS", self.orden.pk, 1, 4, Decimal("10.00"))])
+        self.assertAlDia()
+
+    def test_borrar_orden_pasa_a_sin_orden(self):
+        EntregaItem.objects.create(entrega=self.entrega, bien=self.bien, cantidad=1, precio_unitario=Decimal("1.00"))
+        self.orden.delete()
+        self.assertEqual(self.filas(), [(2024, 3, "DEPTO", None, 2, 5, Decimal("11.00"))])
+        self.assertAlDia()
+        self.entrega.delete()
+        self.assertEqual(self.filas(), [])
+
+    def test_reconstruir_y_reportes(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import ResumenEntregas
+        ResumenEntregas.objects.all().delete()
+        salida = StringIO()
+        call_command('rebuild_resumen_entregas', '--check', stdout=salida)
+        self.assertIn('1 grupos con diferencias', salida.getvalue())
+        call_command('rebuild_resumen_entregas', stdout=StringIO())
+        self.assertAlDia()
+
+        User.objects.create_superuser(username='admin', password='12345')
+        self.client.login(username='admin', password='12345')
+        response = self.client.get('/reportes/entregas_area/')
+        self.assertEqual(response.context['filas'][0]['grupo'], 2024)
+        self.assertEqual(
+            [[texto for texto, _ in fila['celdas']] for fila in response.context['filas']],
+            [['DEPTO', 'LAPIZ', '03/2024', '4']],
+        )
+        self.assertEqual(response.context['resumen'], [['DEPTO', '1', '10.00']])
+        response = self.client.get('/reportes/ranking_proveedores/')
+        self.assertEqual(response.context['filas'][0]['celdas'][1][0], 'ACME')
+        response = self.client.get('/api/analytics/')
+        self.assertEqual(response.json()['entregas_por_mes'][0]['mes'], '2024-03-01')
+
+class DocumentoPDFTest(TestCase):
+    def test_tablas_por_bloques_con_anchos_comunes(self):
+        from reportlab.platypus import Table
+        from .pdf_tablas import DocumentoPDF
+        documento = DocumentoPDF('Prueba')
+        por_pagina = documento.filas_por_pagina()
+        consumidas = []
+
+        def filas():
+            for numero in range(por_pagina * 2 + 5):
+                consumidas.append(numero)
+                yield (f'GRUPO {numero // (por_pagina + 3)}', [f'BIEN {numero}', numero])
+
+        documento.tabla(['Bien', 'Cantidad'], filas(), agrupada=True)
+        # Las filas no se recorren hasta construir el documento
+        self.assertEqual(consumidas, [])
+        tablas = [t for t in documento._bloques(['Bien', 'Cantidad'], filas(), None, None, None, True, None) if isinstance(t, Table)]
+        self.assertTrue(all(len(t._cellvalues) <= por_pagina + 1 for t in tablas))
+        self.assertEqual(sum(len(t._cellvalues) - 1 for t in tablas), por_pagina * 2 + 5)
+        self.assertEqual(len({tuple(t._colWidths) for t in tablas}), 1)
+        self.assertTrue(documento.escribir().read().startswith(b'%PDF'))
+
+    def test_tabla_vacia(self):
+        from .pdf_tablas import DocumentoPDF
+        documento = DocumentoPDF()
+        documento.tabla(['A'], [], vacia='Sin datos')
+        response = documento.respuesta('vacio.pdf')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertIn('vacio.pdf', response['Content-Disposition'])
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+class RemitoPDFCacheTest(TestCase):
+    def setUp(self):
+        import tempfile
+        self.directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directorio.cleanup)
+        ajuste = self.settings(REMITOS_PDF_DIR=self.directorio.name)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.login(username='testuser', password='12345')
+        rubro = Rubro.objects.create(nombre="LIBRERIA")
+        self.bien = Bien.objects.create(nombre="LAPIZ", rubro=rubro)
+        self.entrega = Entrega.objects.create(area_persona="SISTEMAS")
+        self.item = EntregaItem.objects.create(
+            entrega=self.entrega, bien=self.bien, cantidad=2, precio_unitario=Decimal('10.00'),
+        )
+
+    def _descargar(self, **extra):
+        from unittest import mock
+        from xhtml2pdf import pisa
+        with mock.patch.object(pisa, 'CreatePDF', wraps=pisa.CreatePDF) as create_pdf:
+            response = self.client.get(f'/remito/{self.entrega.pk}/pdf/', **extra)
+        return response, create_pdf.call_count
+
+    def test_segunda_descarga_sale_del_disco(self):
+        import os
+        response, renderizados = self._descargar()
+        contenido = b''.join(response.streaming_content)
+        self.assertEqual(renderizados, 1)
+        self.assertTrue(contenido.startswith(b'%PDF'))
+        self.assertIn(f'filename="remito_{self.entrega.pk}.pdf"', response['Content-Disposition'])
+
+        response, renderizados = self._descargar()
+        self.assertEqual(renderizados, 0)
+        self.assertEqual(b''.join(response.streaming_content), contenido)
+        self.assertEqual(len(os.listdir(self.directorio.name)), 1)
+
+        response, renderizados = self._descargar(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual((response.status_code, renderizados), (304, 0))
+
+    def test_editar_cambia_la_huella_y_descarta_la_version_anterior(self):
+        import os
+        response, _ = self._descargar()
+        etag = response['ETag']
+        response.close()
+        self.item.cantidad = 5
+        self.item.save()
+        response, renderizados = self._descargar(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, renderizados), (200, 1))
+        self.assertNotEqual(response['ETag'], etag)
+        response.close()
+        self.assertEqual(len(os.listdir(self.directorio.name)), 1)
+
+        self.bien.nombre = "LAPIZ NEGRO"
+        self.bien.save()
+        response, renderizados = self._descargar()
+        self.assertEqual(renderizados, 1)
+        response.close()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.entrega.delete()
+        self.assertEqual(os.listdir(self.directorio.name), [])
+
+    def test_lote_zip_y_pdf_unido(self):
+        import zipfile
+        from io import BytesIO
+        from pypdf import PdfReader
+        otra = Entrega.objects.create(area_persona="COMPRAS")
+        EntregaItem.objects.create(entrega=otra, bien=self.bien, cantidad=1, precio_unitario=Decimal('3.00'))
+        self._descargar()[0].close()
+        url = f'/remitos/lote/?ids={self.entrega.pk},{otra.pk}'
+        with self.settings(REMITOS_PDF_PROCESOS=1):
+            response = self.client.get(url)
+            paquete = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+            self.assertEqual(paquete.namelist(), [f'remito_{self.entrega.pk}.pdf', f'remito_{otra.pk}.pdf'])
+            self.assertTrue(paquete.read(f'remito_{otra.pk}.pdf').startswith(b'%PDF'))
+
+            response = self.client.get(url + '&formato=pdf')
+            self.assertEqual(len(PdfReader(BytesIO(b''.join(response.streaming_content))).pages), 2)
+        self.assertRedirects(self.client.get('/remitos/lote/'), '/remitos/')
+
+    def test_comando_genera_en_paralelo(self):
+        import os
+        import zipfile
+        from io import StringIO
+        from django.core.management import call_command
+        otra = Entrega.objects.create(area_persona="COMPRAS")
+        EntregaItem.objects.create(entrega=otra, bien=self.bien, cantidad=1, precio_unitario=Decimal('3.00'))
+        salida = os.path.join(self.directorio.name, 'lote.zip')
+        call_command(
+            'generar_remitos', '--ids', str(self.entrega.pk), str(otra.pk), '--procesos', '2', '--salida', salida,
+            stdout=StringIO(),
+        )
+        with zipfile.ZipFile(salida) as paquete:
+            self.assertEqual(len(paquete.namelist()), 2)
+        self.assertEqual(len([nombre for nombre in os.listdir(self.directorio.name) if nombre.endswith('.pdf')]), 2)
+
+class MetricasTest(TestCase):
+    def setUp(self):
+        from . import metricas
+        for histograma in metricas.HISTOGRAMAS:
+            histograma.limpiar()
+        ajuste = self.settings(REQUEST_METRICS_ENABLED=True, REQUEST_METRICS_TOKEN='secreto')
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.staff = User.objects.create_user(username='jefe', password='12345', is_staff=True)
+        rubro = Rubro.objects.create(nombre="LIBRERIA")
+        Bien.objects.create(nombre="LAPIZ", rubro=rubro)
+
+    def test_huella_ignora_valores(self):
+        from .metricas import RegistroConsultas, huella_sql
+        self.assertEqual(
+            huella_sql('SELECT * FROM t WHERE id IN (%s, %s) AND x = 1'),
+            huella_sql('SELECT *  FROM t WHERE id IN (%s, %s, %s) AND x = 25'),
+        )
+        registro = RegistroConsultas()
+        registro.consultas = [('SELECT a FROM t WHERE id = %s', 0.001)] * 3 + [('SELECT b FROM u', 0.002)]
+        self.assertEqual(registro.repeticiones, 2)
+        self.assertEqual([(grupo['veces'], grupo['sql']) for grupo in registro.repetidas(5)],
+                         [(3, 'SELECT a FROM t WHERE id = %s')])
+        self.assertEqual(registro.mas_lentas(1)[0]['sql'], 'SELECT b FROM u')
+
+    def test_log_y_encabezado_para_staff(self):
+        import json
+        self.client.login(username='testuser', password='12345')
+        with self.assertLogs('inventario.metricas', 'INFO') as logs:
+            response = self.client.get('/reportes/stock_rubro/')
+        datos = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((datos['vista'], datos['estado']), ('reporte_stock_rubro', 200))
+        self.assertGreater(datos['consultas'], 0)
+        self.assertLessEqual(len(datos['lentas']), 5)
+        self.assertNotIn('Server-Timing', response)
+
+        self.client.login(username='jefe', password='12345')
+        response = self.client.get('/reportes/stock_rubro/')
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ consultas, \d+ repetidas"$')
+
+    def test_metrics_prometheus(self):
+        self.client.login(username='testuser', password='12345')
+        self.client.get('/reportes/stock_rubro/')
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secreto')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        contenido = response.content.decode()
+        self.assertIn('# TYPE inventario_request_duration_seconds histogram', contenido)
+        self.assertIn('inventario_request_duration_seconds_count{view="reporte_stock_rubro"} 1', contenido)
+        self.assertIn('inventario_request_queries_bucket{view="reporte_stock_rubro",le="+Inf"} 1', contenido)
+
+        self.client.login(username='jefe', password='12345')
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_metrics_con_token_sin_sesion(self):
+        # Prometheus no tiene sesión: alcanza con el token
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secreto')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer otro').status_code, 403)
+
+class AnalyticsSeccionesTest(TestCase):
+    def setUp(self):
+        from datetime import date
+        from django.core.cache import cache
+        cache.clear()
+        User.objects.create_user(username='testuser', password='12345')
+        self.client.login(username='testuser', password='12345')
+        libreria = Rubro.objects.create(nombre="LIBRERIA")
+        Rubro.objects.create(nombre="VACIO")
+        self.bien = Bien.objects.create(nombre="LAPIZ", rubro=libreria)
+        orden = OrdenDeCompra.objects.create(numero="OC001", proveedor="ACME", fecha_inicio=date(2024, 1, 1))
+        OrdenDeCompraItem.objects.create(orden_de_compra=orden, bien=self.bien, cantidad=10, precio_unitario=Decimal("2.00"))
+        entrega = Entrega.objects.create(area_persona="DEPTO")
+        EntregaItem.objects.create(entrega=entrega, bien=self.bien, orden_de_compra=orden, cantidad=3, precio_unitario=Decimal("2.00"))
+
+    def test_secciones_con_una_consulta(self):
+        from . import analytics
+        with self.assertNumQueries(1):
+            self.assertEqual(analytics.stock_por_rubro(), [
+                {'rubro__nombre': 'LIBRERIA', 'total_stock': 7}, {'rubro__nombre': 'VACIO', 'total_stock': 0},
+            ])
+        with self.assertNumQueries(1):
+            self.assertEqual(analytics.totales(), {
+                'total_bienes': 1, 'total_rubros': 2, 'total_ordenes': 1, 'total_entregas': 1,
+                'total_servicios': 0, 'valor_total_entregas': 6.0,
+            })
+        with self.assertNumQueries(1):
+            self.assertEqual(analytics.top_bienes(), [{'nombre': 'LAPIZ', 'total_entregado': 3}])
+
+        response = self.client.get('/api/analytics/stock_por_rubro/')
+        self.assertEqual(response.json(), {'stock_por_rubro': [
+            {'rubro__nombre': 'LIBRERIA', 'total_stock': 7}, {'rubro__nombre': 'VACIO', 'total_stock': 0},
+        ]})
+        self.assertEqual(self.client.get('/api/analytics/otra/').status_code, 404)
+
+    def test_combinado_desde_cache_y_errores_informados(self):
+        from unittest import mock
+        from . import analytics
+        datos = self.client.get('/api/analytics/').json()
+        self.assertEqual(datos['errores'], {})
+        self.assertEqual(datos['totales']['total_bienes'], 1)
+
+        # Todo sale de la caché: ninguna sección se vuelve a calcular
+        from contextlib import ExitStack
+        with ExitStack() as pila:
+            for seccion in analytics.SECCIONES.values():
+                pila.enter_context(mock.patch.object(seccion, 'calcular', side_effect=AssertionError))
+            self.assertEqual(self.client.get('/api/analytics/').json(), datos)
+
+        from django.core.cache import cache
+        cache.clear()
+        seccion = analytics.SECCIONES['top_bienes']
+        with mock.patch.object(seccion, 'calcular', side_effect=RuntimeError('falla')), \
+                self.assertLogs('inventario.analytics', 'ERROR'):
+            datos = self.client.get('/api/analytics/').json()
+            self.assertIsNone(datos['top_bienes'])
+            self.assertEqual(datos['errores'], {'top_bienes': 'No se pudo calcular top_bienes.'})
+            self.assertEqual(datos['totales']['total_bienes'], 1)
+            response = self.client.get('/api/analytics/top_bienes/')
+            self.assertEqual(response.status_code, 500)
+            self.assertEqual(response.json(), {'error': 'No se pudo calcular top_bienes.'})
+
+class RespuestaCondicionalTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        User.objects.create_user(username='testuser', password='12345')
+        self.client.login(username='testuser', password='12345')
+        self.rubro = Rubro.objects.create(nombre="LIBRERIA")
+        Bien.objects.create(nombre="LAPIZ", rubro=self.rubro)
+
+    def _sin_consultas_a(self, tabla, url, **extra):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(url, **extra)
+        self.assertFalse([q['sql'] for q in consultas.captured_queries if tabla in q['sql']])
+        return response
+
+    def test_lista_con_etag_y_304_sin_consultar(self):
+        response = self.client.get('/api/bienes/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        response = self._sin_consultas_a('inventario_bien', '/api/bienes/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        # Otros parámetros son otra respuesta
+        self.assertEqual(self.client.get('/api/bienes/?nombre=LAPIZ', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Bien.objects.create(nombre="GOMA", rubro=self.rubro)
+        response = self.client.get('/api/bienes/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.json()['count']), (200, 2))
+        self.assertNotEqual(response['ETag'], etag)
+
+        # Last-Modified recién aparece cuando todos los conjuntos de los que depende registraron un cambio
+        self.assertNotIn('Last-Modified', response)
+        from .cache import bump_data_version, nombre_modelo
+        from .stock import VERSION_STOCK
+        bump_data_version(nombre_modelo(Rubro))
+        bump_data_version(VERSION_STOCK)
+        modificado = self.client.get('/api/bienes/')['Last-Modified']
+        response = self._sin_consultas_a('inventario_bien', '/api/bienes/', HTTP_IF_MODIFIED_SINCE=modificado)
+        self.assertEqual(response.status_code, 304)
+
+    def test_analytics_condicional(self):
+        from unittest import mock
+        from . import analytics
+        response = self.client.get('/api/analytics/')
+        response = self.client.get('/api/analytics/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/api/analytics/totales/')
+        self.assertEqual(self.client.get('/api/analytics/totales/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        from django.core.cache import cache
+        cache.clear()
+        with mock.patch.object(analytics.SECCIONES['top_bienes'], 'calcular', side_effect=RuntimeError), \
+                self.assertLogs('inventario.analytics', 'ERROR'):
+            response = self.client.get('/api/analytics/')
+        # Una respuesta con errores no se puede revalidar: el próximo pedido la recalcula
+        self.assertNotIn('ETag', response)
+
+class DashboardFragmentosTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.client.login(username='testuser', password='12345')
+        self.rubro = Rubro.objects.create(nombre="LIBRERIA", stock_minimo=50)
+        self.lapiz = Bien.objects.create(nombre="LAPIZ", rubro=self.rubro)
+        self.goma = Bien.objects.create(nombre="GOMA", rubro=self.rubro, stock_minimo=5)
+        self.cable = Bien.objects.create(nombre="CABLE")
+        self.sin_movimientos = Bien.objects.create(nombre="TONER")
+        orden = OrdenDeCompra.objects.create(numero="OC001", fecha_inicio=timezone.now().date())
+        for bien in (self.lapiz, self.goma, self.cable):
+            OrdenDeCompraItem.objects.create(
+                orden_de_compra=orden, bien=bien, cantidad=30, precio_unitario=Decimal("1.00")
+            )
+
+    def test_umbral_del_bien_del_rubro_o_general(self):
+        from .stock import bienes_bajo_stock
+        # LAPIZ: 30 <= 50 (rubro); GOMA: 30 > 5 (propio); CABLE: 30 > 10 (general); TONER: sin saldo, 0
+        self.assertEqual(
+            [(bien.nombre, bien.stock, bien.umbral) for bien in bienes_bajo_stock()],
+            [("TONER", 0, 10), ("LAPIZ", 30, 50)],
+        )
+        with self.settings(STOCK_BAJO_UMBRAL=30):
+            self.assertEqual([bien.nombre for bien in bienes_bajo_stock()], ["TONER", "CABLE", "LAPIZ"])
+        self.assertEqual(list(bienes_bajo_stock(rubro=self.rubro)), [self.lapiz])
+
+    def test_shell_sin_consultas_de_paneles(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get('/')
+        self.assertContains(response, 'data-fragmento="/dashboard/bajo-stock/"')
+        self.assertFalse([q['sql'] for q in consultas.captured_queries if 'inventario_' in q['sql']])
+
+    def test_fragmento_bajo_stock_paginado_en_la_base(self):
+        for numero in range(12):
+            Bien.objects.create(nombre=f"BIEN {numero:02d}")
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get('/dashboard/bajo-stock/?stock_page=2')
+        # Conteo y página, con el LIMIT en la base
+        sql = [q['sql'] for q in consultas.captured_queries if 'inventario_' in q['sql']]
+        self.assertEqual(len(sql), 2)
+        self.assertIn('LIMIT', sql[1])
+        self.assertTemplateUsed(response, 'inventario/dashboard_bajo_stock.html')
+        page_obj = response.context['page_obj']
+        self.assertEqual((page_obj.number, page_obj.paginator.count), (2, 14))
+        self.assertEqual([bien.nombre for bien in page_obj], ["BIEN 10", "BIEN 11", "TONER", "LAPIZ"])
+
+    def test_por_vencer_en_la_base(self):
+        from datetime import date, timedelta
+        hoy = date.today()
+        for numero, dias in (("OC-LEJOS", 200), ("OC-PRONTO", 30), ("OC-VENCIDA", -5)):
+            OrdenDeCompra.objects.create(numero=numero, fecha_inicio=hoy, fecha_fin=hoy + timedelta(days=dias))
+        with self.assertNumQueries(1):
+            ordenes = [(oc.numero, oc.dias_restantes) for oc in OrdenDeCompra.objects.por_vencer(dias=120)]
+        self.assertEqual(ordenes, [("OC-VENCIDA", -5), ("OC-PRONTO", 30)])
+
+        datos = dict(proveedor="P", frecuencia="MENSUAL", costo_mensual=Decimal("1.00"), fecha_inicio=hoy)
+        for nombre, dias, estado in (("LUZ", 10, "ACTIVO"), ("GAS", 40, "ACTIVO"), ("AGUA", 3, "SUSPENDIDO"), ("TEL", 0, "POR_VENCER")):
+            Servicio.objects.create(nombre=nombre, fecha_fin=hoy + timedelta(days=dias), estado=estado, **datos)
+        servicios = Servicio.objects.filter(estado__in=['ACTIVO', 'POR_VENCER']).por_vencer(dias=30)
+        self.assertEqual(
+            [(servicio.nombre, servicio.dias_restantes) for servicio in servicios],
+            [("TEL", 0), ("LUZ", 10)],
+        )
+        self.assertEqual(servicios[1].dias_restantes, servicios[1].dias_para_vencimiento())
+
+    def test_fragmentos_ordenes_y_servicios(self):
+        response = self.client.get('/dashboard/ordenes/')
+        self.assertTemplateUsed(response, 'inventario/dashboard_ordenes.html')
+        self.assertEqual(self.client.get('/dashboard/servicios/').status_code, 403)
+        from django.contrib.auth.models import Permission
+        self.user.user_permissions.add(Permission.objects.get(codename='view_servicio'))
+        response = self.client.get('/dashboard/servicios/')
+        self.assertTemplateUsed(response, 'inventario/dashboard_servicios.html')
+
+class EstadoServicioTest(TestCase):
+    def setUp(self):
+        from datetime import date, timedelta
+        User.objects.create_user(username='testuser', password='12345')
+        self.client.login(username='testuser', password='12345')
+        self.hoy = date.today()
+        datos = dict(proveedor="P", frecuencia="MENSUAL", costo_mensual=Decimal("100.00"), fecha_inicio=self.hoy)
+        # Todos guardados como ACTIVO: la columna quedó desactualizada
+        self.servicios = {
+            nombre: Servicio.objects.create(
+                nombre=nombre, estado=estado, fecha_fin=self.hoy + timedelta(days=dias) if dias is not None else None, **datos
+            )
+            for nombre, dias, estado in (
+                ("VENCIDO", -1, "ACTIVO"), ("HOY", 0, "ACTIVO"), ("LIMITE", 60, "ACTIVO"),
+                ("LEJOS", 61, "ACTIVO"), ("SIN FIN", None, "ACTIVO"), ("SUSPENDIDO", -30, "SUSPENDIDO"),
+            )
+        }
+
+    def test_estado_vigente_igual_a_estado_actual(self):
+        with self.assertNumQueries(1):
+            servicios = list(Servicio.objects.con_estado_vigente())
+        self.assertEqual(
+            {servicio.nombre: servicio.estado_vigente for servicio in servicios},
+            {servicio.nombre: servicio.estado_actual for servicio in servicios},
+        )
+        self.assertEqual(
+            dict(Servicio.objects.con_estado_vigente().values_list('nombre', 'estado_vigente')),
+            {"VENCIDO": "VENCIDO", "HOY": "POR_VENCER", "LIMITE": "POR_VENCER", "LEJOS": "ACTIVO",
+             "SIN FIN": "ACTIVO", "SUSPENDIDO": "SUSPENDIDO"},
+        )
+
+    def test_lista_y_reporte_por_estado_vigente(self):
+        response = self.client.get('/servicios/?estado=POR_VENCER')
+        self.assertEqual(sorted(servicio.nombre for servicio in response.context['page_obj']), ["HOY", "LIMITE"])
+        response = self.client.get('/reportes/servicios_estado/')
+        cantidades = {celdas[0]: celdas[1] for celdas in response.context['resumen']}
+        self.assertEqual(cantidades, {'Activo': '2', 'Por vencer': '2', 'Suspendido': '1', 'Vencido': '1'})
+        self.assertEqual(response.context['filas'][0]['grupo'], 'Activo')
+
+    def test_panel_y_analytics_por_estado_vigente(self):
+        from datetime import timedelta
+        from django.contrib.auth.models import Permission
+        from django.core.cache import cache
+        from . import analytics
+        cache.clear()
+        # Guardado como vencido pero con la fecha de fin extendida
+        Servicio.objects.filter(nombre="VENCIDO").update(estado="VENCIDO", fecha_fin=self.hoy + timedelta(days=5))
+        usuario = User.objects.get(username='testuser')
+        usuario.user_permissions.add(Permission.objects.get(codename='view_servicio'))
+        response = self.client.get('/dashboard/servicios/')
+        self.assertEqual([servicio.nombre for servicio in response.context['page_obj']], ["HOY", "VENCIDO"])
+
+        datos, _ = analytics.obtener(['servicios_por_estado'])
+        self.assertEqual(
+            {fila['estado']: fila['count'] for fila in datos['servicios_por_estado']},
+            {'ACTIVO': 2, 'POR_VENCER': 3, 'SUSPENDIDO': 1},
+        )
+        self.assertIn(self.hoy.isoformat(), analytics.SECCIONES['servicios_por_estado'].clave())
+
+    def test_panel_sin_los_vencidos_hace_tiempo(self):
+        from datetime import timedelta
+        from django.contrib.auth.models import Permission
+        Servicio.objects.create(
+            nombre="ANTIGUO", proveedor="P", frecuencia="MENSUAL", costo_mensual=Decimal("100.00"),
+            fecha_inicio=self.hoy - timedelta(days=800), fecha_fin=self.hoy - timedelta(days=400),
+        )
+        usuario = User.objects.get(username='testuser')
+        usuario.user_permissions.add(Permission.objects.get(codename='view_servicio'))
+        response = self.client.get('/dashboard/servicios/')
+        self.assertEqual([servicio.nombre for servicio in response.context['page_obj']], ["HOY"])
+
+    def test_comando_un_update_por_transicion(self):
+        from datetime import timedelta
+        from io import StringIO
+        from django.core.management import call_command
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        out = StringIO()
+        with CaptureQueriesContext(connection) as consultas:
+            call_command('actualizar_estado_servicios', stdout=out)
+        self.assertEqual(len([q for q in consultas.captured_queries if q['sql'].startswith('UPDATE')]), 3)
+        self.assertIn('1 a VENCIDO, 2 a POR_VENCER', out.getvalue())
+        self.assertEqual(
+            dict(Servicio.objects.values_list('nombre', 'estado')),
+            dict(Servicio.objects.con_estado_vigente().values_list('nombre', 'estado_vigente')),
+        )
+        self.assertEqual(Servicio.objects.actualizar_estados(), {})
+        # Dentro de dos meses LEJOS pasa a por vencer y LIMITE y HOY vencen
+        self.assertEqual(
+            Servicio.objects.actualizar_estados(hoy=self.hoy + timedelta(days=60)),
+            {'VENCIDO': 1, 'POR_VENCER': 1},
+        )
+        self.assertEqual(Servicio.objects.get(nombre="SUSPENDIDO").estado, "SUSPENDIDO")
+
 class AuditLogTest(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='12345')
@@ -0,0 +1,195 @@
+"""
+Cola de reportes en segundo plano (ReportJob) sin broker externo.
+
+Las vistas que pueden tardar más que el proxy ofrecen generar la exportación en
+segundo plano cuando la cantidad estimada de filas supera ``REPORT_JOBS_ROW_THRESHOLD``.
+El pedido queda en la base como PENDIENTE; el comando ``run_report_worker`` lo toma,
+ejecuta la misma vista con los parámetros guardados y deja el archivo en
+``REPORT_JOBS_DIR`` hasta que vence (``REPORT_JOBS_TTL_HOURS``). El progreso sale de
+las filas que van leyendo las exportaciones (ver ``exportacion.informar_progreso``).
+"""
+import logging
+import re
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpRequest, QueryDict
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import exportacion
+from .models import ReportJob
+
+logger = logging.getLogger(__name__)
+
+# Reportes que se pueden generar en segundo plano: clave -> (vista, título)
+REPORTES = {
+    'entregas_area': ('inventario.views.reporte_entregas_area', 'Entregas por área / persona'),
+    'stock_bien': ('inventario.views.reporte_stock_bien', 'Estado de stock por bien'),
+    'personalizado': ('inventario.views.reporte_personalizado', 'Reporte personalizado'),
+}
+FORMATOS = ('pdf', 'excel')
+
+
+def directorio():
+    ruta = Path(getattr(settings, 'REPORT_JOBS_DIR', Path(settings.BASE_DIR) / 'reportes_generados'))
+    ruta.mkdir(parents=True, exist_ok=True)
+    return ruta
+
+
+def umbral_filas():
+    return getattr(settings, 'REPORT_JOBS_ROW_THRESHOLD', 5000)
+
+
+def vencimiento():
+    return timezone.now() + timedelta(hours=getattr(settings, 'REPORT_JOBS_TTL_HOURS', 24))
+
+
+def ofrecer_segundo_plano(request, reporte, filas_estimadas):
+    """Datos para el botón de "generar en segundo plano" (None si el reporte es chico)"""
+    if filas_estimadas <= umbral_filas():
+        return None
+    parametros = request.GET.copy()
+    for clave in ('page', 'cursor', 'export'):
+        parametros.pop(clave, None)
+    return {'reporte': reporte, 'filas': filas_estimadas, 'consulta': parametros.urlencode()}
+
+
+def encolar(usuario, reporte, consulta='', formato='pdf', filas_estimadas=0):
+    if reporte not in REPORTES:
+        raise ValueError(f'Reporte desconocido: {reporte}')
+    if formato not in FORMATOS:
+        raise ValueError(f'Formato no soportado: {formato}')
+    return ReportJob.objects.create(
+        usuario=usuario, reporte=reporte, consulta=consulta, formato=formato, filas_estimadas=filas_estimadas,
+    )
+
+
+def tiempo_maximo():
+    return timedelta(minutes=getattr(settings, 'REPORT_JOBS_TIMEOUT_MINUTES', 120))
+
+
+def _borrar_parciales(job_pk):
+    """Archivos a medio escribir de un pedido (``<pk>_<nombre>``)"""
+    for ruta in directorio().glob(f'{job_pk}_*'):
+        ruta.unlink(missing_ok=True)
+
+
+def recuperar_colgados(ahora=None):
+    """Marca como ERROR los pedidos que siguen PROCESANDO después de ``REPORT_JOBS_TIMEOUT_MINUTES``.
+
+    Quedan así si el worker se cortó a mitad de un reporte. No se reintentan: si el
+    reporte es el que tumba al worker, volvería a hacerlo. Devuelve cuántos marcó.
+    """
+    ahora = ahora or timezone.now()
+    colgados = list(
+        ReportJob.objects.filter(estado='PROCESANDO', iniciado__lt=ahora - tiempo_maximo()).values_list('pk', flat=True)
+    )
+    for pk in colgados:
+        _borrar_parciales(pk)
+    if not colgados:
+        return 0
+    return ReportJob.objects.filter(pk__in=colgados, estado='PROCESANDO').update(
+        estado='ERROR', error='El worker se interrumpió mientras generaba el reporte.',
+        terminado=ahora, expira=vencimiento(),
+    )
+
+
+def tomar_siguiente():
+    """Marca como PROCESANDO el pedido pendiente más antiguo y lo devuelve.
+
+    El cambio de estado es un UPDATE condicional, así dos workers nunca toman el
+    mismo pedido.
+    """
+    pendientes = ReportJob.objects.filter(estado='PENDIENTE').order_by('creado').values_list('pk', flat=True)
+    for pk in pendientes[:10]:
+        tomado = ReportJob.objects.filter(pk=pk, estado='PENDIENTE').update(
+            estado='PROCESANDO', progreso=0, iniciado=timezone.now(),
+        )
+        if tomado:
+            return ReportJob.objects.get(pk=pk)
+    return None
+
+
+def _actualizar(job, **campos):
+    for campo, valor in campos.items():
+        setattr(job, campo, valor)
+    ReportJob.objects.filter(pk=job.pk).update(**campos)
+
+
+def _request(job):
+    request = HttpRequest()
+    request.method = 'GET'
+    request.GET = QueryDict(job.consulta, mutable=True)
+    request.GET['export'] = job.formato
+    request.user = job.usuario
+    request.META['SERVER_NAME'] = 'localhost'
+    request.META['SERVER_PORT'] = '80'
+    return request
+
+
+def _nombre_descarga(response, job):
+    coincidencia = re.search(r'filename="?([^";]+)"?', response.get('Content-Disposition', ''))
+    if coincidencia:
+        return coincidencia.group(1)
+    return f"{job.reporte}.{'xlsx' if job.formato == 'excel' else job.formato}"
+
+
+class _Progreso:
+    """Lleva ``progreso`` a partir de las filas exportadas sobre ``filas_estimadas``.
+
+    Se guarda sólo cuando cambia el porcentaje y nunca llega a 100 antes de terminar
+    (la estimación puede quedar corta). Sin estimación el progreso queda en 0 y sólo
+    se informa el estado.
+    """
+
+    def __init__(self, job):
+        self.job = job
+
+    def __call__(self, filas):
+        if not self.job.filas_estimadas:
+            return
+        porcentaje = min(99, filas * 100 // self.job.filas_estimadas)
+        if porcentaje > self.job.progreso:
+            _actualizar(self.job, progreso=porcentaje)
+
+
+def ejecutar(job):
+    """Genera el archivo del pedido con la vista del reporte y lo deja en disco"""
+    vista = import_string(REPORTES[job.reporte][0])
+    ruta = None
+    try:
+        with exportacion.informar_progreso(_Progreso(job)):
+            response = vista(_request(job))
+            if response.status_code != 200 or 'attachment' not in response.get('Content-Disposition', ''):
+                raise RuntimeError(f'La vista devolvió {response.status_code} sin archivo adjunto')
+            nombre = _nombre_descarga(response, job)
+            ruta = directorio() / f'{job.pk}_{nombre}'
+            with open(ruta, 'wb') as archivo:
+                for bloque in (response.streaming_content if response.streaming else [response.content]):
+                    archivo.write(bloque)
+            if hasattr(response, 'close'):
+                response.close()
+    except Exception as exc:
+        logger.exception('Error generando el reporte en segundo plano %s', job.pk)
+        if ruta is not None:
+            ruta.unlink(missing_ok=True)
+        _actualizar(
+            job, estado='ERROR', error=str(exc) or exc.__class__.__name__,
+            terminado=timezone.now(), expira=vencimiento(),
+        )
+        return job
+    _actualizar(
+        job, estado='TERMINADO', progreso=100, archivo=str(ruta), nombre_archivo=nombre,
+        terminado=timezone.now(), expira=vencimiento(),
+    )
+    return job
+
+
+def limpiar_vencidos(ahora=None):
+    """Borra los pedidos vencidos junto con sus archivos; devuelve cuántos borró"""
+    vencidos = ReportJob.objects.filter(expira__lt=ahora or timezone.now())
+    for ruta in vencidos.exclude(archivo='').values_list('archivo', flat=True):
+        Path(ruta).unlink(missing_ok=True)
+    return vencidos.delete()[0]
@@ -14,12 +14,17 @@ router.register(r'servicios', api.ServicioViewSet)
 urlpatterns = [
     path('api/', include(router.urls)),
     path('api/analytics/', api.AnalyticsAPIView.as_view(), name='api_analytics'),
+    path('api/analytics/<str:seccion>/', api.AnalyticsSeccionAPIView.as_view(), name='api_analytics_seccion'),
     path('importar_bienes/', views.importar_bienes, name='importar_bienes'),
     path('exportar_bienes/', views.exportar_bienes_excel, name='exportar_bienes'),
     # ... existing paths ...
     path('api/orden_bien_stock/<int:orden_id>/<int:bien_id>/', views.api_orden_bien_stock, name='api_orden_bien_stock'),
     path('', views.dashboard, name='dashboard'),
+    path('dashboard/ordenes/', views.dashboard_ordenes, name='dashboard_ordenes'),
+    path('dashboard/bajo-stock/', views.dashboard_bajo_stock, name='dashboard_bajo_stock'),
+    path('dashboard/servicios/', views.dashboard_servicios, name='dashboard_servicios'),
     path('remitos/', views.remitos_list, name='remitos_list'),
+    path('remitos/lote/', views.remitos_lote, name='remitos_lote'),
     path('rubros/', views.rubros_list, name='rubros_list'),
     path('agregar_rubro/', views.agregar_rubro, name='agregar_rubro'),
     path('rubros/<int:pk>/editar/', views.editar_rubro, name='editar_rubro'),
@@ -43,9 +48,15 @@ urlpatterns = [
     path('api/orden_bienes/<int:orden_id>/', views.api_orden_bienes, name='api_orden_bienes'),
     path('api/orden_precio/<int:orden_id>/<int:bien_id>/', views.api_orden_precio, name='api_orden_precio'),
     path('api/ordenes_con_stock_bien/<int:bien_id>/', views.api_ordenes_con_stock_bien, name='api_ordenes_con_stock_bien'),
+    path('api/stock/batch/', views.api_stock_batch, name='api_stock_batch'),
     path('reportes/', views.reportes, name='reportes'),
     path('reportes/stock_rubro/', views.reporte_stock_rubro, name='reporte_stock_rubro'),
     path('reportes/stock_bien/', views.reporte_stock_bien, name='reporte_stock_bien'),
+    path('reportes/kardex/', views.reporte_kardex, name='reporte_kardex'),
+    path('reportes/trabajos/', views.reporte_jobs, name='reporte_jobs'),
+    path('reportes/trabajos/nuevo/', views.reporte_job_crear, name='reporte_job_crear'),
+    path('reportes/trabajos/<int:pk>/estado/', views.reporte_job_estado, name='reporte_job_estado'),
+    path('reportes/trabajos/<int:pk>/descargar/', views.reporte_job_descargar, name='reporte_job_descargar'),
     path('reportes/entregas_anio/', views.reporte_entregas_anio, name='reporte_entregas_anio'),
     path('reportes/entregas_area/', views.reporte_entregas_area, name='reporte_entregas_area'),
     path('reportes/ranking_bienes/', views.reporte_ranking_bienes, name='reporte_ranking_bienes'),
@@ -66,4 +77,5 @@ urlpatterns = [
     path('servicios/<int:pk>/', views.servicio_detalle, name='servicio_detalle'),
     path('servicios/<int:pago_id>/marcar_pagado/', views.marcar_pago_pagado, name='marcar_pago_pagado'),
     path('servicios/<int:pk>/renovar/', views.renovar_servicio, name='renovar_servicio'),
+    path('metrics', views.metricas_prometheus, name='metricas'),
 ]
@@ -1,11 +1,30 @@
 
-from django.contrib.auth.decorators import login_required, user_passes_test
-from django.db.models import Q, Sum, F
-from django.http import JsonResponse, HttpResponse
+import json
+import re
+
+from django.contrib.auth.decorators import login_required, permission_required, user_passes_test
+from django.db.models import Count, Q, Sum, F, Window
+from django.db.models.functions import DenseRank, Rank
+from django.http import FileResponse, JsonResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.views.decorators.http import require_POST
 from django import forms
 from django.forms import inlineformset_factory
 from django.contrib.contenttypes.models import ContentType
-from .models import Rubro, Bien, OrdenDeCompra, OrdenDeCompraItem, Entrega, EntregaItem, Servicio, ServicioPago, AuditLog
+from .models import Rubro, Bien, OrdenDeCompra, OrdenDeCompraItem, Entrega, EntregaItem, Servicio, ServicioPago, AuditLog, ReportJob, ResumenEntregas
+from . import remitos_pdf, trabajos
+from .exportacion import respuesta_csv, respuesta_xlsx, respuesta_xlsx_streaming
+from .kardex import iterar_kardex, pagina_kardex
+from .motor_reportes import Columna, Reporte
+from .pdf_tablas import DocumentoPDF
+from .signals import registrar_entrega_items_bulk
+from .stock import (
+    bienes_bajo_stock, bienes_con_stock, filas_stock_bienes, ordenes_con_stock, ordenes_con_stock_bien, saldos_bien, saldos_para_entrega, saldos_pares, stock_bien,
+    texto_precio,
+)
+from django.db import transaction
 from django.contrib import messages
 from django.template.loader import get_template
 from xhtml2pdf import pisa
@@ -44,14 +63,65 @@ def api_orden_bien_stock(request, orden_id, bien_id):
 
 @login_required
 def api_stock_bien(request, bien_id):
-    try:
-        bien = Bien.objects.get(pk=bien_id)
-    except Bien.DoesNotExist:
+    if not Bien.objects.filter(pk=bien_id).exists():
         return JsonResponse({'status': 'error', 'stock': 0})
-    comprado = OrdenDeCompraItem.objects.filter(bien_id=bien_id).aggregate(total=Sum('cantidad'))['total'] or 0
-    entregado = EntregaItem.objects.filter(bien_id=bien_id).aggregate(total=Sum('cantidad'))['total'] or 0
-    stock = comprado - entregado
-    return JsonResponse({'status': 'ok', 'bien_id': bien_id, 'stock': stock})
+    return JsonResponse({'status': 'ok', 'bien_id': bien_id, 'stock': stock_bien(bien_id)})
+
+# Máximo de bienes y de pares aceptados por pedido en api_stock_batch
+LIMITE_STOCK_BATCH = 500
+
+@login_required
+@require_POST
+def api_stock_batch(request):
+    """
+    Stock, órdenes disponibles y precios de varios bienes y pares (orden, bien) en un
+    solo pedido, para no consultar fila por fila desde el formulario de remitos.
+
+    Cuerpo JSON: {"bienes": [bien_id, ...], "pares": [[orden_id, bien_id], ...]}.
+    Las órdenes de compra se filtran por el rubro del usuario como en
+    api_ordenes_con_stock_bien.
+    """
+    try:
+        datos = json.loads(request.body or '{}')
+        bien_ids = sorted({int(bien_id) for bien_id in datos.get('bienes', [])})
+        pares = sorted({(int(orden_id), int(bien_id)) for orden_id, bien_id in datos.get('pares', [])})
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({'status': 'error', 'error': 'Formato inválido'}, status=400)
+    if len(bien_ids) > LIMITE_STOCK_BATCH or len(pares) > LIMITE_STOCK_BATCH:
+        return JsonResponse({'status': 'error', 'error': f'Máximo {LIMITE_STOCK_BATCH} elementos por pedido'}, status=400)
+
+    user_rubro = get_user_rubro(request.user)
+    stocks = dict(saldos_bien().filter(bien_id__in=bien_ids).values_list('bien_id', 'stock'))
+    ordenes = ordenes_con_stock(bien_ids, rubro=user_rubro)
+    saldos = saldos_pares(pares, rubro=user_rubro)
+
+    return JsonResponse({
+        'status': 'ok',
+        'bienes': [
+            {
+                'bien_id': bien_id,
+                'encontrado': bien_id in stocks,
+                'stock': stocks.get(bien_id, 0),
+                'ordenes': ordenes.get(bien_id, []),
+            }
+            for bien_id in bien_ids
+        ],
+        'pares': [
+            {
+                'orden_id': orden_id,
+                'bien_id': bien_id,
+                'encontrado': (orden_id, bien_id) in saldos,
+                'stock': saldos[(orden_id, bien_id)]['stock'] if (orden_id, bien_id) in saldos else 0,
+                'precio': (
+                    texto_precio(saldos[(orden_id, bien_id)]['precio_unitario'])
+                    if (orden_id, bien_id) in saldos else ''
+                ),
+            }
+            for orden_id, bien_id in pares
+        ],
+    })
+
+
 @login_required
 def rubros_list(request):
     q = request.GET.get('q', '').strip()
@@ -66,15 +136,8 @@ def rubros_list(request):
 def bienes_list(request):
     q = request.GET.get('q', '').strip()
     rubro_id = request.GET.get('rubro')
-    from django.db.models import Sum, F
     # Calcular stock: sum(cantidad comprada) - sum(cantidad entregada)
-    bienes = Bien.objects.select_related('rubro').all()
-    bienes = bienes.annotate(
-        comprado=Sum('ordendecompraitem__cantidad'),
-        entregado=Sum('entregaitem__cantidad'),
-    )
-    
-    bienes = bienes.annotate(stock=F('comprado') - F('entregado'))
+    bienes = Bien.objects.select_related('rubro').with_stock()
     if q:
         bienes = bienes.filter(
             Q(nombre__icontains=q) |
@@ -106,37 +169,13 @@ def bienes_list(request):
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 
-# API stub: ordenes con stock para un bien
+# API: ordenes con stock para un bien
 @login_required
 def api_ordenes_con_stock_bien(request, bien_id):
-    from .models import OrdenDeCompraItem, OrdenDeCompra, EntregaItem
-    from django.db.models import Sum, F
-    # Buscar todas las ordenes de compra que tengan ese bien y stock disponible
-    # Stock disponible = cantidad comprada - cantidad entregada
-    # Primero, obtener todas las ordenes de compra con ese bien
-    items = (
-        OrdenDeCompraItem.objects
-        .filter(bien_id=bien_id)
-        .select_related('orden_de_compra')
-    )
-    
-    # Filtrar por rubro del usuario si no es superusuario o staff
+    # Stock disponible = cantidad comprada - cantidad entregada, leído del saldo por orden.
+    # El resultado se cachea por (bien, rubro del usuario) hasta el próximo cambio de stock.
     user_rubro = get_user_rubro(request.user)
-    if user_rubro:
-        items = items.filter(orden_de_compra__rubro=user_rubro)
-    
-    ordenes = []
-    for item in items:
-        # Calcular entregado para esa orden y bien
-        entregado = EntregaItem.objects.filter(orden_de_compra=item.orden_de_compra, bien_id=bien_id).aggregate(total=Sum('cantidad'))['total'] or 0
-        disponible = item.cantidad - entregado
-        if disponible > 0:
-            ordenes.append({
-                'id': item.orden_de_compra.id,
-                'numero': f"OC #{item.orden_de_compra.numero}",
-                'disponible': disponible,
-                'precio_unitario': str(item.precio_unitario),
-            })
+    ordenes = ordenes_con_stock_bien(bien_id, rubro=user_rubro)
     return JsonResponse({'status': 'ok', 'bien_id': bien_id, 'ordenes': ordenes})
 from .models import Entrega, OrdenDeCompraItem
 # Vista para listar remitos con paginador
@@ -177,42 +216,159 @@ def remitos_list(request):
 def reportes(request):
     return render(request, 'inventario/reportes.html')
 
+# Columnas del reporte personalizado según el tipo: (campo de la consulta, clave de la fila, título)
+COLUMNAS_PERSONALIZADO = {
+    'entregados': (
+        ('bien__nombre', 'bien', 'Bien'),
+        ('bien__rubro__nombre', 'rubro', 'Rubro'),
+        ('orden_de_compra__numero', 'orden', 'Orden'),
+        ('orden_de_compra__proveedor', 'proveedor', 'Proveedor'),
+        ('entrega__fecha', 'fecha', 'Fecha'),
+        (None, 'hora', 'Hora'),
+        ('entrega__area_persona', 'area_persona', 'Área/Persona'),
+        ('precio_unitario', 'precio_unitario', 'Precio unitario'),
+        ('cantidad', 'cantidad', 'Cantidad'),
+        ('precio_total', 'precio_total', 'Precio total'),
+    ),
+    'comprados': (
+        ('bien__nombre', 'bien', 'Bien'),
+        ('bien__rubro__nombre', 'rubro', 'Rubro'),
+        ('orden_de_compra__numero', 'orden', 'Orden'),
+        ('orden_de_compra__proveedor', 'proveedor', 'Proveedor'),
+        ('precio_unitario', 'precio_unitario', 'Precio unitario'),
+        ('cantidad', 'cantidad', 'Cantidad'),
+        ('precio_total', 'precio_total', 'Precio total'),
+    ),
+}
+# Orden de las filas (y clave de la paginación): fecha del movimiento e id
+FECHA_PERSONALIZADO = {
+    'entregados': 'entrega__fecha',
+    'comprados': 'orden_de_compra__fecha_inicio',
+}
+TAMANIO_BLOQUE_EXPORTACION = 2000
+POR_PAGINA_PERSONALIZADO = 20
+SALT_CURSOR_PERSONALIZADO = 'inventario.reporte_personalizado'
+
+
+def _consulta_personalizado(qs, tipo):
+    """Consulta ``values_list`` ordenada por (fecha, id); el id va al final de cada fila"""
+    campos = [campo for campo, _, _ in COLUMNAS_PERSONALIZADO[tipo] if campo]
+    fecha = FECHA_PERSONALIZADO[tipo]
+    return qs.order_by(fecha, 'pk').values_list(*campos, fecha, 'pk')
+
+
+def _convertir_fila_personalizado(valores, tipo):
+    """Valores de ``_consulta_personalizado`` (sin fecha de orden ni id) como lista para mostrar"""
+    from django.utils.timezone import localtime
+    fila = ['' if valor is None else valor for valor in valores]
+    if tipo == 'entregados':
+        # La fecha de la entrega se separa en fecha y hora locales
+        fecha = localtime(fila[4]) if fila[4] else None
+        fila[4:5] = [fecha.strftime('%Y-%m-%d'), fecha.strftime('%H:%M:%S')] if fecha else ['', '']
+    return fila
+
+
+def _filas_personalizado(qs, tipo):
+    """Filas del reporte personalizado leídas por bloques con values_list"""
+    for valores in _consulta_personalizado(qs, tipo).iterator(chunk_size=TAMANIO_BLOQUE_EXPORTACION):
+        yield _convertir_fila_personalizado(valores[:-2], tipo)
+
+
+def _pagina_personalizado(qs, tipo, cursor=None, por_pagina=POR_PAGINA_PERSONALIZADO):
+    """Una página de resultados paginada por clave (fecha, id) en la base.
+
+    Sólo se leen ``por_pagina + 1`` filas, cualquiera sea la cantidad que cumple los
+    filtros. Devuelve (filas, cursor_siguiente); el cursor es None en la última página.
+    """
+    from django.core import signing
+    from django.utils.dateparse import parse_datetime
+    campo_fecha = FECHA_PERSONALIZADO[tipo]
+    if cursor:
+        try:
+            fecha, pk = signing.loads(cursor, salt=SALT_CURSOR_PERSONALIZADO)
+            fecha = parse_datetime(fecha) or parse_date(fecha)
+        except (signing.BadSignature, ValueError, TypeError):
+            fecha = None
+        if fecha is not None:
+            qs = qs.filter(Q(**{f'{campo_fecha}__gt': fecha}) | Q(**{campo_fecha: fecha, 'pk__gt': pk}))
+
+    valores = list(_consulta_personalizado(qs, tipo)[:por_pagina + 1])
+    siguiente = None
+    if len(valores) > por_pagina:
+        valores = valores[:por_pagina]
+        fecha, pk = valores[-1][-2:]
+        siguiente = signing.dumps([fecha.isoformat(), pk], salt=SALT_CURSOR_PERSONALIZADO)
+    claves = [clave for _, clave, _ in COLUMNAS_PERSONALIZADO[tipo]]
+    filas = [dict(zip(claves, _convertir_fila_personalizado(fila[:-2], tipo))) for fila in valores]
+    return filas, siguiente
+
+
+def _exportar_personalizado(qs, tipo, formato):
+    """Excel o CSV del reporte personalizado enviados en streaming"""
+    encabezados = [titulo for _, _, titulo in COLUMNAS_PERSONALIZADO[tipo]]
+    if formato == 'csv':
+        return respuesta_csv('personalizado.csv', encabezados, _filas_personalizado(qs, tipo))
+    return respuesta_xlsx_streaming(
+        'personalizado.xlsx', encabezados, _filas_personalizado(qs, tipo), hoja='Reporte personalizado'
+    )
+
+
+def _pdf_personalizado(qs, tipo):
+    # Encabezados legibles
+    headers = [
+        'Bien', 'Rubro', 'Orden', 'Proveedor', 'Fecha', 'Hora', 'Área/Persona', 'Precio unitario', 'Cantidad', 'Precio total'
+    ]
+    claves = [clave for _, clave, _ in COLUMNAS_PERSONALIZADO[tipo]]
+
+    def celdas():
+        for valores in _filas_personalizado(qs, tipo):
+            row = dict(zip(claves, valores))
+            yield [
+                row.get('bien',''), row.get('rubro',''), row.get('orden',''), row.get('proveedor',''),
+                row.get('fecha',''), row.get('hora',''), row.get('area_persona',''), row.get('precio_unitario',''),
+                row.get('cantidad',''), row.get('precio_total','')
+            ]
+
+    documento = DocumentoPDF('Reporte personalizado')
+    # Anchos fijos para evitar superposición y centrar mejor
+    documento.tabla(
+        headers, celdas(), anchos=[70, 60, 40, 70, 55, 45, 70, 50, 40, 60],
+        vacia='No hay resultados para los filtros seleccionados.',
+    )
+    return documento.respuesta('personalizado.pdf')
+
+
 # Vista de reporte personalizado con filtros y resultados
 @login_required
 def reporte_personalizado(request):
     from .forms import ReportePersonalizadoForm
-    from .models import EntregaItem
-    from django.db.models import Q
-    import pandas as pd
-    from django.http import HttpResponse
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib import colors
-    from reportlab.lib.styles import getSampleStyleSheet
+    from datetime import datetime, time
+    from django.utils.timezone import make_aware, is_naive, get_current_timezone
 
     # Obtener valores únicos para proveedor y area_persona
-    from .models import Entrega, OrdenDeCompra
     proveedores = list(OrdenDeCompra.objects.order_by().values_list('proveedor', flat=True).distinct())
     areas_persona = list(Entrega.objects.order_by().values_list('area_persona', flat=True).distinct())
 
     form = ReportePersonalizadoForm(request.GET or None)
-    resultados = []
+    filas, siguiente, segundo_plano = None, None, None
     tipo = form.cleaned_data.get('tipo') if form.is_valid() else 'entregados'
     if form.is_valid() and any(form.cleaned_data.values()):
         filtros = Q()
         cd = form.cleaned_data
-        from datetime import datetime, time
-        from django.utils.timezone import make_aware, is_naive, get_current_timezone
         tz = get_current_timezone()
+        if cd['bien']:
+            filtros &= Q(bien=cd['bien'])
+        if cd['rubro']:
+            filtros &= Q(bien__rubro=cd['rubro'])
+        if cd['orden_de_compra']:
+            filtros &= Q(orden_de_compra=cd['orden_de_compra'])
+        if cd['proveedor']:
+            filtros &= Q(orden_de_compra__proveedor__icontains=cd['proveedor'])
+        if cd['precio_unitario_min'] is not None:
+            filtros &= Q(precio_unitario__gte=cd['precio_unitario_min'])
+        if cd['precio_unitario_max'] is not None:
+            filtros &= Q(precio_unitario__lte=cd['precio_unitario_max'])
         if tipo == 'entregados':
-            if cd['bien']:
-                filtros &= Q(bien=cd['bien'])
-            if cd['rubro']:
-                filtros &= Q(bien__rubro=cd['rubro'])
-            if cd['orden_de_compra']:
-                filtros &= Q(orden_de_compra=cd['orden_de_compra'])
-            if cd['proveedor']:
-                filtros &= Q(orden_de_compra__proveedor__icontains=cd['proveedor'])
             # Manejo correcto de fechas con zona horaria
             if cd['fecha_inicio']:
                 dt_inicio = datetime.combine(cd['fecha_inicio'], time.min)
@@ -226,712 +382,490 @@ def reporte_personalizado(request):
                 filtros &= Q(entrega__fecha__lte=dt_fin)
             if cd['area_persona']:
                 filtros &= Q(entrega__area_persona__icontains=cd['area_persona'])
-            if cd['precio_unitario_min'] is not None:
-                filtros &= Q(precio_unitario__gte=cd['precio_unitario_min'])
-            if cd['precio_unitario_max'] is not None:
-                filtros &= Q(precio_unitario__lte=cd['precio_unitario_max'])
-            qs = EntregaItem.objects.filter(filtros).select_related('bien', 'orden_de_compra', 'entrega', 'bien__rubro')
-            from django.utils.timezone import is_aware
-            for item in qs:
-                fecha = item.entrega.fecha if item.entrega else ''
-                fecha_str = ''
-                hora_str = ''
-                if fecha and hasattr(fecha, 'isoformat'):
-                    # Convertir a string sin zona horaria
-                    if is_aware(fecha):
-                        fecha = fecha.astimezone(None).replace(tzinfo=None)
-                    fecha_str = fecha.strftime('%Y-%m-%d')
-                    hora_str = fecha.strftime('%H:%M:%S')
-                resultados.append({
-                    'bien': item.bien.nombre,
-                    'rubro': item.bien.rubro.nombre if item.bien.rubro else '',
-                    'orden': item.orden_de_compra.numero if item.orden_de_compra else '',
-                    'proveedor': item.orden_de_compra.proveedor if item.orden_de_compra else '',
-                    'fecha': fecha_str,
-                    'hora': hora_str,
-                    'area_persona': item.entrega.area_persona if item.entrega else '',
-                    'precio_unitario': item.precio_unitario,
-                    'cantidad': item.cantidad,
-                    'precio_total': item.precio_total,
-                })
-        elif tipo == 'comprados':
-            from .models import OrdenDeCompraItem
-            if cd['bien']:
-                filtros &= Q(bien=cd['bien'])
-            if cd['rubro']:
-                filtros &= Q(bien__rubro=cd['rubro'])
-            if cd['orden_de_compra']:
-                filtros &= Q(orden_de_compra=cd['orden_de_compra'])
-            if cd['proveedor']:
-                filtros &= Q(orden_de_compra__proveedor__icontains=cd['proveedor'])
-            if cd['precio_unitario_min'] is not None:
-                filtros &= Q(precio_unitario__gte=cd['precio_unitario_min'])
-            if cd['precio_unitario_max'] is not None:
-                filtros &= Q(precio_unitario__lte=cd['precio_unitario_max'])
-            qs = OrdenDeCompraItem.objects.filter(filtros).select_related('bien', 'orden_de_compra', 'bien__rubro')
-            for item in qs:
-                resultados.append({
-                    'bien': item.bien.nombre,
-                    'rubro': item.bien.rubro.nombre if item.bien.rubro else '',
-                    'orden': item.orden_de_compra.numero if item.orden_de_compra else '',
-                    'proveedor': item.orden_de_compra.proveedor if item.orden_de_compra else '',
-                    'precio_unitario': item.precio_unitario,
-                    'cantidad': item.cantidad,
-                    'precio_total': item.precio_total,
-                })
-        # Exportar si corresponde
-        if request.GET.get('export') == 'excel':
-            df = pd.DataFrame(resultados)
-            response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-            response['Content-Disposition'] = 'attachment; filename=personalizado.xlsx'
-            df.to_excel(response, index=False)
-            return response
-        if request.GET.get('export') == 'pdf':
-            response = HttpResponse(content_type='application/pdf')
-            response['Content-Disposition'] = 'attachment; filename=personalizado.pdf'
-            doc = SimpleDocTemplate(response, pagesize=letter)
-            elements = []
-            styles = getSampleStyleSheet()
-            elements.append(Paragraph('Reporte personalizado', styles['Title']))
-            elements.append(Spacer(1, 12))
-            if resultados:
-                # Encabezados legibles
-                headers = [
-                    'Bien', 'Rubro', 'Orden', 'Proveedor', 'Fecha', 'Hora', 'Área/Persona', 'Precio unitario', 'Cantidad', 'Precio total'
-                ]
-                table_data = [headers]
-                for row in resultados:
-                    table_data.append([
-                        row.get('bien',''), row.get('rubro',''), row.get('orden',''), row.get('proveedor',''),
-                        row.get('fecha',''), row.get('hora',''), row.get('area_persona',''), row.get('precio_unitario',''),
-                        row.get('cantidad',''), row.get('precio_total','')
-                    ])
-                # Ajustar anchos de columna para que encuadre bien
-                # Ajustar anchos para evitar superposición y centrar mejor
-                col_widths = [70, 60, 40, 70, 55, 45, 70, 50, 40, 60]
-                t = Table(table_data, repeatRows=1, colWidths=col_widths, hAlign='CENTER')
-                t.setStyle(TableStyle([
-                    ('BACKGROUND', (0,0), (-1,0), colors.grey),
-                    ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-                    ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-                    ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-                    ('BOTTOMPADDING', (0,0), (-1,0), 8),
-                    ('BACKGROUND', (0,1), (-1,-1), colors.beige),
-                    ('GRID', (0,0), (-1,-1), 1, colors.black),
-                ]))
-                elements.append(t)
-            else:
-                elements.append(Paragraph('No hay resultados para los filtros seleccionados.', styles['Normal']))
-            doc.build(elements)
-            return response
-
-    # Paginación backend para resultados si hay datos
-    page_obj = None
-    if resultados:
-        from django.core.paginator import Paginator, EmptyPage
-        paginator = Paginator(resultados, 20)
-        page_number = request.GET.get('page')
-        try:
-            page_number_int = int(page_number) if page_number else 1
-        except (TypeError, ValueError):
-            page_number_int = 1
-        if page_number_int < 1:
-            page_number_int = 1
-        if page_number_int > paginator.num_pages and paginator.num_pages > 0:
-            page_number_int = paginator.num_pages
-        try:
-            page_obj = paginator.page(page_number_int)
-        except EmptyPage:
-            page_obj = paginator.page(1)
+            qs = EntregaItem.objects.filter(filtros)
+        else:
+            qs = OrdenDeCompraItem.objects.filter(filtros)
+
+        # Exportar si corresponde: Excel y CSV en streaming, PDF recorriendo la consulta por bloques
+        exportar = request.GET.get('export')
+        if exportar in ('excel', 'csv'):
+            return _exportar_personalizado(qs, tipo, exportar)
+        if exportar == 'pdf':
+            return _pdf_personalizado(qs, tipo)
+
+        filas, siguiente = _pagina_personalizado(qs, tipo, cursor=request.GET.get('cursor'))
+        # Conteo acotado: alcanza con saber si supera el umbral del segundo plano
+        segundo_plano = trabajos.ofrecer_segundo_plano(
+            request, 'personalizado', qs.order_by()[:trabajos.umbral_filas() + 1].count(),
+        )
+
+    parametros = request.GET.copy()
+    for clave in ('cursor', 'page', 'export'):
+        parametros.pop(clave, None)
     return render(request, 'inventario/reporte_personalizado.html', {
         'form': form,
-        'page_obj': page_obj,
+        'filas': filas,
+        'siguiente': siguiente,
+        'es_primera_pagina': not request.GET.get('cursor'),
+        'consulta': parametros.urlencode(),
         'request': request,
         'proveedores': proveedores,
         'areas_persona': areas_persona,
+        'segundo_plano': segundo_plano,
     })
 
+# Alias para compatibilidad con urls.py
 
-    # Paginación backend para resultados si hay datos
-    page_obj = None
-    if resultados:
-        from django.core.paginator import Paginator, EmptyPage
-        paginator = Paginator(resultados, 20)
-        page_number = request.GET.get('page')
-        try:
-            page_number_int = int(page_number) if page_number else 1
-        except (TypeError, ValueError):
-            page_number_int = 1
-        if page_number_int < 1:
-            page_number_int = 1
-        if page_number_int > paginator.num_pages and paginator.num_pages > 0:
-            page_number_int = paginator.num_pages
-        try:
-            page_obj = paginator.page(page_number_int)
-        except EmptyPage:
-            page_obj = paginator.page(1)
-    return render(request, 'inventario/reporte_personalizado.html', {'form': form, 'page_obj': page_obj, 'request': request})
+def _fecha_parametro(request, nombre='fecha'):
+    """Fecha AAAA-MM-DD de un parámetro GET; None si falta o es inválida"""
+    try:
+        return parse_date(request.GET.get(nombre) or '')
+    except ValueError:
+        return None
+
+ENCABEZADOS_STOCK = ['Rubro', 'Bien', 'Stock', 'Valor en Stock ($)', 'Total Entregado', 'Valor Entregado ($)']
+
+
+def _planilla_stock(filas):
+    for fila in filas:
+        yield [
+            fila['rubro_nombre'] or '', fila['nombre'], fila['stock'], fila['valor_stock'],
+            fila['entregado'], fila['valor_entregado'],
+        ]
+
+
+def _pdf_stock(nombre_archivo, titulo, filas, por_rubro=False):
+    """PDF de los reportes de stock en una sola pasada sobre las filas ordenadas por rubro.
+
+    Con ``por_rubro`` cada rubro lleva su subtítulo y sus propias tablas.
+    """
+    encabezados = ['Bien', 'Stock', 'Total Entregado', 'Valor Entregado ($)']
+    if not por_rubro:
+        encabezados.insert(0, 'Rubro')
+
+    def celdas():
+        for fila in filas:
+            valores = [fila['nombre'], fila['stock'], fila['entregado'], f"{fila['valor_entregado']:.2f}"]
+            if por_rubro:
+                yield f"Rubro: {fila['rubro_nombre']}", valores
+            else:
+                yield [fila['rubro_nombre'] or ''] + valores
+
+    documento = DocumentoPDF(titulo)
+    documento.tabla(encabezados, celdas(), agrupada=por_rubro)
+    return documento.respuesta(nombre_archivo)
 
-# Alias para compatibilidad con urls.py
 
-# Stubs de reportes (para evitar errores de import hasta implementar cada uno)
 @login_required
 def reporte_stock_rubro(request):
-    from .models import Rubro, Bien, EntregaItem
-    from django.db.models import Sum, F, DecimalField, ExpressionWrapper
-    import pandas as pd
-    from django.http import HttpResponse
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib import colors
-    from reportlab.lib.styles import getSampleStyleSheet
-
-    rubros = Rubro.objects.all().order_by('nombre')
-    data = []
-    excel_rows = []
-    for rubro in rubros:
-        bienes = Bien.objects.filter(rubro=rubro)
-        bienes_data = []
-        for bien in bienes:
-            comprado = OrdenDeCompraItem.objects.filter(bien=bien).aggregate(total=Sum('cantidad'))['total'] or 0
-            entregado = EntregaItem.objects.filter(bien=bien).aggregate(
-                total=Sum('cantidad'),
-                total_pesos=Sum(ExpressionWrapper(F('cantidad') * F('precio_unitario'), output_field=DecimalField(max_digits=14, decimal_places=2)))
-            )
-            stock = comprado - (entregado['total'] or 0)
-            # Calcular precio_unitario promedio ponderado
-            from django.db.models import FloatField
-            suma_precio_total = OrdenDeCompraItem.objects.filter(bien=bien).aggregate(
-                suma=Sum(ExpressionWrapper(F('cantidad') * F('precio_unitario'), output_field=FloatField()))
-            )['suma'] or 0
-            cantidad_total = OrdenDeCompraItem.objects.filter(bien=bien).aggregate(total=Sum('cantidad'))['total'] or 0
-            precio_unitario_prom = (suma_precio_total / cantidad_total) if cantidad_total else 0
-            valor_stock = stock * precio_unitario_prom
-            row = {
-                'Rubro': rubro.nombre,
-                'Bien': bien.nombre,
-                'Stock': stock,
-                'Valor_Stock': valor_stock,
-                'Total Entregado': entregado['total'] or 0,
-                'Valor Entregado ($)': float(entregado['total_pesos'] or 0),
-            }
-            bienes_data.append({
-                'bien': bien,
-                'stock': stock,
-                'valor_stock': valor_stock,
-                'entregado': entregado['total'] or 0,
-                'valor': entregado['total_pesos'] or 0,
-            })
-            excel_rows.append(row)
-        data.append({'rubro': rubro, 'bienes': bienes_data})
+    # ?fecha=AAAA-MM-DD: stock al cierre de ese día (fotos de stock + movimientos posteriores)
+    fecha = _fecha_parametro(request)
+    sufijo = f'_{fecha:%Y%m%d}' if fecha else ''
+    titulo = 'Estado de Stock por Rubro' + (f' al {fecha:%d/%m/%Y}' if fecha else '')
+    filas = filas_stock_bienes(fecha, solo_con_rubro=True)
 
     if request.GET.get('export') == 'excel':
-        df = pd.DataFrame(excel_rows)
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename=stock_por_rubro.xlsx'
-        df.to_excel(response, index=False)
-        return response
-
+        filas = filas.iterator() if fecha is None else filas
+        return respuesta_xlsx_streaming(f'stock_por_rubro{sufijo}.xlsx', ENCABEZADOS_STOCK, _planilla_stock(filas))
     if request.GET.get('export') == 'pdf':
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = 'attachment; filename=stock_por_rubro.pdf'
-        doc = SimpleDocTemplate(response, pagesize=letter)
-        elements = []
-        styles = getSampleStyleSheet()
-        elements.append(Paragraph('Estado de Stock por Rubro', styles['Title']))
-        elements.append(Spacer(1, 12))
-        current_rubro = None
-        for row in excel_rows:
-            if row['Rubro'] != current_rubro:
-                if current_rubro is not None:
-                    elements.append(Spacer(1, 12))
-                elements.append(Paragraph(f"Rubro: {row['Rubro']}", styles['Heading3']))
-                table_data = [["Bien", "Stock", "Total Entregado", "Valor Entregado ($)"]]
-                current_rubro = row['Rubro']
-            table_data.append([row['Bien'], row['Stock'], row['Total Entregado'], f"{row['Valor Entregado ($)']:.2f}"])
-            # Si es el último bien del rubro o el último row, renderizar la tabla
-            next_row = excel_rows[excel_rows.index(row)+1] if excel_rows.index(row)+1 < len(excel_rows) else None
-            if not next_row or next_row['Rubro'] != current_rubro:
-                t = Table(table_data, repeatRows=1)
-                t.setStyle(TableStyle([
-                    ('BACKGROUND', (0,0), (-1,0), colors.grey),
-                    ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-                    ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-                    ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-                    ('BOTTOMPADDING', (0,0), (-1,0), 8),
-                    ('BACKGROUND', (0,1), (-1,-1), colors.beige),
-                    ('GRID', (0,0), (-1,-1), 1, colors.black),
-                ]))
-                elements.append(t)
-        doc.build(elements)
-        return response
-
-    return render(request, 'inventario/reporte_stock_rubro.html', {'data': data})
+        return _pdf_stock(f'stock_por_rubro{sufijo}.pdf', titulo, filas, por_rubro=True)
+
+    bienes_por_rubro = {}
+    for fila in filas:
+        bienes_por_rubro.setdefault(fila['rubro_id'], []).append(fila)
+    data = [
+        {'rubro': rubro, 'bienes': bienes_por_rubro.get(rubro.pk, [])}
+        for rubro in Rubro.objects.order_by('nombre')
+    ]
+    return render(request, 'inventario/reporte_stock_rubro.html', {'data': data, 'fecha': fecha})
 
 @login_required
 def reporte_stock_bien(request):
-    from .models import Bien, EntregaItem, Rubro
-    from django.db.models import Sum, F, DecimalField, ExpressionWrapper
-    import pandas as pd
-    from django.http import HttpResponse
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib import colors
-    from reportlab.lib.styles import getSampleStyleSheet
-
-    bienes = Bien.objects.select_related('rubro').all().order_by('rubro__nombre', 'nombre')
-    data = []
-    excel_rows = []
-    for bien in bienes:
-        comprado = OrdenDeCompraItem.objects.filter(bien=bien).aggregate(total=Sum('cantidad'))['total'] or 0
-        entregado = EntregaItem.objects.filter(bien=bien).aggregate(
-            total=Sum('cantidad'),
-            total_pesos=Sum(ExpressionWrapper(F('cantidad') * F('precio_unitario'), output_field=DecimalField(max_digits=14, decimal_places=2)))
-        )
-        stock = comprado - (entregado['total'] or 0)
-        from django.db.models import FloatField
-        suma_precio_total = OrdenDeCompraItem.objects.filter(bien=bien).aggregate(
-            suma=Sum(ExpressionWrapper(F('cantidad') * F('precio_unitario'), output_field=FloatField()))
-        )['suma'] or 0
-        cantidad_total = OrdenDeCompraItem.objects.filter(bien=bien).aggregate(total=Sum('cantidad'))['total'] or 0
-        precio_unitario_prom = (suma_precio_total / cantidad_total) if cantidad_total else 0
-        valor_stock = stock * precio_unitario_prom
-        row = {
-            'Rubro': bien.rubro.nombre if bien.rubro else '',
-            'Bien': bien.nombre,
-            'Stock': stock,
-            'Valor_Stock': valor_stock,
-            'Total_Entregado': entregado['total'] or 0,
-            'Valor_Entregado': float(entregado['total_pesos'] or 0),
-        }
-        data.append(row)
-        excel_rows.append({
-            'Rubro': bien.rubro.nombre if bien.rubro else '',
-            'Bien': bien.nombre,
-            'Stock': stock,
-            'Valor en Stock ($)': valor_stock,
-            'Total Entregado': entregado['total'] or 0,
-            'Valor Entregado ($)': float(entregado['total_pesos'] or 0),
-        })
-
-    # Paginación unificada (debe estar antes de los bloques de exportación)
-    paginator = Paginator(data, 20)
-    page_number = request.GET.get('page')
-    try:
-        page_number_int = int(page_number) if page_number else 1
-    except (TypeError, ValueError):
-        page_number_int = 1
-    if page_number_int < 1:
-        page_number_int = 1
-    if page_number_int > paginator.num_pages and paginator.num_pages > 0:
-        page_number_int = paginator.num_pages
-    try:
-        page_obj = paginator.page(page_number_int)
-    except EmptyPage:
-        page_obj = paginator.page(1)
+    # ?fecha=AAAA-MM-DD: stock al cierre de ese día (fotos de stock + movimientos posteriores)
+    fecha = _fecha_parametro(request)
+    sufijo = f'_{fecha:%Y%m%d}' if fecha else ''
+    titulo = 'Estado de Stock por Bien' + (f' al {fecha:%d/%m/%Y}' if fecha else '')
+    filas = filas_stock_bienes(fecha)
 
     if request.GET.get('export') == 'excel':
-        df = pd.DataFrame(excel_rows)
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename=stock_por_bien.xlsx'
-        df.to_excel(response, index=False)
-        return response
-
+        filas = filas.iterator() if fecha is None else filas
+        return respuesta_xlsx_streaming(f'stock_por_bien{sufijo}.xlsx', ENCABEZADOS_STOCK, _planilla_stock(filas))
     if request.GET.get('export') == 'pdf':
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = 'attachment; filename=stock_por_bien.pdf'
-        doc = SimpleDocTemplate(response, pagesize=letter)
-        elements = []
-        styles = getSampleStyleSheet()
-        elements.append(Paragraph('Estado de Stock por Bien', styles['Title']))
-        elements.append(Spacer(1, 12))
-        table_data = [["Rubro", "Bien", "Stock", "Total Entregado", "Valor Entregado ($)"]]
-        for row in excel_rows:
-            table_data.append([row['Rubro'], row['Bien'], row['Stock'], row['Total Entregado'], f"{row['Valor Entregado ($)']:.2f}"])
-        t = Table(table_data, repeatRows=1)
-        t.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.grey),
-            ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-            ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-            ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-            ('BOTTOMPADDING', (0,0), (-1,0), 8),
-            ('BACKGROUND', (0,1), (-1,-1), colors.beige),
-            ('GRID', (0,0), (-1,-1), 1, colors.black),
-        ]))
-        elements.append(t)
-        doc.build(elements)
-        return response
-
-    return render(request, 'inventario/reporte_stock_bien.html', {'page_obj': page_obj})
+        return _pdf_stock(f'stock_por_bien{sufijo}.pdf', titulo, filas)
+
+    # Sin fecha la página sale de la base (LIMIT/OFFSET sobre la consulta agrupada)
+    paginator = Paginator(filas, 20)
+    page_obj = paginator.get_page(request.GET.get('page'))
+    return render(request, 'inventario/reporte_stock_bien.html', {
+        'page_obj': page_obj,
+        'fecha': fecha,
+        'segundo_plano': trabajos.ofrecer_segundo_plano(request, 'stock_bien', paginator.count),
+    })
 
 @login_required
-def reporte_entregas_anio(request):
-    from .models import Entrega, EntregaItem
-    from django.db.models import Sum
-    import pandas as pd
-    from django.http import HttpResponse
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib import colors
-    from reportlab.lib.styles import getSampleStyleSheet
-    from django.db.models.functions import ExtractYear
-
-    # --- NUEVA IMPLEMENTACIÓN: Totales y detalle por año, rubro y bien ---
-    from collections import defaultdict
-    from django.db.models import F, DecimalField, ExpressionWrapper
-    # --- NUEVA IMPLEMENTACIÓN: solapas por año y exportación filtrada ---
-    anio_param = request.GET.get('anio')
-    # Totales por año (para tabs)
-    resumen = (
-        EntregaItem.objects
-        .annotate(anio=ExtractYear('entrega__fecha'), subtotal=F('cantidad') * F('precio_unitario'))
-        .values('anio')
-        .annotate(
-            cantidad=Sum('cantidad'),
-            total=Sum('subtotal', output_field=DecimalField(max_digits=20, decimal_places=2))
+def reporte_kardex(request):
+    """Kardex de un bien: compras y entregas en orden cronológico con saldo acumulado"""
+    bienes = Bien.objects.order_by('nombre').only('id', 'nombre')
+    bien = None
+    bien_id = request.GET.get('bien')
+    if bien_id and bien_id.isdigit():
+        bien = Bien.objects.select_related('rubro').filter(pk=bien_id).first()
+
+    if bien and request.GET.get('export') == 'excel':
+        filas = (
+            (
+                mov['fecha'], mov['tipo_nombre'], mov['orden_numero'] or '',
+                f"Remito #{mov['entrega_id']}" if mov['entrega_id'] else '',
+                mov['destino'] or '', mov['ingreso'], mov['egreso'], mov['saldo'],
+                float(mov['precio_unitario'] or 0),
+            )
+            for mov in iterar_kardex(bien.pk)
+        )
+        return respuesta_xlsx(
+            f'kardex_{bien.pk}.xlsx',
+            ['Fecha', 'Tipo', 'Orden de Compra', 'Remito', 'Destino', 'Ingreso', 'Egreso', 'Saldo', 'Precio Unitario'],
+            filas,
+            hoja='Kardex',
         )
-        .order_by('anio')
-    )
-    totales = []
-    for row in resumen:
-        totales.append({
-            'anio': row['anio'],
-            'cantidad': row['cantidad'],
-            'total': float(row['total'] or 0),
-        })
 
-    # Si hay año seleccionado, filtrar detalle solo para ese año
-    if anio_param:
-        try:
-            anio_int = int(anio_param)
-        except Exception:
-            anio_int = None
-    else:
-        anio_int = None
-
-    # Detalle por año, rubro y bien
-    items_qs = EntregaItem.objects.select_related('bien__rubro').annotate(anio=ExtractYear('entrega__fecha'), subtotal=F('cantidad') * F('precio_unitario'))
-    if anio_int:
-        items_qs = items_qs.filter(anio=anio_int)
-    items = (
-        items_qs
-        .values('anio', 'bien__rubro__nombre', 'bien__nombre')
-        .annotate(
-            cantidad=Sum('cantidad'),
-            total=Sum('subtotal', output_field=DecimalField(max_digits=20, decimal_places=2))
+    movimientos, siguiente = [], None
+    if bien:
+        movimientos, siguiente = pagina_kardex(bien.pk, cursor=request.GET.get('cursor'))
+    return render(request, 'inventario/reporte_kardex.html', {
+        'bienes': bienes,
+        'bien': bien,
+        'movimientos': movimientos,
+        'siguiente': siguiente,
+        'es_primera_pagina': not request.GET.get('cursor'),
+        'stock_actual': stock_bien(bien.pk) if bien else None,
+    })
+
+def _datos_report_job(job):
+    return {
+        'id': job.pk,
+        'reporte': trabajos.REPORTES[job.reporte][1] if job.reporte in trabajos.REPORTES else job.reporte,
+        'formato': job.formato,
+        'estado': job.estado,
+        'estado_display': job.get_estado_display(),
+        'progreso': job.progreso,
+        'error': job.error,
+        'creado': job.creado.isoformat(),
+        'url_descarga': reverse('reporte_job_descargar', args=[job.pk]) if job.estado == 'TERMINADO' else None,
+    }
+
+@login_required
+@require_POST
+def reporte_job_crear(request):
+    """Encola la exportación de un reporte para generarla en segundo plano"""
+    try:
+        job = trabajos.encolar(
+            request.user,
+            request.POST.get('reporte', ''),
+            consulta=request.POST.get('consulta', ''),
+            formato=request.POST.get('formato', 'pdf'),
+            filas_estimadas=int(request.POST.get('filas') or 0),
         )
-        .order_by('anio', 'bien__rubro__nombre', 'bien__nombre')
-    )
-    detalles_por_anio = defaultdict(list)
-    for row in items:
-        detalles_por_anio[row['anio']].append({
-            'rubro': row['bien__rubro__nombre'],
-            'bien': row['bien__nombre'],
-            'cantidad': row['cantidad'],
-            'total': float(row['total'] or 0),
-        })
-    detalles_por_anio_list = [
-        {'anio': anio, 'detalle': detalles_por_anio[anio]}
-        for anio in sorted(detalles_por_anio.keys())
-    ]
+    except ValueError as exc:
+        if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+            return JsonResponse({'status': 'error', 'message': str(exc)}, status=400)
+        messages.error(request, str(exc))
+        return redirect('reporte_jobs')
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        return JsonResponse({'status': 'ok', 'job': _datos_report_job(job)})
+    messages.success(request, 'El reporte se está generando en segundo plano. Podés descargarlo desde esta página cuando termine.')
+    return redirect('reporte_jobs')
+
+@login_required
+def reporte_jobs(request):
+    """Reportes pedidos en segundo plano por el usuario"""
+    jobs = ReportJob.objects.filter(usuario=request.user)[:50]
+    return render(request, 'inventario/reporte_jobs.html', {
+        'jobs': [_datos_report_job(job) for job in jobs],
+    })
 
-    # Si hay año seleccionado, mostrar solo ese año en detalles_por_anio_list
-    if anio_int:
-        detalles_por_anio_list = [d for d in detalles_por_anio_list if d['anio'] == anio_int]
-
-    data = {'totales': totales, 'detalles_por_anio': detalles_por_anio_list, 'anio_seleccionado': anio_int}
-
-    if request.GET.get('export') == 'excel' and anio_int:
-        import pandas as pd
-        # Exportar solo el año seleccionado
-        totales_sel = [t for t in totales if t['anio'] == anio_int]
-        detalles_sel = [d for d in detalles_por_anio_list if d['anio'] == anio_int]
-        with pd.ExcelWriter(f'entregas_{anio_int}.xlsx', engine='openpyxl') as writer:
-            pd.DataFrame([{ 'Año': t['anio'], 'Cantidad de Entregas': t['cantidad'], 'Monto Total ($)': t['total']} for t in totales_sel]).to_excel(writer, sheet_name='Totales', index=False)
-            for anio in detalles_sel:
-                df = pd.DataFrame(anio['detalle'])
-                df.rename(columns={'rubro': 'Rubro', 'bien': 'Bien', 'cantidad': 'Cantidad Entregada', 'total': 'Monto Total ($)'}, inplace=True)
-                df.to_excel(writer, sheet_name=f"Detalle {anio['anio']}", index=False)
-            writer.save()
-            with open(f'entregas_{anio_int}.xlsx', 'rb') as f:
-                response = HttpResponse(f.read(), content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-                response['Content-Disposition'] = f'attachment; filename=entregas_{anio_int}.xlsx'
-                return response
-
-    if request.GET.get('export') == 'pdf' and anio_int:
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename=entregas_{anio_int}.pdf'
-        doc = SimpleDocTemplate(response, pagesize=letter)
-        elements = []
-        styles = getSampleStyleSheet()
-        elements.append(Paragraph(f'Entregas año {anio_int}', styles['Title']))
-        elements.append(Spacer(1, 12))
-        totales_sel = [t for t in totales if t['anio'] == anio_int]
-        table_data = [["Año", "Cantidad de Entregas", "Monto Total ($)"]]
-        for t in totales_sel:
-            table_data.append([t['anio'], t['cantidad'], f"{t['total']:.2f}"])
-        t = Table(table_data, repeatRows=1)
-        t.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.grey),
-            ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-            ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-            ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-            ('BOTTOMPADDING', (0,0), (-1,0), 8),
-            ('BACKGROUND', (0,1), (-1,-1), colors.beige),
-            ('GRID', (0,0), (-1,-1), 1, colors.black),
-        ]))
-        elements.append(t)
-        elements.append(Spacer(1, 24))
-        for anio in detalles_por_anio_list:
-            elements.append(Paragraph(f'Detalle por rubro y bien (año: {anio["anio"]})', styles['Heading3']))
-            table_data2 = [["Rubro", "Bien", "Cantidad Entregada", "Monto Total ($)"]]
-            for row in anio['detalle']:
-                table_data2.append([row['rubro'], row['bien'], row['cantidad'], f"{row['total']:.2f}"])
-            t2 = Table(table_data2, repeatRows=1)
-            t2.setStyle(TableStyle([
-                ('BACKGROUND', (0,0), (-1,0), colors.grey),
-                ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-                ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-                ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-                ('BOTTOMPADDING', (0,0), (-1,0), 8),
-                ('BACKGROUND', (0,1), (-1,-1), colors.beige),
-                ('GRID', (0,0), (-1,-1), 1, colors.black),
-            ]))
-            elements.append(t2)
-            elements.append(Spacer(1, 12))
-        doc.build(elements)
-        return response
-
-    return render(request, 'inventario/reporte_entregas_anio.html', {'data': data})
+@login_required
+def reporte_job_estado(request, pk):
+    """Estado y progreso de un reporte en segundo plano (JSON)"""
+    job = get_object_or_404(ReportJob, pk=pk, usuario=request.user)
+    return JsonResponse({'status': 'ok', 'job': _datos_report_job(job)})
 
 @login_required
-def reporte_entregas_area(request):
-    from .models import Entrega
-    from django.db.models import Sum
-    import pandas as pd
-    from django.http import HttpResponse
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib import colors
-    from reportlab.lib.styles import getSampleStyleSheet
-
-    # Totales por área/persona
-    from .models import EntregaItem
-    from django.db.models.functions import ExtractYear
-    totales_qs = Entrega.objects.values('area_persona').annotate(
-        cantidad=Sum(1),
-        total=Sum('items__precio_total')
-    ).order_by('area_persona')
-    totales = [
-        {'area': row['area_persona'], 'cantidad': row['cantidad'], 'total': float(row['total'] or 0)}
-        for row in totales_qs
+def reporte_job_descargar(request, pk):
+    from django.http import FileResponse, Http404
+    job = get_object_or_404(ReportJob, pk=pk, usuario=request.user, estado='TERMINADO')
+    try:
+        archivo = open(job.archivo, 'rb')
+    except OSError:
+        raise Http404("El archivo del reporte ya no está disponible.")
+    return FileResponse(archivo, as_attachment=True, filename=job.nombre_archivo)
+
+class EntregasAnioReporte(Reporte):
+    """Entregas por año con el detalle por rubro y bien, leídas del resumen mensual de entregas.
+
+    Con ``anio`` el detalle (y su exportación) se limita a ese año; la tabla de
+    totales por año muestra siempre todos para poder elegir otro.
+    """
+    titulo = 'Entregas por Año'
+    icono = 'fa-calendar-days'
+    nombre_archivo = 'entregas_por_anio'
+    template_name = 'inventario/reporte_entregas_anio.html'
+    modelos = (ResumenEntregas, Bien, Rubro)
+    columnas = [
+        Columna('bien__rubro__nombre', 'Rubro'),
+        Columna('bien__nombre', 'Bien'),
+        Columna('cantidad', 'Cantidad Entregada', 'entero'),
+        Columna('total', 'Monto Total ($)', 'moneda'),
+    ]
+    agrupar_por = 'anio'
+    titulo_grupo = 'Año'
+    totalizar = ('cantidad', 'total')
+    titulo_resumen = 'Totales por año'
+    columnas_resumen = [
+        Columna('anio', 'Año'),
+        Columna('cantidad', 'Cantidad de Entregas', 'entero'),
+        Columna('total', 'Monto Total ($)', 'moneda'),
     ]
 
-    # Detalle por año, área/persona y bien (incluyendo fecha de entrega)
-    detalle_qs = EntregaItem.objects.annotate(
-        anio=ExtractYear('entrega__fecha')
-    ).values('anio', 'entrega__area_persona', 'bien__nombre', 'entrega__fecha').annotate(
-        cantidad=Sum('cantidad')
-    ).order_by('anio', 'entrega__area_persona', 'bien__nombre', 'entrega__fecha')
-
-    # Agrupar para el template: {anio: {detalle: [{area, bien, cantidad, fecha}]}}
-    from collections import defaultdict
-    detalles_por_anio = defaultdict(list)
-    for row in detalle_qs:
-        detalles_por_anio[row['anio']].append({
-            'area': row['entrega__area_persona'],
-            'bien': row['bien__nombre'],
-            'cantidad': row['cantidad'],
-            'fecha_entrega': row['entrega__fecha'],
-        })
-    detalles_por_anio = [
-        {'anio': anio, 'detalle': detalles}
-        for anio, detalles in sorted(detalles_por_anio.items())
+    def __init__(self, request):
+        super().__init__(request)
+        anio = request.GET.get('anio') or ''
+        self.anio = int(anio) if anio.isdigit() else None
+
+    def get_queryset(self):
+        qs = ResumenEntregas.objects.all()
+        if self.anio:
+            qs = qs.filter(anio=self.anio)
+        return (
+            qs.values('anio', 'bien__rubro__nombre', 'bien__nombre')
+            .annotate(cantidad=Sum('cantidad'), total=Sum('monto'))
+            .order_by('anio', 'bien__rubro__nombre', 'bien__nombre')
+        )
+
+    def resumen(self):
+        return (
+            ResumenEntregas.objects.values('anio')
+            .annotate(cantidad=Sum('cantidad'), total=Sum('monto'))
+            .order_by('anio')
+        )
+
+
+reporte_entregas_anio = EntregasAnioReporte.as_view()
+
+
+class EntregasAreaReporte(Reporte):
+    """Entregas por área/persona: totales y detalle por año, mes y bien (del resumen mensual)"""
+    titulo = 'Entregas por Área / Persona'
+    icono = 'fa-users'
+    nombre_archivo = 'entregas_por_area'
+    template_name = 'inventario/reporte_entregas_area.html'
+    modelos = (ResumenEntregas, Bien)
+    columnas = [
+        Columna('area_persona', 'Área / Persona'),
+        Columna('bien__nombre', 'Bien'),
+        Columna('mes', 'Mes'),
+        Columna('cantidad', 'Cantidad Entregada', 'entero'),
+    ]
+    agrupar_por = 'anio'
+    titulo_grupo = 'Año'
+    totalizar = ('cantidad',)
+    titulo_resumen = 'Totales por área/persona'
+    columnas_resumen = [
+        Columna('area_persona', 'Área / Persona'),
+        Columna('cantidad', 'Cantidad de Entregas', 'entero'),
+        Columna('total', 'Monto Total ($)', 'moneda'),
     ]
 
-    # Para exportar a Excel
-    if request.GET.get('export') == 'excel':
-        from io import BytesIO
-        buffer = BytesIO()
-        with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-            df_totales = pd.DataFrame([{ 'Área / Persona': t['area'], 'Cantidad de Entregas': t['cantidad'], 'Monto Total ($)': t['total'] } for t in totales])
-            df_detalle = pd.DataFrame([
-                { 'Año': d['anio'], 'Área / Persona': d['entrega__area_persona'], 'Bien': d['bien__nombre'], 'Fecha de Entrega': d['entrega__fecha'].strftime('%d/%m/%Y'), 'Cantidad Entregada': d['cantidad'] }
-                for d in detalle_qs
-            ])
-            df_totales.to_excel(writer, sheet_name='Totales', index=False)
-            df_detalle.to_excel(writer, sheet_name='Detalle', index=False)
-        
-        buffer.seek(0)
-        response = HttpResponse(buffer.getvalue(), content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename=entregas_por_area.xlsx'
-        return response
+    def get_queryset(self):
+        return (
+            ResumenEntregas.objects.values('anio', 'mes', 'area_persona', 'bien__nombre')
+            .annotate(cantidad=Sum('cantidad'))
+            .order_by('anio', 'area_persona', 'bien__nombre', 'mes')
+        )
 
-    # Para exportar a PDF
-    if request.GET.get('export') == 'pdf':
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = 'attachment; filename=entregas_por_area.pdf'
-        doc = SimpleDocTemplate(response, pagesize=letter)
-        elements = []
-        styles = getSampleStyleSheet()
-        elements.append(Paragraph('Entregas por Área / Persona', styles['Title']))
-        elements.append(Spacer(1, 12))
-        # Totales
-        elements.append(Paragraph('Totales por área/persona', styles['Heading2']))
-        table_data = [["Área / Persona", "Cantidad de Entregas", "Monto Total ($)"]]
-        for t in totales:
-            table_data.append([t['area'], t['cantidad'], f"{t['total']:.2f}"])
-        t1 = Table(table_data, repeatRows=1)
-        t1.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.grey),
-            ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-            ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-            ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-            ('BOTTOMPADDING', (0,0), (-1,0), 8),
-            ('BACKGROUND', (0,1), (-1,-1), colors.beige),
-            ('GRID', (0,0), (-1,-1), 1, colors.black),
-        ]))
-        elements.append(t1)
-        elements.append(Spacer(1, 18))
-        # Detalle por año
-        for anio in detalles_por_anio:
-            elements.append(Paragraph(f"Año: {anio['anio']}", styles['Heading3']))
-            table_data2 = [["Área / Persona", "Bien", "Fecha de Entrega", "Cantidad Entregada"]]
-            for d in anio['detalle']:
-                table_data2.append([d['area'], d['bien'], d['fecha_entrega'].strftime('%d/%m/%Y'), d['cantidad']])
-            t2 = Table(table_data2, repeatRows=1)
-            t2.setStyle(TableStyle([
-                ('BACKGROUND', (0,0), (-1,0), colors.grey),
-                ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-                ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-                ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-                ('BOTTOMPADDING', (0,0), (-1,0), 8),
-                ('BACKGROUND', (0,1), (-1,-1), colors.beige),
-                ('GRID', (0,0), (-1,-1), 1, colors.black),
-            ]))
-            elements.append(t2)
-            elements.append(Spacer(1, 12))
-        doc.build(elements)
-        return response
-
-    return render(request, 'inventario/reporte_entregas_area.html', {'data': {'totales': totales, 'detalles_por_anio': detalles_por_anio}})
+    def preparar_fila(self, fila):
+        fila['mes'] = f"{fila['mes']:02d}/{fila['anio']}"
+        return fila
 
-@login_required
-def reporte_ranking_bienes(request):
-    from .models import Bien, EntregaItem
-    from django.db.models import Sum
-    import pandas as pd
-    from django.http import HttpResponse
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib import colors
-    from reportlab.lib.styles import getSampleStyleSheet
-
-    ranking = EntregaItem.objects.values('bien__nombre').annotate(
-        cantidad=Sum('cantidad'),
-        valor=Sum('precio_total')
-    ).order_by('-cantidad')
-
-    data = []
-    for row in ranking:
-        data.append({
-            'bien': row['bien__nombre'],
-            'cantidad': row['cantidad'],
-            'valor': float(row['valor'] or 0),
-        })
+    def resumen(self):
+        return (
+            ResumenEntregas.objects.values('area_persona')
+            .annotate(cantidad=Sum('lineas'), total=Sum('monto'))
+            .order_by('area_persona')
+        )
 
-    if request.GET.get('export') == 'excel':
-        df = pd.DataFrame([{ 'Bien': d['bien'], 'Cantidad Entregada': d['cantidad'], 'Valor Total Entregado ($)': d['valor'] } for d in data])
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename=ranking_bienes.xlsx'
-        df.to_excel(response, index=False)
-        return response
+    def contexto_extra(self):
+        filas = self.en_cache(lambda: self.get_queryset().count(), 'cantidad')
+        return {'segundo_plano': trabajos.ofrecer_segundo_plano(self.request, 'entregas_area', filas)}
 
-    if request.GET.get('export') == 'pdf':
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = 'attachment; filename=ranking_bienes.pdf'
-        doc = SimpleDocTemplate(response, pagesize=letter)
-        elements = []
-        styles = getSampleStyleSheet()
-        elements.append(Paragraph('Ranking de bienes más entregados', styles['Title']))
-        elements.append(Spacer(1, 12))
-        table_data = [["Bien", "Cantidad Entregada", "Valor Total Entregado ($)"]]
-        for d in data:
-            table_data.append([d['bien'], d['cantidad'], f"{d['valor']:.2f}"])
-        t = Table(table_data, repeatRows=1)
-        t.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.grey),
-            ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-            ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-            ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-            ('BOTTOMPADDING', (0,0), (-1,0), 8),
-            ('BACKGROUND', (0,1), (-1,-1), colors.beige),
-            ('GRID', (0,0), (-1,-1), 1, colors.black),
-        ]))
-        elements.append(t)
-        doc.build(elements)
-        return response
-
-    return render(request, 'inventario/reporte_ranking_bienes.html', {'data': data})
 
-@login_required
-def reporte_ranking_proveedores(request):
-    from .models import EntregaItem
-    from django.db.models import Sum
-    import pandas as pd
-    from django.http import HttpResponse
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib import colors
-    from reportlab.lib.styles import getSampleStyleSheet
+reporte_entregas_area = EntregasAreaReporte.as_view()
+
+
+def _mes_parametro(request, nombre):
+    """Mes de un parámetro GET (AAAA-MM o una fecha AAAA-MM-DD) como número anio * 12 + mes - 1"""
+    coincidencia = re.fullmatch(r'(\d{4})-(\d{2})(?:-\d{2})?', request.GET.get(nombre) or '')
+    if not coincidencia or not 1 <= int(coincidencia.group(2)) <= 12:
+        return None
+    return int(coincidencia.group(1)) * 12 + int(coincidencia.group(2)) - 1
+
 
+def _texto_mes(numero):
+    return f'{numero % 12 + 1:02d}/{numero // 12}'
+
+
+class RankingReporte(Reporte):
+    """Ranking sobre el resumen mensual de entregas.
+
+    Filtros: ``desde`` / ``hasta`` (meses, inclusive), ``rubro``, ``top`` y ``empates``.
+    El puesto se calcula en la base con RANK() (o DENSE_RANK()) y se quedan las filas
+    con puesto <= top, así los empates en el último lugar no se cortan. Con ``desde``
+    la fila trae también el valor del período anterior de igual largo, que sale de
+    una sola consulta agrupada más.
+    """
+    template_name = 'inventario/reporte_ranking.html'
+    # Campos por los que se agrupa; el primero identifica la fila
+    campos = ()
+    # Columna por la que se ordena el ranking ('cantidad' o 'valor')
+    metrica = 'cantidad'
+    top_por_defecto = 20
+    top_maximo = 500
+    EMPATES = {'competicion': Rank, 'denso': DenseRank}
+
+    def __init__(self, request):
+        super().__init__(request)
+        desde = _mes_parametro(request, 'desde')
+        hasta = _mes_parametro(request, 'hasta')
+        if desde is not None and hasta is None:
+            hoy = timezone.localdate()
+            hasta = hoy.year * 12 + hoy.month - 1
+        if desde is not None and hasta is not None and desde > hasta:
+            desde, hasta = hasta, desde
+        self.desde, self.hasta = desde, hasta
+        try:
+            self.top = min(max(int(request.GET.get('top') or self.top_por_defecto), 1), self.top_maximo)
+        except (TypeError, ValueError):
+            self.top = self.top_por_defecto
+        rubro = request.GET.get('rubro') or ''
+        self.rubro_id = int(rubro) if rubro.isdigit() else None
+        self.empates = request.GET.get('empates') if request.GET.get('empates') in self.EMPATES else 'competicion'
+        self._anteriores = None
+
+    @property
+    def con_anterior(self):
+        return self.desde is not None
+
+    def _resumen_periodo(self, desde, hasta):
+        """Filas del resumen entre dos meses (números de ``_mes_parametro``) y del rubro elegido"""
+        qs = ResumenEntregas.objects.all()
+        # Comparaciones sobre (anio, mes) tal cual para que sirva el índice de la tabla
+        if desde is not None:
+            anio, mes = divmod(desde, 12)
+            qs = qs.filter(Q(anio__gt=anio) | Q(anio=anio, mes__gte=mes + 1))
+        if hasta is not None:
+            anio, mes = divmod(hasta, 12)
+            qs = qs.filter(Q(anio__lt=anio) | Q(anio=anio, mes__lte=mes + 1))
+        if self.rubro_id:
+            qs = qs.filter(bien__rubro_id=self.rubro_id)
+        return qs
+
+    def get_queryset(self):
+        return (
+            self._resumen_periodo(self.desde, self.hasta)
+            .values(*self.campos)
+            .annotate(cantidad=Sum('cantidad'), valor=Sum('monto'))
+            .annotate(puesto=Window(self.EMPATES[self.empates](), order_by=F(self.metrica).desc()))
+            .filter(puesto__lte=self.top)
+            .order_by('puesto', *self.campos[1:])
+        )
+
+    def anteriores(self):
+        """{clave: métrica} del período anterior de igual cantidad de meses"""
+        if self._anteriores is None:
+            largo = self.hasta - self.desde + 1
+            clave = self.campos[0]
+            self._anteriores = dict(
+                self._resumen_periodo(self.desde - largo, self.desde - 1)
+                .order_by().values(clave).annotate(total=Sum(self.metrica)).values_list(clave, 'total')
+            )
+        return self._anteriores
+
+    def preparar_fila(self, fila):
+        if self.con_anterior:
+            anterior = self.anteriores().get(fila[self.campos[0]]) or 0
+            fila['anterior'] = anterior
+            fila['variacion'] = (fila[self.metrica] or 0) - anterior
+        return fila
+
+    @property
+    def columnas(self):
+        columnas = [Columna('puesto', 'Puesto', 'entero')] + self.columnas_ranking
+        if self.con_anterior:
+            formato = 'moneda' if self.metrica == 'valor' else 'entero'
+            columnas += [
+                Columna('anterior', f'Período anterior ({self.titulo_metrica})', formato),
+                Columna('variacion', 'Variación', formato),
+            ]
+        return columnas
+
+    def contexto_extra(self):
+        periodo = ''
+        if self.desde is not None or self.hasta is not None:
+            periodo = ' a '.join(_texto_mes(numero) for numero in (self.desde, self.hasta) if numero is not None)
+        return {
+            'rubros': Rubro.objects.order_by('nombre'),
+            'filtros': {
+                'desde': self.request.GET.get('desde', ''),
+                'hasta': self.request.GET.get('hasta', ''),
+                'rubro': self.rubro_id,
+                'top': self.top,
+                'empates': self.empates,
+            },
+            'periodo': periodo,
+        }
+
+
+class RankingBienesReporte(RankingReporte):
+    """Ranking de bienes más entregados"""
+    titulo = 'Ranking de bienes más entregados'
+    icono = 'fa-ranking-star'
+    nombre_archivo = 'ranking_bienes'
+    modelos = (ResumenEntregas, Bien)
+    campos = ('bien_id', 'bien__nombre')
+    metrica = 'cantidad'
+    titulo_metrica = 'cantidad'
+    columnas_ranking = [
+        Columna('bien__nombre', 'Bien'),
+        Columna('cantidad', 'Cantidad Entregada', 'entero'),
+        Columna('valor', 'Valor Total Entregado ($)', 'moneda'),
+    ]
+
+
+reporte_ranking_bienes = RankingBienesReporte.as_view()
+
+
+class RankingProveedoresReporte(RankingReporte):
+    """Ranking de proveedores por valor entregado"""
+    titulo = 'Ranking de proveedores'
+    icono = 'fa-truck-field'
+    nombre_archivo = 'ranking_proveedores'
+    modelos = (ResumenEntregas, OrdenDeCompra, Bien)
     # Agrupar por proveedor (campo de texto en OrdenDeCompra)
-    ranking = EntregaItem.objects.values('orden_de_compra__proveedor').annotate(
-        cantidad=Sum('cantidad'),
-        valor=Sum('precio_total')
-    ).order_by('-valor')
-
-    data = []
-    for row in ranking:
-        data.append({
-            'proveedor': row['orden_de_compra__proveedor'] or '(Sin proveedor)',
-            'cantidad': row['cantidad'],
-            'valor': float(row['valor'] or 0),
-        })
+    campos = ('orden_de_compra__proveedor',)
+    metrica = 'valor'
+    titulo_metrica = '$'
+    columnas_ranking = [
+        Columna('orden_de_compra__proveedor', 'Proveedor'),
+        Columna('cantidad', 'Cantidad de Bienes Entregados', 'entero'),
+        Columna('valor', 'Valor Total Entregado ($)', 'moneda'),
+    ]
 
-    if request.GET.get('export') == 'excel':
-        df = pd.DataFrame([{ 'Proveedor': d['proveedor'], 'Cantidad de Bienes Entregados': d['cantidad'], 'Valor Total Entregado ($)': d['valor'] } for d in data])
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename=ranking_proveedores.xlsx'
-        df.to_excel(response, index=False)
-        return response
+    def preparar_fila(self, fila):
+        fila = super().preparar_fila(fila)
+        fila['orden_de_compra__proveedor'] = fila['orden_de_compra__proveedor'] or '(Sin proveedor)'
+        return fila
 
-    if request.GET.get('export') == 'pdf':
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = 'attachment; filename=ranking_proveedores.pdf'
-        doc = SimpleDocTemplate(response, pagesize=letter)
-        elements = []
-        styles = getSampleStyleSheet()
-        elements.append(Paragraph('Ranking de proveedores', styles['Title']))
-        elements.append(Spacer(1, 12))
-        table_data = [["Proveedor", "Cantidad de Bienes Entregados", "Valor Total Entregado ($)"]]
-        for d in data:
-            table_data.append([d['proveedor'], d['cantidad'], f"{d['valor']:.2f}"])
-        t = Table(table_data, repeatRows=1)
-        t.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.grey),
-            ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-            ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-            ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-            ('BOTTOMPADDING', (0,0), (-1,0), 8),
-            ('BACKGROUND', (0,1), (-1,-1), colors.beige),
-            ('GRID', (0,0), (-1,-1), 1, colors.black),
-        ]))
-        elements.append(t)
-        doc.build(elements)
-        return response
-
-    return render(request, 'inventario/reporte_ranking_proveedores.html', {'data': data})
+
+reporte_ranking_proveedores = RankingProveedoresReporte.as_view()
 from django.http import JsonResponse, HttpResponse
 from django import forms
 from django.forms import inlineformset_factory
@@ -1013,13 +947,14 @@ def orden_editar(request, pk):
             print("Formset errors:", formset.errors, file=sys.stderr)
             print("Formset non_form_errors:", formset.non_form_errors(), file=sys.stderr)
         if form.is_valid() and formset.is_valid():
-            orden = form.save()
-            items = formset.save(commit=False)
-            for item in items:
-                item.orden_de_compra = orden
-                item.save()
-            # Procesar eliminados y relaciones many-to-many
-            formset.save()  # Esto elimina los objetos marcados para borrar
+            with transaction.atomic():
+                orden = form.save()
+                items = formset.save(commit=False)
+                for item in items:
+                    item.orden_de_compra = orden
+                    item.save()
+                # Procesar eliminados y relaciones many-to-many
+                formset.save()  # Esto elimina los objetos marcados para borrar
             messages.success(request, 'Orden de compra actualizada correctamente.')
             return redirect('orden_detalle', pk=orden.id)
     else:
@@ -1086,7 +1021,10 @@ from django.urls import reverse
 class RubroForm(forms.ModelForm):
     class Meta:
         model = Rubro
-        fields = ['nombre']
+        fields = ['nombre', 'stock_minimo']
+        widgets = {
+            'stock_minimo': forms.NumberInput(attrs={'class': 'form-control', 'min': 0}),
+        }
 
     def clean_nombre(self):
         nombre = self.cleaned_data['nombre'].strip().upper()
@@ -1108,7 +1046,7 @@ class BienForm(forms.ModelForm):
 
     class Meta:
         model = Bien
-        fields = ['rubro', 'nombre', 'catalogo', 'imagen']
+        fields = ['rubro', 'nombre', 'catalogo', 'stock_minimo', 'imagen']
         widgets = {
             'rubro': forms.Select(attrs={
                 'class': 'form-control select2-dropdown',
@@ -1124,6 +1062,11 @@ class BienForm(forms.ModelForm):
                 'autocomplete': 'off',
                 'placeholder': 'Catálogo (opcional)'
             }),
+            'stock_minimo': forms.NumberInput(attrs={
+                'class': 'form-control',
+                'min': 0,
+                'placeholder': 'Vacío: el del rubro'
+            }),
         }
 
     def clean_nombre(self):
@@ -1231,6 +1174,25 @@ class EntregaForm(forms.ModelForm):
 
 
 
+class BienesPrecargadosIterator(forms.models.ModelChoiceIterator):
+    """Opciones armadas desde una lista (id, nombre) ya resuelta, sin consultar la base.
+
+    Permite que todos los formularios de un formset compartan la misma lista de bienes.
+    """
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for bien_id, nombre in self.field.bienes_precargados:
+            yield self.choice(Bien(id=bien_id, nombre=nombre))
+
+    def __len__(self):
+        return len(self.field.bienes_precargados) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(self.field.bienes_precargados)
+
+
 class EntregaItemForm(forms.ModelForm):
     class Meta:
         model = EntregaItem
@@ -1238,6 +1200,8 @@ class EntregaItemForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         self.user = kwargs.pop('user', None)
+        # Lista (id, nombre) de bienes con stock; la vista la calcula una vez por request
+        bienes_stock = kwargs.pop('bienes_con_stock', None)
         super().__init__(*args, **kwargs)
         self.fields['precio_unitario'].required = False
         self.fields['precio_unitario'].widget = forms.HiddenInput()
@@ -1256,18 +1220,13 @@ class EntregaItemForm(forms.ModelForm):
                     pass
         
         # Filtrar bienes que tienen stock disponible (sin considerar uso en otras filas por ahora)
-        bienes_con_stock = []
-        for bien in Bien.objects.all():
-            # Calcular stock total del bien
-            comprado = OrdenDeCompraItem.objects.filter(bien=bien).aggregate(total=Sum('cantidad'))['total'] or 0
-            entregado = EntregaItem.objects.filter(bien=bien).aggregate(total=Sum('cantidad'))['total'] or 0
-            stock_disponible = comprado - entregado
-            
-            if stock_disponible > 0:
-                bienes_con_stock.append(bien.id)
-        
-        # Aplicar el filtro al queryset del campo bien
-        self.fields['bien'].queryset = Bien.objects.filter(id__in=bienes_con_stock)
+        if bienes_stock is None:
+            bienes_stock = bienes_con_stock()
+        campo_bien = self.fields['bien']
+        campo_bien.queryset = Bien.objects.filter(id__in=saldos_bien().filter(stock__gt=0).values('bien_id'))
+        campo_bien.bienes_precargados = bienes_stock
+        campo_bien.iterator = BienesPrecargadosIterator
+        campo_bien.widget.choices = campo_bien.choices
 
 class ServicioForm(forms.ModelForm):
     fecha_inicio = forms.DateField(
@@ -1361,109 +1320,60 @@ class ServicioRenovacionForm(forms.Form):
 
 @login_required
 def dashboard(request):
-    from django.db.models import Sum
-    from datetime import date, timedelta
-    from django.core.paginator import Paginator, EmptyPage
-    
-    # Órdenes de compra próximas a vencer y vencidas (fecha_fin dentro de los próximos 4 meses o ya vencidas)
-    hoy = date.today()
-    cuatro_meses = hoy + timedelta(days=120)
-    ordenes_vencer = []
-    from .models import OrdenDeCompra
-    
-    # Filtrar órdenes por rubro del usuario si no es superusuario o staff
-    user_rubro = get_user_rubro(request.user)
-    ordenes_qs = OrdenDeCompra.objects.exclude(fecha_fin=None)
-    if user_rubro:
-        ordenes_qs = ordenes_qs.filter(rubro=user_rubro)
-    
-    for oc in ordenes_qs:
-        if oc.fecha_fin <= cuatro_meses:
-            dias_restantes = (oc.fecha_fin - hoy).days
-            ordenes_vencer.append({
-                'oc': oc,
-                'fecha_inicio': oc.fecha_inicio,
-                'dias_restantes': dias_restantes
-            })
+    # Sólo la estructura: cada panel se carga después desde su fragmento (dashboard_*)
+    return render(request, 'inventario/dashboard.html')
 
-    # Ordenar órdenes de compra por días restantes (menor a mayor)
-    ordenes_vencer = sorted(ordenes_vencer, key=lambda x: x['dias_restantes'])
 
-    # Paginación para órdenes de compra
-    ordenes_paginator = Paginator(ordenes_vencer, 10)
-    ordenes_page = request.GET.get('ordenes_page')
-    try:
-        ordenes_page_int = int(ordenes_page) if ordenes_page else 1
-    except (TypeError, ValueError):
-        ordenes_page_int = 1
-    if ordenes_page_int < 1:
-        ordenes_page_int = 1
-    if ordenes_page_int > ordenes_paginator.num_pages and ordenes_paginator.num_pages > 0:
-        ordenes_page_int = ordenes_paginator.num_pages
-    try:
-        ordenes_page_obj = ordenes_paginator.page(ordenes_page_int)
-    except EmptyPage:
-        ordenes_page_obj = ordenes_paginator.page(1)
-
-    # Productos bajos de stock (stock <= 10)
-    bienes = Bien.objects.all()
-    bajos_stock = []
-    for bien in bienes:
-        comprado = OrdenDeCompraItem.objects.filter(bien=bien).aggregate(total=Sum('cantidad'))['total'] or 0
-        entregado = EntregaItem.objects.filter(bien=bien).aggregate(total=Sum('cantidad'))['total'] or 0
-        stock_actual = comprado - entregado
-        if stock_actual <= 10:
-            bajos_stock.append({'bien': bien, 'stock': stock_actual})
-
-    bajos_stock = sorted(bajos_stock, key=lambda x: x['stock'])
-
-    # Paginación para productos bajos en stock
-    stock_paginator = Paginator(bajos_stock, 10)
-    stock_page = request.GET.get('stock_page')
-    try:
-        stock_page_int = int(stock_page) if stock_page else 1
-    except (TypeError, ValueError):
-        stock_page_int = 1
-    if stock_page_int < 1:
-        stock_page_int = 1
-    if stock_page_int > stock_paginator.num_pages and stock_paginator.num_pages > 0:
-        stock_page_int = stock_paginator.num_pages
-    try:
-        stock_page_obj = stock_paginator.page(stock_page_int)
-    except EmptyPage:
-        stock_page_obj = stock_paginator.page(1)
-
-    # Servicios próximos a vencer (dentro de 30 días)
-    servicios_por_vencer = []
-    if request.user.has_perm('inventario.view_servicio'):
-        for servicio in Servicio.objects.filter(estado__in=['ACTIVO', 'POR_VENCER']):
-            dias = servicio.dias_para_vencimiento()
-            if dias is not None and dias <= 30:
-                servicios_por_vencer.append({
-                    'servicio': servicio,
-                    'dias_restantes': dias
-                })
+POR_PAGINA_DASHBOARD = 10
+
 
-    # Paginación para servicios próximos a vencer
-    servicios_paginator = Paginator(servicios_por_vencer, 10)
-    servicios_page = request.GET.get('servicios_page')
+def _pagina_dashboard(request, objetos, parametro):
+    """Página pedida en ``parametro`` (la primera o la última si está fuera de rango)"""
+    paginator = Paginator(objetos, POR_PAGINA_DASHBOARD)
     try:
-        servicios_page_int = int(servicios_page) if servicios_page else 1
+        numero = int(request.GET.get(parametro) or 1)
     except (TypeError, ValueError):
-        servicios_page_int = 1
-    if servicios_page_int < 1:
-        servicios_page_int = 1
-    if servicios_page_int > servicios_paginator.num_pages and servicios_paginator.num_pages > 0:
-        servicios_page_int = servicios_paginator.num_pages
+        numero = 1
+    numero = min(max(numero, 1), max(paginator.num_pages, 1))
     try:
-        servicios_page_obj = servicios_paginator.page(servicios_page_int)
+        return paginator.page(numero)
     except EmptyPage:
-        servicios_page_obj = servicios_paginator.page(1)
+        return paginator.page(1)
 
-    return render(request, 'inventario/dashboard.html', {
-        'ordenes_page_obj': ordenes_page_obj,
-        'stock_page_obj': stock_page_obj,
-        'servicios_page_obj': servicios_page_obj
+
+@login_required
+def dashboard_ordenes(request):
+    """Fragmento del dashboard: órdenes de compra próximas a vencer (próximos 4 meses) y vencidas"""
+    ordenes = OrdenDeCompra.objects.por_vencer(dias=120)
+    # Filtrar órdenes por rubro del usuario si no es superusuario o staff
+    user_rubro = get_user_rubro(request.user)
+    if user_rubro:
+        ordenes = ordenes.filter(rubro=user_rubro)
+    return render(request, 'inventario/dashboard_ordenes.html', {
+        'page_obj': _pagina_dashboard(request, ordenes, 'ordenes_page'),
+    })
+
+
+@login_required
+def dashboard_bajo_stock(request):
+    """Fragmento del dashboard: bienes con stock menor o igual a su umbral, paginados en la base"""
+    bienes = bienes_bajo_stock().select_related('rubro').only('nombre', 'stock_minimo', 'rubro__stock_minimo')
+    return render(request, 'inventario/dashboard_bajo_stock.html', {
+        'page_obj': _pagina_dashboard(request, bienes, 'stock_page'),
+    })
+
+
+@login_required
+@permission_required('inventario.view_servicio', raise_exception=True)
+def dashboard_servicios(request):
+    """Fragmento del dashboard: servicios que vencen dentro de 30 días"""
+    from datetime import date
+    # Por fecha_fin, no por la columna estado (que se actualiza una vez por día): los que
+    # están activos o por vencer, sin los que ya vencieron
+    hoy = date.today()
+    servicios = Servicio.objects.exclude(estado='SUSPENDIDO').filter(fecha_fin__gte=hoy).por_vencer(dias=30, hoy=hoy)
+    return render(request, 'inventario/dashboard_servicios.html', {
+        'page_obj': _pagina_dashboard(request, servicios, 'servicios_page'),
     })
 
 @login_required
@@ -1535,12 +1445,13 @@ def agregar_orden(request):
         form = OrdenDeCompraForm(request.POST, user=request.user)
         formset = OrdenItemFormSet(request.POST)
         if form.is_valid() and formset.is_valid():
-            orden = form.save()
-            items = formset.save(commit=False)
-            for item in items:
-                item.orden_de_compra = orden
-                item.save()
-            formset.save_m2m()
+            with transaction.atomic():
+                orden = form.save()
+                items = formset.save(commit=False)
+                for item in items:
+                    item.orden_de_compra = orden
+                    item.save()
+                formset.save_m2m()
             messages.success(request, 'Orden de compra agregada correctamente.')
             return redirect('dashboard')
     else:
@@ -1553,7 +1464,99 @@ def agregar_orden(request):
         'agregar_bien_url': 'agregar_bien',
     })
 
-@login_required
+
+def _validar_stock_entrega(formset, entrega=None, mensaje_sin_orden=None):
+    """Valida en memoria el stock de todos los ítems del remito.
+
+    Los saldos de los pares (orden de compra, bien) se leen y bloquean con una sola
+    consulta, así que debe llamarse dentro de ``transaction.atomic()``. Varias filas
+    sobre el mismo par se descuentan del mismo disponible. Al editar, lo que ya
+    entregaban los ítems del remito vuelve a estar disponible.
+    Devuelve (hay_errores, saldos, existentes).
+    """
+    if mensaje_sin_orden is None:
+        mensaje_sin_orden = '{bien} no tiene Stock o no se seleccionó una orden de compra.'
+    existentes = entrega.items.in_bulk() if entrega is not None and entrega.pk else {}
+
+    filas = []
+    hay_errores = False
+    for item_form in formset.forms:
+        if not item_form.cleaned_data or item_form.cleaned_data.get('DELETE', False):
+            continue
+        orden_de_compra = item_form.cleaned_data.get('orden_de_compra')
+        bien = item_form.cleaned_data.get('bien')
+        cantidad = item_form.cleaned_data.get('cantidad') or 0
+        if not bien or cantidad <= 0:
+            continue
+        if not orden_de_compra:
+            item_form.add_error('orden_de_compra', mensaje_sin_orden.format(bien=bien.nombre))
+            hay_errores = True
+            continue
+        filas.append((item_form, (orden_de_compra.pk, bien.pk), bien, cantidad))
+
+    saldos = saldos_para_entrega({par for _, par, _, _ in filas})
+
+    # Stock que ya ocupan los ítems del remito que se está editando
+    disponible = {
+        par: saldo['comprado'] - saldo['entregado']
+        for par, saldo in saldos.items()
+    }
+    for item in existentes.values():
+        par = (item.orden_de_compra_id, item.bien_id)
+        if par in disponible:
+            disponible[par] += item.cantidad
+
+    for item_form, par, bien, cantidad in filas:
+        if par not in saldos:
+            item_form.add_error('orden_de_compra', f'No se encontró la orden de compra para {bien.nombre}')
+            hay_errores = True
+            continue
+        if cantidad > disponible[par]:
+            item_form.add_error('cantidad',
+                f'La cantidad ({cantidad}) excede el stock disponible ({max(disponible[par], 0)}) para {bien.nombre}')
+            hay_errores = True
+        disponible[par] -= cantidad
+
+    return hay_errores, saldos, existentes
+
+
+def _guardar_items_entrega(entrega, formset, saldos, existentes):
+    """Guarda los ítems del formset con bulk_create / bulk_update.
+
+    El precio unitario sale de los saldos ya leídos en la validación. El saldo de
+    stock y la auditoría se actualizan en bloque con registrar_entrega_items_bulk.
+    """
+    items = formset.save(commit=False)
+    cambiados = {obj.pk for obj, _ in formset.changed_objects}
+
+    creados, actualizados = [], []
+    for item in items:
+        item.entrega = entrega
+        if item.orden_de_compra_id:
+            saldo = saldos.get((item.orden_de_compra_id, item.bien_id))
+            item.precio_unitario = saldo['precio_unitario'] if saldo and saldo['precio_unitario'] is not None else 0
+        elif item.precio_unitario is None:
+            item.precio_unitario = 0
+        item.precio_total = item.cantidad * item.precio_unitario
+        if item.pk in cambiados:
+            actualizados.append((existentes[item.pk], item))
+        else:
+            creados.append(item)
+
+    if formset.deleted_objects:
+        # Las bajas pasan por las señales (saldo y auditoría) como cualquier delete
+        for obj in formset.deleted_objects:
+            obj.delete()
+
+    EntregaItem.objects.bulk_create(creados)
+    if actualizados:
+        EntregaItem.objects.bulk_update(
+            [actual for _, actual in actualizados],
+            ['orden_de_compra', 'bien', 'cantidad', 'precio_unitario', 'precio_total'],
+        )
+    registrar_entrega_items_bulk(creados, actualizados)
+    formset.save_m2m()
+
 
 @login_required
 def crear_entrega(request):
@@ -1570,83 +1573,25 @@ def crear_entrega(request):
                 print(f"Prefijo detectado: '{prefix}'")
                 break
         form = EntregaForm(request.POST, user=request.user)
-        formset = EntregaItemFormSet(request.POST or None, form_kwargs={'user': request.user})
+        formset = EntregaItemFormSet(request.POST or None, form_kwargs={'user': request.user, 'bienes_con_stock': bienes_con_stock()})
         print("Form válido:", form.is_valid())
         print("Formset válido:", formset.is_valid())
         if not formset.is_valid():
             print("Errores del formset:", formset.errors)
             print("Errores no form del formset:", formset.non_form_errors())
         
-        # Validaciones personalizadas adicionales
+        # Validación de stock y guardado en la misma transacción: los saldos quedan
+        # bloqueados hasta confirmar el remito
         validation_errors = False
         if form.is_valid() and formset.is_valid():
-            # Validar que todos los ítems tengan orden de compra y stock antes de guardar
-            for item_form in formset.forms:
-                if item_form.cleaned_data and not item_form.cleaned_data.get('DELETE', False):
-                    orden_de_compra = item_form.cleaned_data.get('orden_de_compra')
-                    bien = item_form.cleaned_data.get('bien')
-                    cantidad = item_form.cleaned_data.get('cantidad', 0)
-                    
-                    # Validar que todos los ítems tengan orden de compra
-                    if bien and cantidad > 0:
-                        if not orden_de_compra:
-                            item_form.add_error('orden_de_compra', 
-                                f'{bien.nombre} no tiene Stock o no se seleccionó una orden de compra.')
-                                
-                            validation_errors = True
-                            print(f"Error de validación: Falta orden de compra para {bien.nombre}")
-                        else:
-                            # Si hay orden de compra, validar stock
-                            # Obtener stock disponible
-                            try:
-                                oc_item = OrdenDeCompraItem.objects.get(orden_de_compra=orden_de_compra, bien=bien)
-                                # Calcular stock disponible (comprado - ya entregado)
-                                ya_entregado = EntregaItem.objects.filter(
-                                    orden_de_compra=orden_de_compra, 
-                                    bien=bien
-                                ).aggregate(total=Sum('cantidad'))['total'] or 0
-                                
-                                stock_disponible = oc_item.cantidad - ya_entregado
-                                
-                                if cantidad > stock_disponible:
-                                    # Agregar error al formulario
-                                    item_form.add_error('cantidad', 
-                                        f'La cantidad ({cantidad}) excede el stock disponible ({stock_disponible}) para {bien.nombre}')
-                                    validation_errors = True
-                                    print(f"Error de validación: Cantidad excede stock para {bien.nombre}")
-                            except OrdenDeCompraItem.DoesNotExist:
-                                item_form.add_error('orden_de_compra', 
-                                    f'No se encontró la orden de compra para {bien.nombre}')
-                                validation_errors = True
-                                print(f"Error de validación: Orden de compra no encontrada para {bien.nombre}")
-            
+            with transaction.atomic():
+                validation_errors, saldos, existentes = _validar_stock_entrega(formset)
+                if not validation_errors:
+                    entrega = form.save()
+                    _guardar_items_entrega(entrega, formset, saldos, existentes)
             print("Errores de validación encontrados:", validation_errors)
-        
+
         if form.is_valid() and formset.is_valid() and not validation_errors:
-            entrega = form.save()
-            items = formset.save(commit=False)
-            print("Items a guardar:", len(items))
-            for i, item in enumerate(items):
-                print(f"Item {i}: bien={item.bien}, cantidad={item.cantidad}, orden={item.orden_de_compra}")
-                item.entrega = entrega
-                # Obtener el precio_unitario de la orden de compra seleccionada para cada item
-                if item.orden_de_compra:
-                    try:
-                        oc_item = OrdenDeCompraItem.objects.get(orden_de_compra=item.orden_de_compra, bien=item.bien)
-                        item.precio_unitario = oc_item.precio_unitario
-                        print(f"Precio encontrado para item {i}: {item.precio_unitario}")
-                    except OrdenDeCompraItem.DoesNotExist:
-                        item.precio_unitario = 0
-                        print(f"Precio no encontrado para item {i}, usando 0")
-                else:
-                    # Si no hay orden de compra, usar precio 0 o el precio que ya viene del formulario
-                    if item.precio_unitario is None:
-                        item.precio_unitario = 0
-                    print(f"Sin orden de compra para item {i}, usando precio {item.precio_unitario}")
-                item.precio_total = item.cantidad * item.precio_unitario
-                item.save()
-                print(f"Item {i} guardado con precio_total: {item.precio_total}")
-            formset.save_m2m()
             print("Items guardados exitosamente")
             messages.success(request, 'Entrega registrada y stock actualizado.')
             # AJAX support: if request is AJAX, return JSON with URLs
@@ -1673,7 +1618,7 @@ def crear_entrega(request):
                 return JsonResponse({'success': False, 'errors': errors})
     else:
         form = EntregaForm(user=request.user)
-        formset = EntregaItemFormSet(form_kwargs={'user': request.user})
+        formset = EntregaItemFormSet(form_kwargs={'user': request.user, 'bienes_con_stock': bienes_con_stock()})
     return render(request, 'inventario/entrega_form.html', {'form': form, 'formset': formset})
 
 @login_required
@@ -1688,7 +1633,7 @@ def editar_entrega(request, pk):
         print("POST data:", dict(request.POST))
         
         form = EntregaForm(request.POST, instance=entrega, user=request.user)
-        formset = EntregaItemFormSet(request.POST, instance=entrega, form_kwargs={'user': request.user})
+        formset = EntregaItemFormSet(request.POST, instance=entrega, form_kwargs={'user': request.user, 'bienes_con_stock': bienes_con_stock()})
         
         print("Form válido:", form.is_valid())
         print("Formset válido:", formset.is_valid())
@@ -1697,85 +1642,21 @@ def editar_entrega(request, pk):
             print("Errores del formset:", formset.errors)
             print("Errores no form del formset:", formset.non_form_errors())
         
-        # Validaciones personalizadas adicionales para edición
+        # Validación de stock y guardado en la misma transacción: los saldos quedan
+        # bloqueados hasta confirmar el remito
         validation_errors = False
         if form.is_valid() and formset.is_valid():
-            # Validar que todos los ítems tengan orden de compra y stock antes de guardar (para ediciones)
-            for item_form in formset.forms:
-                if item_form.cleaned_data and not item_form.cleaned_data.get('DELETE', False):
-                    orden_de_compra = item_form.cleaned_data.get('orden_de_compra')
-                    bien = item_form.cleaned_data.get('bien')
-                    cantidad = item_form.cleaned_data.get('cantidad', 0)
-                    
-                    # Validar que todos los ítems tengan orden de compra
-                    if bien and cantidad > 0:
-                        if not orden_de_compra:
-                            item_form.add_error('orden_de_compra', 
-                                f'Debe seleccionar una orden de compra para {bien.nombre} o {bien.nombre} no tiene Stock')
-                            validation_errors = True
-                            print(f"Error de validación (editar): Falta orden de compra para {bien.nombre}")
-                        else:
-                            # Si hay orden de compra, validar stock
-                            # Obtener stock disponible
-                            try:
-                                oc_item = OrdenDeCompraItem.objects.get(orden_de_compra=orden_de_compra, bien=bien)
-                                # Calcular stock disponible (comprado - ya entregado, excluyendo este item si existe)
-                                ya_entregado = EntregaItem.objects.filter(
-                                    orden_de_compra=orden_de_compra, 
-                                    bien=bien
-                                ).exclude(
-                                    pk=item_form.instance.pk if item_form.instance.pk else None
-                                ).aggregate(total=Sum('cantidad'))['total'] or 0
-                                
-                                stock_disponible = oc_item.cantidad - ya_entregado
-                                
-                                if cantidad > stock_disponible:
-                                    # Agregar error al formulario
-                                    item_form.add_error('cantidad', 
-                                        f'La cantidad ({cantidad}) excede el stock disponible ({stock_disponible}) para {bien.nombre}')
-                                    validation_errors = True
-                                    print(f"Error de validación (editar): Cantidad excede stock para {bien.nombre}")
-                            except OrdenDeCompraItem.DoesNotExist:
-                                item_form.add_error('orden_de_compra', 
-                                    f'No se encontró la orden de compra para {bien.nombre}')
-                                validation_errors = True
-                                print(f"Error de validación (editar): Orden de compra no encontrada para {bien.nombre}")
-            
+            with transaction.atomic():
+                validation_errors, saldos, existentes = _validar_stock_entrega(
+                    formset, entrega,
+                    mensaje_sin_orden='Debe seleccionar una orden de compra para {bien} o {bien} no tiene Stock',
+                )
+                if not validation_errors:
+                    entrega = form.save()
+                    _guardar_items_entrega(entrega, formset, saldos, existentes)
             print("Errores de validación encontrados (editar):", validation_errors)
-        
+
         if form.is_valid() and formset.is_valid() and not validation_errors:
-                entrega = form.save()
-                items = formset.save(commit=False)
-                
-                # Eliminar items marcados para borrar
-                for obj in formset.deleted_objects:
-                    obj.delete()
-                
-                print("Items a guardar/actualizar:", len(items))
-                for i, item in enumerate(items):
-                    print(f"Item {i}: bien={item.bien}, cantidad={item.cantidad}, orden={item.orden_de_compra}")
-                    item.entrega = entrega
-                    
-                    # Obtener el precio_unitario de la orden de compra seleccionada para cada item
-                    if item.orden_de_compra:
-                        try:
-                            oc_item = OrdenDeCompraItem.objects.get(orden_de_compra=item.orden_de_compra, bien=item.bien)
-                            item.precio_unitario = oc_item.precio_unitario
-                            print(f"Precio encontrado para item {i}: {item.precio_unitario}")
-                        except OrdenDeCompraItem.DoesNotExist:
-                            item.precio_unitario = 0
-                            print(f"Precio no encontrado para item {i}, usando 0")
-                    else:
-                        # Si no hay orden de compra, usar precio 0 o el precio que ya viene del formulario
-                        if item.precio_unitario is None:
-                            item.precio_unitario = 0
-                        print(f"Sin orden de compra para item {i}, usando precio {item.precio_unitario}")
-                    
-                    item.precio_total = item.cantidad * item.precio_unitario
-                    item.save()
-                    print(f"Item {i} guardado con precio_total: {item.precio_total}")
-                
-                formset.save_m2m()
                 print("Items actualizados exitosamente")
                 messages.success(request, 'Remito actualizado correctamente.')
                 
@@ -1803,7 +1684,7 @@ def editar_entrega(request, pk):
                 return JsonResponse({'success': False, 'errors': errors})
     else:
         form = EntregaForm(instance=entrega, user=request.user)
-        formset = EntregaItemFormSet(instance=entrega, form_kwargs={'user': request.user})
+        formset = EntregaItemFormSet(instance=entrega, form_kwargs={'user': request.user, 'bienes_con_stock': bienes_con_stock()})
     
     return render(request, 'inventario/entrega_form.html', {
         'form': form, 
@@ -1814,12 +1695,57 @@ def editar_entrega(request, pk):
 
 @login_required
 def remito_pdf(request, pk):
-    entrega = get_object_or_404(Entrega, pk=pk)
-    template = get_template('inventario/remito_pdf.html')
-    html = template.render({'entrega': entrega})
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="remito_{entrega.id}.pdf"'
-    pisa.CreatePDF(html, dest=response)
+    """Remito en PDF servido desde la caché en disco (ver ``remitos_pdf``)"""
+    entrega = get_object_or_404(
+        Entrega.objects.prefetch_related('items__bien', 'items__orden_de_compra'), pk=pk,
+    )
+    valor_huella = remitos_pdf.huella(entrega)
+    etag = quote_etag(valor_huella)
+    no_modificado = get_conditional_response(request, etag=etag)
+    if no_modificado is not None:
+        return no_modificado
+    ruta = remitos_pdf.obtener(entrega, valor_huella)
+    response = FileResponse(
+        open(ruta, 'rb'), as_attachment=True, filename=f'remito_{entrega.id}.pdf', content_type='application/pdf',
+    )
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+def _ids_parametro(request):
+    """Ids de entrega de ``?ids=1,2&ids=3``; los valores inválidos se ignoran"""
+    ids = []
+    for valor in request.GET.getlist('ids'):
+        ids.extend(int(parte) for parte in valor.split(',') if parte.strip().isdigit())
+    return ids
+
+@login_required
+def remitos_lote(request):
+    """Varios remitos en una descarga: un ZIP con un PDF por remito o un único PDF.
+
+    Se eligen por rango de fechas (``desde`` / ``hasta``) y / o por ``ids``. El ZIP se
+    envía a medida que se generan los remitos; el PDF unido, al terminar.
+    """
+    desde = _fecha_parametro(request, 'desde')
+    hasta = _fecha_parametro(request, 'hasta')
+    ids = _ids_parametro(request)
+    formato = request.GET.get('formato', 'zip')
+    if formato not in remitos_pdf.FORMATOS_LOTE or not (desde or hasta or ids):
+        messages.error(request, 'Indicá un rango de fechas o los remitos a descargar.')
+        return redirect('remitos_list')
+    entregas = remitos_pdf.entregas_lote(desde=desde, hasta=hasta, ids=ids)
+    if not entregas.exists():
+        messages.warning(request, 'No hay remitos para los filtros indicados.')
+        return redirect('remitos_list')
+    nombre_archivo = remitos_pdf.nombre_lote(formato, desde, hasta)
+    if formato == 'pdf':
+        import tempfile
+        archivo = tempfile.TemporaryFile()
+        remitos_pdf.unir_pdf(entregas, archivo)
+        archivo.seek(0)
+        return FileResponse(archivo, as_attachment=True, filename=nombre_archivo, content_type='application/pdf')
+    response = StreamingHttpResponse(remitos_pdf.iterar_zip(entregas), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="{nombre_archivo}"'
     return response
 
 @login_required
@@ -1930,7 +1856,8 @@ def servicios_list(request):
         )
     
     if estado:
-        servicios = servicios.filter(estado=estado)
+        # Por el estado según la fecha de fin, no por la columna (que se actualiza una vez por día)
+        servicios = servicios.con_estado_vigente().filter(estado_vigente=estado)
     
     if frecuencia:
         servicios = servicios.filter(frecuencia=frecuencia)
@@ -2170,523 +2097,207 @@ def renovar_servicio(request, pk):
 
 # ===== REPORTES DE SERVICIOS =====
 
-@login_required
-def reporte_servicios_estado(request):
-    """Reporte de servicios agrupados por estado"""
-    from .models import Servicio
-    from django.db.models import Count, Sum
-    import pandas as pd
-    from django.http import HttpResponse
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib import colors
-    from reportlab.lib.styles import getSampleStyleSheet
-
-    # Agrupar servicios por estado
-    servicios_por_estado = Servicio.objects.values('estado').annotate(
-        cantidad=Count('id'),
-        costo_total=Sum('costo_mensual')
-    ).order_by('estado')
-
-    data = []
-    excel_rows = []
-    total_cantidad = 0
-    total_costo = 0
-    
-    for row in servicios_por_estado:
-        estado_display = dict(Servicio.ESTADO_CHOICES).get(row['estado'], row['estado'])
-        costo_total = float(row['costo_total'] or 0)
-        data.append({
-            'estado': row['estado'],
-            'estado_display': estado_display,
-            'cantidad': row['cantidad'],
-            'costo_total': costo_total,
-        })
-        total_cantidad += row['cantidad']
-        total_costo += costo_total
-        
-        excel_rows.append({
-            'Estado': estado_display,
-            'Cantidad de Servicios': row['cantidad'],
-            'Costo Total Mensual ($)': costo_total,
-        })
+class ServiciosEstadoReporte(Reporte):
+    """Servicios agrupados por estado vigente (calculado en la consulta a partir de fecha_fin).
 
-    if request.GET.get('export') == 'excel':
-        # Obtener detalle de servicios para exportación
-        servicios_detalle = Servicio.objects.select_related('rubro').order_by('estado', 'nombre')
-        excel_rows = []
-        for servicio in servicios_detalle:
-            excel_rows.append({
-                'Estado': dict(Servicio.ESTADO_CHOICES).get(servicio.estado, servicio.estado),
-                'Nombre': servicio.nombre,
-                'Proveedor': servicio.proveedor,
-                'Frecuencia': dict(Servicio.FRECUENCIA_CHOICES).get(servicio.frecuencia, servicio.frecuencia),
-                'Costo Mensual ($)': float(servicio.costo_mensual),
-                'Fecha Inicio': servicio.fecha_inicio.strftime('%d/%m/%Y') if servicio.fecha_inicio else '',
-                'Fecha Fin': servicio.fecha_fin.strftime('%d/%m/%Y') if servicio.fecha_fin else '',
-                'Rubro': servicio.rubro.nombre if servicio.rubro else '',
-                'Expediente Contratación': servicio.expediente_contratacion,
-                'Observaciones': servicio.observaciones,
-            })
-        df = pd.DataFrame(excel_rows)
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename=servicios_detalle.xlsx'
-        df.to_excel(response, index=False)
-        return response
+    No se guarda en la caché: el estado cambia con la fecha aunque no cambien los datos.
+    """
+    titulo = 'Servicios por Estado'
+    icono = 'fa-chart-pie'
+    nombre_archivo = 'servicios_por_estado'
+    columnas = [
+        Columna('nombre', 'Nombre'),
+        Columna('proveedor', 'Proveedor'),
+        Columna('frecuencia', 'Frecuencia'),
+        Columna('costo_mensual', 'Costo Mensual ($)', 'moneda'),
+        Columna('fecha_inicio', 'Fecha Inicio', 'fecha'),
+        Columna('fecha_fin', 'Fecha Fin', 'fecha'),
+        Columna('rubro__nombre', 'Rubro'),
+        Columna('expediente_contratacion', 'Expediente Contratación'),
+    ]
+    agrupar_por = 'estado'
+    titulo_grupo = 'Estado'
+    totalizar = ('costo_mensual',)
+    titulo_resumen = 'Totales por estado'
+    columnas_resumen = [
+        Columna('estado', 'Estado'),
+        Columna('cantidad', 'Cantidad de Servicios', 'entero'),
+        Columna('costo_total', 'Costo Total Mensual ($)', 'moneda'),
+    ]
+    pdf_horizontal = True
+    pdf_tamanio_fuente = 7
 
-    if request.GET.get('export') == 'pdf':
-        # Obtener detalle de servicios para exportación
-        servicios_detalle = Servicio.objects.select_related('rubro').order_by('estado', 'nombre')
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = 'attachment; filename=servicios_detalle.pdf'
-        from reportlab.lib.pagesizes import landscape, letter
-        doc = SimpleDocTemplate(response, pagesize=landscape(letter))
-        elements = []
-        styles = getSampleStyleSheet()
-        elements.append(Paragraph('Detalle de Servicios por Estado', styles['Title']))
-        elements.append(Spacer(1, 12))
-        
-        table_data = [["Estado", "Nombre", "Proveedor", "Frecuencia", "Costo Mensual ($)", "Fecha Inicio", "Fecha Fin", "Rubro"]]
-        for servicio in servicios_detalle:
-            table_data.append([
-                dict(Servicio.ESTADO_CHOICES).get(servicio.estado, servicio.estado),
-                servicio.nombre[:20] + '...' if len(servicio.nombre) > 20 else servicio.nombre,
-                servicio.proveedor[:15] + '...' if len(servicio.proveedor) > 15 else servicio.proveedor,
-                dict(Servicio.FRECUENCIA_CHOICES).get(servicio.frecuencia, servicio.frecuencia),
-                f"{float(servicio.costo_mensual):.2f}",
-                servicio.fecha_inicio.strftime('%d/%m/%y') if servicio.fecha_inicio else '',
-                servicio.fecha_fin.strftime('%d/%m/%y') if servicio.fecha_fin else '',
-                servicio.rubro.nombre if servicio.rubro else '',
-            ])
-        t = Table(table_data, repeatRows=1)
-        t.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.grey),
-            ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-            ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-            ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-            ('BOTTOMPADDING', (0,0), (-1,0), 8),
-            ('BACKGROUND', (0,1), (-1,-1), colors.beige),
-            ('GRID', (0,0), (-1,-1), 1, colors.black),
-            ('FONTSIZE', (0,0), (-1,-1), 5.5),
-        ]))
-        elements.append(t)
-        doc.build(elements)
-        return response
-
-    return render(request, 'inventario/reporte_servicios_estado.html', {
-        'data': data,
-        'total_cantidad': total_cantidad,
-        'total_costo': total_costo
-    })
+    def get_queryset(self):
+        return Servicio.objects.con_estado_vigente().values(
+            'estado_vigente', 'nombre', 'proveedor', 'frecuencia', 'costo_mensual',
+            'fecha_inicio', 'fecha_fin', 'rubro__nombre', 'expediente_contratacion',
+        ).order_by('estado_vigente', 'nombre')
 
-@login_required
-def reporte_servicios_proveedor(request):
+    def preparar_fila(self, fila):
+        fila['estado'] = dict(Servicio.ESTADO_CHOICES).get(fila['estado_vigente'], fila['estado_vigente'])
+        fila['frecuencia'] = dict(Servicio.FRECUENCIA_CHOICES).get(fila['frecuencia'], fila['frecuencia'])
+        return fila
+
+    def resumen(self):
+        for fila in Servicio.objects.con_estado_vigente().values('estado_vigente').annotate(
+            cantidad=Count('id'),
+            costo_total=Sum('costo_mensual'),
+        ).order_by('estado_vigente'):
+            fila['estado'] = dict(Servicio.ESTADO_CHOICES).get(fila['estado_vigente'], fila['estado_vigente'])
+            yield fila
+
+
+reporte_servicios_estado = ServiciosEstadoReporte.as_view()
+
+
+class ServiciosProveedorReporte(Reporte):
     """Reporte de servicios agrupados por proveedor"""
-    from .models import Servicio
-    from django.db.models import Count, Sum
-    import pandas as pd
-    from django.http import HttpResponse
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib import colors
-    from reportlab.lib.styles import getSampleStyleSheet
-
-    # Agrupar servicios por proveedor
-    servicios_por_proveedor = Servicio.objects.values('proveedor').annotate(
-        cantidad=Count('id'),
-        costo_total=Sum('costo_mensual')
-    ).order_by('proveedor')
-
-    data = []
-    excel_rows = []
-    total_cantidad = 0
-    total_costo = 0
-    
-    for row in servicios_por_proveedor:
-        costo_total = float(row['costo_total'] or 0)
-        data.append({
-            'proveedor': row['proveedor'],
-            'cantidad': row['cantidad'],
-            'costo_total': costo_total,
-        })
-        total_cantidad += row['cantidad']
-        total_costo += costo_total
-        
-        excel_rows.append({
-            'Proveedor': row['proveedor'],
-            'Cantidad de Servicios': row['cantidad'],
-            'Costo Total Mensual ($)': costo_total,
-        })
+    titulo = 'Servicios por Proveedor'
+    icono = 'fa-truck'
+    nombre_archivo = 'servicios_por_proveedor'
+    modelos = (Servicio,)
+    columnas = [
+        Columna('proveedor', 'Proveedor'),
+        Columna('cantidad', 'Cantidad de Servicios', 'entero'),
+        Columna('costo_total', 'Costo Total Mensual ($)', 'moneda'),
+    ]
+    totalizar = ('cantidad', 'costo_total')
 
-    if request.GET.get('export') == 'excel':
-        df = pd.DataFrame(excel_rows)
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename=servicios_por_proveedor.xlsx'
-        df.to_excel(response, index=False)
-        return response
+    def get_queryset(self):
+        return Servicio.objects.values('proveedor').annotate(
+            cantidad=Count('id'),
+            costo_total=Sum('costo_mensual')
+        ).order_by('proveedor')
 
-    if request.GET.get('export') == 'pdf':
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = 'attachment; filename=servicios_por_proveedor.pdf'
-        doc = SimpleDocTemplate(response, pagesize=letter)
-        elements = []
-        styles = getSampleStyleSheet()
-        elements.append(Paragraph('Servicios por Proveedor', styles['Title']))
-        elements.append(Spacer(1, 12))
-        table_data = [["Proveedor", "Cantidad de Servicios", "Costo Total Mensual ($)"]]
-        for row in excel_rows:
-            table_data.append([row['Proveedor'], row['Cantidad de Servicios'], f"{row['Costo Total Mensual ($)']:.2f}"])
-        t = Table(table_data, repeatRows=1)
-        t.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.grey),
-            ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-            ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-            ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-            ('BOTTOMPADDING', (0,0), (-1,0), 8),
-            ('BACKGROUND', (0,1), (-1,-1), colors.beige),
-            ('GRID', (0,0), (-1,-1), 1, colors.black),
-        ]))
-        elements.append(t)
-        doc.build(elements)
-        return response
-
-    return render(request, 'inventario/reporte_servicios_proveedor.html', {
-        'data': data,
-        'total_cantidad': total_cantidad,
-        'total_costo': total_costo
-    })
 
-@login_required
-def reporte_servicios_rubro(request):
+reporte_servicios_proveedor = ServiciosProveedorReporte.as_view()
+
+class ServiciosRubroReporte(Reporte):
     """Reporte de servicios agrupados por rubro"""
-    from .models import Servicio
-    from django.db.models import Count, Sum
-    import pandas as pd
-    from django.http import HttpResponse
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib import colors
-    from reportlab.lib.styles import getSampleStyleSheet
-
-    # Agrupar servicios por rubro
-    servicios_por_rubro = Servicio.objects.select_related('rubro').values('rubro__nombre').annotate(
-        cantidad=Count('id'),
-        costo_total=Sum('costo_mensual')
-    ).order_by('rubro__nombre')
-
-    data = []
-    excel_rows = []
-    total_cantidad = 0
-    total_costo = 0
-    
-    for row in servicios_por_rubro:
-        rubro_nombre = row['rubro__nombre'] or 'Sin Rubro'
-        costo_total = float(row['costo_total'] or 0)
-        data.append({
-            'rubro': rubro_nombre,
-            'cantidad': row['cantidad'],
-            'costo_total': costo_total,
-        })
-        total_cantidad += row['cantidad']
-        total_costo += costo_total
-        
-        excel_rows.append({
-            'Rubro': rubro_nombre,
-            'Cantidad de Servicios': row['cantidad'],
-            'Costo Total Mensual ($)': costo_total,
-        })
+    titulo = 'Servicios por Rubro'
+    icono = 'fa-tags'
+    nombre_archivo = 'servicios_por_rubro'
+    modelos = (Servicio, Rubro)
+    columnas = [
+        Columna('rubro__nombre', 'Rubro'),
+        Columna('cantidad', 'Cantidad de Servicios', 'entero'),
+        Columna('costo_total', 'Costo Total Mensual ($)', 'moneda'),
+    ]
+    totalizar = ('cantidad', 'costo_total')
 
-    if request.GET.get('export') == 'excel':
-        df = pd.DataFrame(excel_rows)
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename=servicios_por_rubro.xlsx'
-        df.to_excel(response, index=False)
-        return response
+    def get_queryset(self):
+        return Servicio.objects.values('rubro__nombre').annotate(
+            cantidad=Count('id'),
+            costo_total=Sum('costo_mensual')
+        ).order_by('rubro__nombre')
 
-    if request.GET.get('export') == 'pdf':
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = 'attachment; filename=servicios_por_rubro.pdf'
-        doc = SimpleDocTemplate(response, pagesize=letter)
-        elements = []
-        styles = getSampleStyleSheet()
-        elements.append(Paragraph('Servicios por Rubro', styles['Title']))
-        elements.append(Spacer(1, 12))
-        table_data = [["Rubro", "Cantidad de Servicios", "Costo Total Mensual ($)"]]
-        for row in excel_rows:
-            table_data.append([row['Rubro'], row['Cantidad de Servicios'], f"{row['Costo Total Mensual ($)']:.2f}"])
-        t = Table(table_data, repeatRows=1)
-        t.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.grey),
-            ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-            ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-            ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-            ('BOTTOMPADDING', (0,0), (-1,0), 8),
-            ('BACKGROUND', (0,1), (-1,-1), colors.beige),
-            ('GRID', (0,0), (-1,-1), 1, colors.black),
-        ]))
-        elements.append(t)
-        doc.build(elements)
-        return response
-
-    return render(request, 'inventario/reporte_servicios_rubro.html', {
-        'data': data,
-        'total_cantidad': total_cantidad,
-        'total_costo': total_costo
-    })
+    def preparar_fila(self, fila):
+        fila['rubro__nombre'] = fila['rubro__nombre'] or 'Sin Rubro'
+        return fila
 
-@login_required
-def reporte_costos_servicios(request):
-    """Reporte de costos totales de servicios"""
-    from .models import Servicio
-    from django.db.models import Sum
-    import pandas as pd
-    from django.http import HttpResponse
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib import colors
-    from reportlab.lib.styles import getSampleStyleSheet
-
-    # Obtener todos los servicios con sus costos calculados
-    servicios = Servicio.objects.select_related('rubro').all()
-    data = []
-    excel_rows = []
-
-    costo_mensual_total = 0
-    costo_anual_total = 0
-
-    for servicio in servicios:
-        costo_total = servicio.calcular_costo_total()
-        costo_mensual = float(servicio.costo_mensual)
-        costo_anual = costo_mensual * 12
-
-        data.append({
-            'servicio': servicio,
-            'costo_mensual': costo_mensual,
-            'costo_anual': costo_anual,
-            'costo_total': costo_total,
-            'estado': servicio.estado_actual,
-            'dias_vencimiento': servicio.dias_para_vencimiento(),
-        })
 
-        excel_rows.append({
-            'Servicio': str(servicio),
-            'Proveedor': servicio.proveedor,
-            'Rubro': servicio.rubro.nombre if servicio.rubro else 'Sin Rubro',
-            'Frecuencia': servicio.get_frecuencia_display(),
-            'Costo Mensual ($)': costo_mensual,
-            'Costo Anual ($)': costo_anual,
-            'Costo Total Contrato ($)': costo_total if costo_total else 0,
-            'Estado': servicio.estado_actual,
-            'Fecha Inicio': servicio.fecha_inicio,
-            'Fecha Fin': servicio.fecha_fin,
-            'Días para Vencimiento': servicio.dias_para_vencimiento(),
-        })
+reporte_servicios_rubro = ServiciosRubroReporte.as_view()
 
-        costo_mensual_total += costo_mensual
-        costo_anual_total += costo_anual
-
-    # Agregar fila de totales
-    excel_rows.append({
-        'Servicio': 'TOTAL',
-        'Proveedor': '',
-        'Rubro': '',
-        'Frecuencia': '',
-        'Costo Mensual ($)': costo_mensual_total,
-        'Costo Anual ($)': costo_anual_total,
-        'Costo Total Contrato ($)': '',
-        'Estado': '',
-        'Fecha Inicio': '',
-        'Fecha Fin': '',
-        'Días para Vencimiento': '',
-    })
 
-    if request.GET.get('export') == 'excel':
-        df = pd.DataFrame(excel_rows)
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename=costos_servicios.xlsx'
-        df.to_excel(response, index=False)
-        return response
+class CostosServiciosReporte(Reporte):
+    """Costos mensual, anual y total del contrato de cada servicio.
 
-    if request.GET.get('export') == 'pdf':
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = 'attachment; filename=costos_servicios.pdf'
-        doc = SimpleDocTemplate(response, pagesize=letter)
-        elements = []
-        styles = getSampleStyleSheet()
-        elements.append(Paragraph('Costos Totales de Servicios', styles['Title']))
-        elements.append(Spacer(1, 12))
-
-        # Tabla de resumen
-        elements.append(Paragraph('Resumen de Costos', styles['Heading2']))
-        resumen_data = [
-            ['Total Servicios', len(servicios)],
-            ['Costo Mensual Total', f"${costo_mensual_total:.2f}"],
-            ['Costo Anual Total', f"${costo_anual_total:.2f}"],
-        ]
-        t_resumen = Table(resumen_data)
-        t_resumen.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.grey),
-            ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-            ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-            ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-            ('BOTTOMPADDING', (0,0), (-1,0), 8),
-            ('BACKGROUND', (0,1), (-1,-1), colors.beige),
-            ('GRID', (0,0), (-1,-1), 1, colors.black),
-        ]))
-        elements.append(t_resumen)
-        elements.append(Spacer(1, 24))
-
-        # Tabla detallada
-        elements.append(Paragraph('Detalle por Servicio', styles['Heading2']))
-        table_data = [["Servicio", "Proveedor", "Costo Mensual ($)", "Costo Anual ($)", "Estado"]]
-        for row in excel_rows[:-1]:  # Excluir la fila de totales
-            table_data.append([
-                row['Servicio'][:30] + '...' if len(row['Servicio']) > 30 else row['Servicio'],
-                row['Proveedor'][:20] + '...' if len(row['Proveedor']) > 20 else row['Proveedor'],
-                f"{row['Costo Mensual ($)']:.2f}",
-                f"{row['Costo Anual ($)']:.2f}",
-                row['Estado']
-            ])
-        t = Table(table_data, repeatRows=1)
-        t.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.grey),
-            ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-            ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-            ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-            ('BOTTOMPADDING', (0,0), (-1,0), 8),
-            ('BACKGROUND', (0,1), (-1,-1), colors.beige),
-            ('GRID', (0,0), (-1,-1), 1, colors.black),
-            ('FONTSIZE', (0,0), (-1,-1), 8),
-        ]))
-        elements.append(t)
-        doc.build(elements)
-        return response
-
-    return render(request, 'inventario/reporte_costos_servicios.html', {
-        'data': data,
-        'costo_mensual_total': costo_mensual_total,
-        'costo_anual_total': costo_anual_total,
-    })
+    El costo anual se calcula en la consulta; el del contrato depende de la frecuencia y
+    de las fechas (``Servicio.calcular_costo_total``) y se arma por fila. No se guarda en
+    la caché porque el estado y los días para el vencimiento cambian con la fecha.
+    """
+    titulo = 'Costos Totales de Servicios'
+    icono = 'fa-coins'
+    nombre_archivo = 'costos_servicios'
+    columnas = [
+        Columna('nombre', 'Servicio'),
+        Columna('proveedor', 'Proveedor'),
+        Columna('rubro__nombre', 'Rubro'),
+        Columna('frecuencia_display', 'Frecuencia'),
+        Columna('costo_mensual', 'Costo Mensual ($)', 'moneda', 'text-end'),
+        Columna('costo_anual', 'Costo Anual ($)', 'moneda', 'text-end'),
+        Columna('costo_total', 'Costo Total Contrato ($)', 'moneda', 'text-end'),
+        Columna('estado', 'Estado'),
+        Columna('fecha_inicio', 'Fecha Inicio', 'fecha'),
+        Columna('fecha_fin', 'Fecha Fin', 'fecha'),
+        Columna('dias_restantes', 'Días para Vencimiento'),
+    ]
+    totalizar = ('costo_mensual', 'costo_anual')
+    pdf_horizontal = True
+    pdf_tamanio_fuente = 7
+
+    def get_queryset(self):
+        return Servicio.objects.con_estado_vigente().con_dias_restantes().values(
+            'nombre', 'proveedor', 'rubro__nombre', 'frecuencia', 'costo_mensual',
+            'fecha_inicio', 'fecha_fin', 'estado_vigente', 'dias_restantes',
+        ).annotate(costo_anual=F('costo_mensual') * 12).order_by('nombre')
+
+    def preparar_fila(self, fila):
+        servicio = Servicio(
+            frecuencia=fila['frecuencia'], costo_mensual=fila['costo_mensual'],
+            fecha_inicio=fila['fecha_inicio'], fecha_fin=fila['fecha_fin'],
+        )
+        fila['costo_total'] = servicio.calcular_costo_total()
+        fila['rubro__nombre'] = fila['rubro__nombre'] or 'Sin Rubro'
+        fila['frecuencia_display'] = dict(Servicio.FRECUENCIA_CHOICES).get(fila['frecuencia'], fila['frecuencia'])
+        fila['estado'] = dict(Servicio.ESTADO_CHOICES).get(fila['estado_vigente'], fila['estado_vigente'])
+        return fila
 
-@login_required
-def reporte_servicios_pendientes(request):
-    """Reporte de pagos pendientes hasta la fecha actual, detallados por servicio y frecuencia"""
-    from .models import Servicio, ServicioPago
-    from django.db.models import Q
-    from datetime import date
-    import pandas as pd
-    from django.http import HttpResponse
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib import colors
-    from reportlab.lib.styles import getSampleStyleSheet
 
-    hoy = date.today()
-    
-    # Pagos pendientes hasta hoy
-    pagos_pendientes = ServicioPago.objects.filter(
-        estado='PENDIENTE',
-        fecha_vencimiento__lte=hoy
-    ).select_related('servicio').order_by('servicio__frecuencia', 'servicio__nombre', 'fecha_vencimiento')
-
-    # Agrupar pagos por servicio
-    pagos_por_servicio = {}
-    for pago in pagos_pendientes:
-        servicio_id = pago.servicio.id
-        if servicio_id not in pagos_por_servicio:
-            pagos_por_servicio[servicio_id] = {
-                'servicio': pago.servicio.nombre,
-                'proveedor': pago.servicio.proveedor,
-                'frecuencia': pago.servicio.frecuencia,
-                'frecuencia_display': dict(Servicio.FRECUENCIA_CHOICES).get(pago.servicio.frecuencia, pago.servicio.frecuencia),
-                'pagos': [],
-                'total_pagos': 0,
-                'monto_total': 0
-            }
-        monto = float(pago.servicio.costo_mensual)
-        pagos_por_servicio[servicio_id]['pagos'].append({
-            'id': pago.id,
-            'fecha_vencimiento': pago.fecha_vencimiento,
-            'monto': monto
-        })
-        pagos_por_servicio[servicio_id]['total_pagos'] += 1
-        pagos_por_servicio[servicio_id]['monto_total'] += monto
-
-    # Convertir a lista ordenada
-    data = list(pagos_por_servicio.values())
-    data.sort(key=lambda x: (x['frecuencia'], x['servicio']))
-
-    # Calcular totales
-    total_cantidad = sum(servicio['total_pagos'] for servicio in data)
-    total_monto = sum(servicio['monto_total'] for servicio in data)
-
-    # Para Excel y PDF, mantener la lista plana
-    excel_rows = []
-    for servicio in data:
-        for pago in servicio['pagos']:
-            excel_rows.append({
-                'Servicio': servicio['servicio'],
-                'Proveedor': servicio['proveedor'],
-                'Frecuencia': servicio['frecuencia_display'],
-                'Fecha Vencimiento': pago['fecha_vencimiento'].strftime('%d/%m/%Y'),
-                'Monto Mensual ($)': pago['monto'],
-            })
+reporte_costos_servicios = CostosServiciosReporte.as_view()
 
-    # Resumen por frecuencia
-    resumen_por_frecuencia = {}
-    for servicio in data:
-        freq = servicio['frecuencia']
-        if freq not in resumen_por_frecuencia:
-            resumen_por_frecuencia[freq] = {'cantidad': 0, 'monto': 0, 'display': servicio['frecuencia_display']}
-        resumen_por_frecuencia[freq]['cantidad'] += servicio['total_pagos']
-        resumen_por_frecuencia[freq]['monto'] += servicio['monto_total']
 
-    if request.GET.get('export') == 'excel':
-        df = pd.DataFrame(excel_rows)
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename=pagos_pendientes.xlsx'
-        df.to_excel(response, index=False)
-        return response
+class PagosPendientesReporte(Reporte):
+    """Pagos pendientes hasta la fecha actual, por frecuencia y servicio.
+
+    Cada fila tiene el botón para registrar el pago (vista ``realizar_pago``). No se
+    guarda en la caché: qué pagos ya vencieron depende de la fecha.
+    """
+    titulo = 'Pagos Pendientes por Servicio'
+    icono = 'fa-exclamation-triangle'
+    nombre_archivo = 'pagos_pendientes'
+    template_name = 'inventario/reporte_servicios_pendientes.html'
+    acciones = True
+    columnas = [
+        Columna('servicio__nombre', 'Servicio'),
+        Columna('servicio__proveedor', 'Proveedor'),
+        Columna('frecuencia', 'Frecuencia'),
+        Columna('fecha_vencimiento', 'Fecha Vencimiento', 'fecha'),
+        Columna('monto', 'Monto Mensual ($)', 'moneda', 'text-end'),
+    ]
+    totalizar = ('monto',)
+    titulo_resumen = 'Pendientes por frecuencia'
+    columnas_resumen = [
+        Columna('frecuencia', 'Frecuencia'),
+        Columna('cantidad', 'Pagos Pendientes', 'entero'),
+        Columna('monto', 'Total Mensual ($)', 'moneda'),
+    ]
+    pdf_tamanio_fuente = 8
+
+    def pendientes(self):
+        from datetime import date
+        return ServicioPago.objects.filter(estado='PENDIENTE', fecha_vencimiento__lte=date.today())
+
+    def get_queryset(self):
+        return self.pendientes().values(
+            'id', 'servicio__nombre', 'servicio__proveedor', 'servicio__frecuencia', 'fecha_vencimiento',
+            monto=F('servicio__costo_mensual'),
+        ).order_by('servicio__frecuencia', 'servicio__nombre', 'fecha_vencimiento')
+
+    def preparar_fila(self, fila):
+        fila['frecuencia'] = dict(Servicio.FRECUENCIA_CHOICES).get(fila['servicio__frecuencia'], fila['servicio__frecuencia'])
+        return fila
+
+    def resumen(self):
+        for fila in self.pendientes().values('servicio__frecuencia').annotate(
+            cantidad=Count('id'),
+            monto=Sum('servicio__costo_mensual'),
+        ).order_by('servicio__frecuencia'):
+            yield self.preparar_fila(fila)
+
+
+reporte_servicios_pendientes = PagosPendientesReporte.as_view()
 
-    if request.GET.get('export') == 'pdf':
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = 'attachment; filename=pagos_pendientes.pdf'
-        doc = SimpleDocTemplate(response, pagesize=letter)
-        elements = []
-        styles = getSampleStyleSheet()
-        elements.append(Paragraph('Pagos Pendientes por Servicio', styles['Title']))
-        elements.append(Spacer(1, 12))
-        table_data = [["Servicio", "Proveedor", "Frecuencia", "Fecha Vencimiento", "Monto Mensual ($)"]]
-        for row in excel_rows:
-            table_data.append([
-                row['Servicio'][:25] + '...' if len(row['Servicio']) > 25 else row['Servicio'],
-                row['Proveedor'][:20] + '...' if len(row['Proveedor']) > 20 else row['Proveedor'],
-                row['Frecuencia'],
-                row['Fecha Vencimiento'],
-                row['Monto Mensual ($)']
-            ])
-        table_data.append(["Total", "", "", "", f"${total_monto:.2f}"])
-        t = Table(table_data)
-        t.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 8),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ]))
-        elements.append(t)
-        doc.build(elements)
-        return response
-
-    return render(request, 'inventario/reporte_servicios_pendientes.html', {
-        'data': data,
-        'resumen_por_frecuencia': resumen_por_frecuencia,
-        'total_cantidad': total_cantidad,
-        'total_monto': total_monto,
-    })
 
 @login_required
 def realizar_pago(request, pago_id):
@@ -2799,6 +2410,19 @@ from .import_export import importar_bienes_excel, exportar_bienes_excel
 def importar_bienes(request):
     return render(request, 'inventario/importar_bienes.html')
 
-@login_required  
+def metricas_prometheus(request):
+    """Histogramas de ``inventario.metricas`` en formato Prometheus (staff o token)"""
+    import hmac
+    from django.conf import settings
+    from . import metricas
+
+    token = getattr(settings, 'REQUEST_METRICS_TOKEN', '')
+    autorizado = request.user.is_authenticated and request.user.is_staff
+    if token and not autorizado:
+        autorizado = hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not autorizado:
+        return HttpResponse('No autorizado', status=403, content_type='text/plain')
+    return HttpResponse(metricas.exposicion(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 def ratelimit_view(request, exception):
     return render(request, 'inventario/ratelimit.html', status=429)
@@ -37,6 +37,7 @@ INSTALLED_APPS = [
 ] + REST_APPS + RATELIMIT_APPS
 
 MIDDLEWARE = [
+    'inventario.middleware.metricas.MetricasMiddleware',  # Sólo con REQUEST_METRICS_ENABLED
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -161,3 +162,27 @@ REST_FRAMEWORK = {
 # Rate limiting configuration
 RATELIMIT_ENABLE = not DEBUG  # Disable in development
 RATELIMIT_VIEW = 'inventario.views.ratelimit_view'
+
+# Reportes en segundo plano (comando run_report_worker)
+REPORT_JOBS_DIR = Path(os.environ.get('REPORT_JOBS_DIR', BASE_DIR / 'reportes_generados'))
+REPORT_JOBS_TTL_HOURS = 24
+REPORT_JOBS_ROW_THRESHOLD = 5000
+# Minutos tras los que un reporte que sigue PROCESANDO se da por interrumpido
+REPORT_JOBS_TIMEOUT_MINUTES = 120
+
+# Caché en disco de los remitos en PDF (ver inventario/remitos_pdf.py)
+REMITOS_PDF_DIR = Path(os.environ.get('REMITOS_PDF_DIR', BASE_DIR / 'remitos_pdf'))
+# Procesos para generar remitos en lote (0: uno por núcleo)
+REMITOS_PDF_PROCESOS = int(os.environ.get('REMITOS_PDF_PROCESOS', 0))
+
+# Métricas por request (inventario/metricas.py): log estructurado, Server-Timing para staff y /metrics
+REQUEST_METRICS_ENABLED = os.environ.get('REQUEST_METRICS_ENABLED', 'true' if DEBUG else 'false').lower() == 'true'
+REQUEST_METRICS_SLOW_QUERIES = 5
+# Token para que Prometheus lea /metrics sin sesión (Authorization: Bearer <token>)
+REQUEST_METRICS_TOKEN = os.environ.get('REQUEST_METRICS_TOKEN', '')
+
+# TTL en segundos por sección de /api/analytics/ (por defecto, los de inventario/analytics.py)
+ANALYTICS_CACHE_TTL = {}
+
+# Umbral de stock bajo del dashboard para los bienes y rubros sin stock mínimo propio
+STOCK_BAJO_UMBRAL = int(os.environ.get('STOCK_BAJO_UMBRAL', 10))